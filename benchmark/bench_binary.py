@@ -0,0 +1,55 @@
+"""
+Compares the compact binary format with JSON on wire size and on encoding and
+decoding throughput for representative generated types.
+
+    $ python benchmark/bench_binary.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import common
+
+
+def main():
+    types = common.generate_modules()
+    files = types.files
+    ss = types.stone_serializers
+    bv = types.stone_validators
+
+    cases = [
+        ('FileMetadata', bv.StructTree(files.Metadata),
+         common.make_file(files, 1), 20000),
+        ('FileMetadata (4 KB thumbnail)', bv.StructTree(files.Metadata),
+         common.make_file(files, 1, thumbnail_size=4096), 5000),
+        ('ListFolderResult (100)', bv.Struct(files.ListFolderResult),
+         common.make_list_folder_result(files, 100), 200),
+        ('ListFolderResult (10000)', bv.Struct(files.ListFolderResult),
+         common.make_list_folder_result(files, 10000), 2),
+    ]
+    print('JSON backend: %s' % ss.get_json_backend().name)
+    print()
+    common.print_row('', 'json', 'binary')
+    for label, data_type, obj, number in cases:
+        serialized_json = ss.json_encode(data_type, obj)
+        serialized_binary = ss.binary_encode(data_type, obj)
+        common.print_row(
+            'size %s' % label,
+            '%d B' % len(serialized_json.encode('utf-8')),
+            '%d B' % len(serialized_binary))
+        common.print_row(
+            'encode %s' % label,
+            common.format_time(common.best_time(
+                lambda: ss.json_encode(data_type, obj), number)),
+            common.format_time(common.best_time(
+                lambda: ss.binary_encode(data_type, obj), number)))
+        common.print_row(
+            'decode %s' % label,
+            common.format_time(common.best_time(
+                lambda: ss.json_decode(data_type, serialized_json), number)),
+            common.format_time(common.best_time(
+                lambda: ss.binary_decode(data_type, serialized_binary),
+                number)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Compares decoding a few fields of a long list of records into columns with
+decoding the whole list into instances, as an analytics job that sums file
+sizes would.
+
+    $ python benchmark/bench_columns.py [records]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+
+import common
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    types = common.generate_modules()
+    files = types.files
+    ss = types.stone_serializers
+    bv = types.stone_validators
+    data_type = bv.List(bv.Struct(files.FileMetadata))
+    obj = ss.json_compat_obj_encode(
+        data_type, [common.make_file(files, i) for i in range(records)])
+
+    def decode_instances():
+        return sum(f.size for f in ss.json_compat_obj_decode(data_type, obj))
+
+    def decode_columns(field_names):
+        def decode():
+            columns = ss.json_compat_obj_decode_columns(
+                data_type, obj, field_names)
+            return sum(columns['size'].values)
+        return decode
+
+    print('%d FileMetadata records' % records)
+    print()
+    common.print_row('', 'time')
+    for label, decode in [
+            ('instances', decode_instances),
+            ('columns: size', decode_columns(['size'])),
+            ('columns: size, name', decode_columns(['size', 'name'])),
+            ('columns: size, name, client_modified',
+             decode_columns(['size', 'name', 'client_modified']))]:
+        common.print_row(label, common.format_time(common.best_time(decode, 5)))
+
+
+if __name__ == '__main__':
+    main()
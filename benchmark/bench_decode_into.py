@@ -0,0 +1,71 @@
+"""
+Compares decoding a stream of records into new instances with decoding into
+an existing instance and into instances from a StructPool. Along with
+throughput, it reports the garbage collections that decoding triggered,
+as a measure of allocation pressure.
+
+    $ python benchmark/bench_decode_into.py [records]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import gc
+import sys
+import time
+
+import common
+
+
+def run(decode_all, repeat=5):
+    """
+    Returns the best time decode_all() took out of repeat runs, and the
+    number of young-generation garbage collections during a run.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        collections = gc.get_stats()[0]['collections']
+        start = time.time()
+        decode_all()
+        times.append(time.time() - start)
+    return min(times), gc.get_stats()[0]['collections'] - collections
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    types = common.generate_modules()
+    files = types.files
+    ss = types.stone_serializers
+    bv = types.stone_validators
+    data_type = bv.Struct(files.FileMetadata)
+    # Records are decoded from JSON-compatible objects, so that parsing JSON
+    # doesn't dominate.
+    objs = [ss.json_compat_obj_encode(data_type, common.make_file(files, i))
+            for i in range(100)]
+
+    def decode_new():
+        for i in range(records):
+            ss.json_compat_obj_decode(data_type, objs[i % 100])
+
+    def decode_into():
+        ins = files.FileMetadata()
+        for i in range(records):
+            ss.json_compat_obj_decode_into(data_type, objs[i % 100], ins)
+
+    def decode_pooled():
+        pool = ss.StructPool(data_type)
+        for i in range(records):
+            pool.release(pool.decode(objs[i % 100]))
+
+    print('%d FileMetadata records' % records)
+    print()
+    common.print_row('', 'records/s', 'gen0 GCs')
+    for label, decode_all in [('new instances', decode_new),
+                              ('decode into one instance', decode_into),
+                              ('StructPool', decode_pooled)]:
+        elapsed, collections = run(decode_all)
+        common.print_row(label, '%d' % (records / elapsed), collections)
+
+
+if __name__ == '__main__':
+    main()
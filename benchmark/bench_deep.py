@@ -0,0 +1,100 @@
+"""
+Compares recursive encoding and decoding of values of a recursive type with
+encoding and decoding them off an explicit stack (iterative=True):
+
+* Chains of nodes of increasing depth, up to beyond the recursion limit.
+* A wide, shallow tree with as many nodes as the deepest chain, to show the
+  overhead of the explicit stack where recursion isn't a problem.
+
+    $ python benchmark/bench_deep.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import common
+
+DEPTHS = [10, 100, 300, 1000, 10000]
+
+deep_spec = """\
+namespace deep
+
+struct TreeNode
+    name String
+    size UInt64
+    children List(TreeNode)
+    op Op?
+
+union Op
+    leaf
+    neg TreeNode
+"""
+
+
+def make_chain(deep, depth):
+    """
+    Returns a TreeNode that nests depth others, alternately as a child and
+    through a union.
+    """
+    node = deep.TreeNode(name='leaf', size=0, children=[])
+    for i in range(depth):
+        if i % 2:
+            node = deep.TreeNode(name='n%d' % i, size=i, children=[node])
+        else:
+            node = deep.TreeNode(name='n%d' % i, size=i, children=[],
+                                 op=deep.Op.neg(node))
+    return node
+
+
+def make_wide(deep, nodes, fanout=10):
+    """
+    Returns a TreeNode with about the given number of nodes, each with up to
+    fanout children.
+    """
+    level = [deep.TreeNode(name='leaf', size=0, children=[])
+             for _ in range(nodes)]
+    while len(level) > 1:
+        level = [deep.TreeNode(name='n', size=i, children=level[i:i + fanout])
+                 for i in range(0, len(level), fanout)]
+    return level[0]
+
+
+def time_or_error(func, number):
+    try:
+        return common.format_time(common.best_time(func, number))
+    except RuntimeError:
+        # RecursionError is a RuntimeError, and Python 2 raises one.
+        return 'too deep'
+
+
+def main():
+    types = common.generate_modules(spec=deep_spec, package='deep_types')
+    deep = types.deep
+    ss = types.stone_serializers
+    bv = types.stone_validators
+    data_type = bv.Struct(deep.TreeNode)
+    # Each case is (label, node, number of nodes).
+    cases = [('chain, depth %d' % depth, make_chain(deep, depth), depth)
+             for depth in DEPTHS]
+    cases.append(('wide, %d nodes' % DEPTHS[-1], make_wide(deep, DEPTHS[-1]),
+                  DEPTHS[-1]))
+
+    common.print_row('', 'encode', 'encode iter', 'decode', 'decode iter')
+    for label, node, nodes in cases:
+        encoded = ss.json_compat_obj_encode(data_type, node, iterative=True)
+        number = max(1, 10000 // nodes)
+        common.print_row(
+            label,
+            time_or_error(
+                lambda: ss.json_compat_obj_encode(data_type, node), number),
+            time_or_error(
+                lambda: ss.json_compat_obj_encode(
+                    data_type, node, iterative=True), number),
+            time_or_error(
+                lambda: ss.json_compat_obj_decode(data_type, encoded), number),
+            time_or_error(
+                lambda: ss.json_compat_obj_decode(
+                    data_type, encoded, iterative=True), number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Compares encoding and decoding a ListFolderResult in full with encoding and
+decoding only the names and sizes of its entries through a field mask, as a
+client that lists files or a proxy that forwards a subset would.
+
+    $ python benchmark/bench_field_masks.py [entries]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+
+import common
+
+FIELD_MASK = ['entries.name', 'entries.size', 'cursor', 'has_more']
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    types = common.generate_modules()
+    files = types.files
+    ss = types.stone_serializers
+    bv = types.stone_validators
+    data_type = bv.Struct(files.ListFolderResult)
+    result = common.make_list_folder_result(files, entries)
+    obj = ss.json_compat_obj_encode(data_type, result)
+
+    print('ListFolderResult with %d entries, mask %s' %
+          (entries, ', '.join(FIELD_MASK)))
+    print()
+    common.print_row('', 'encode', 'decode')
+    for label, field_mask in [('full', None), ('masked', FIELD_MASK)]:
+        encode = common.best_time(
+            lambda: ss.json_compat_obj_encode(
+                data_type, result, field_mask=field_mask), 20)
+        decode = common.best_time(
+            lambda: ss.json_compat_obj_decode(
+                data_type, obj, field_mask=field_mask), 20)
+        common.print_row(label, common.format_time(encode),
+                         common.format_time(decode))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Compares creating structs from database-style rows with the constructor, one
+row at a time, and with the from_rows() class method, with and without
+validation.
+
+    $ python benchmark/bench_from_rows.py [rows]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import datetime
+import sys
+
+import common
+
+FIELD_NAMES = ['name', 'path_lower', 'id', 'client_modified',
+               'server_modified', 'rev', 'size', 'content_hash']
+
+
+def make_row(i):
+    modified = datetime.datetime(2016, 1, 1) + datetime.timedelta(seconds=i)
+    return ('report-%d.txt' % i,
+            '/documents/reports/report-%d.txt' % i,
+            'id:a4ayc_80_OEAAAAAAAAA%04d' % (i % 10000),
+            modified,
+            modified,
+            '%09x' % (i + 0x100000000),
+            1024 * i,
+            '%064x' % i if i % 3 else None)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    types = common.generate_modules(['--compact-slots'])
+    files = types.files
+    rows = [make_row(i) for i in range(count)]
+
+    def construct():
+        return [files.FileMetadata(**dict(zip(FIELD_NAMES, row)))
+                for row in rows]
+
+    print('%d FileMetadata rows of %d fields' % (count, len(FIELD_NAMES)))
+    print()
+    common.print_row('', 'time')
+    for label, func in [
+            ('constructor', construct),
+            ('from_rows', lambda: files.FileMetadata.from_rows(
+                FIELD_NAMES, rows)),
+            ('from_rows, validate=False', lambda: files.FileMetadata.from_rows(
+                FIELD_NAMES, rows, validate=False))]:
+        common.print_row(label, common.format_time(common.best_time(func, 1)))
+
+
+if __name__ == '__main__':
+    main()
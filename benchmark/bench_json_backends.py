@@ -0,0 +1,49 @@
+"""
+Compares the JSON backends that are registered with stone_serializers on
+encoding and decoding representative generated types.
+
+    $ python benchmark/bench_json_backends.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import common
+
+
+def main():
+    types = common.generate_modules()
+    files = types.files
+    ss = types.stone_serializers
+    bv = types.stone_validators
+
+    cases = [
+        ('FileMetadata', bv.StructTree(files.Metadata),
+         common.make_file(files, 1), 20000),
+        ('ListFolderResult (100)', bv.Struct(files.ListFolderResult),
+         common.make_list_folder_result(files, 100), 200),
+        ('ListFolderResult (10000)', bv.Struct(files.ListFolderResult),
+         common.make_list_folder_result(files, 10000), 2),
+    ]
+    backends = list(ss._json_backends)
+    print('Default backend: %s' % ss.get_json_backend().name)
+    print()
+    common.print_row('', *backends)
+    for label, data_type, obj, number in cases:
+        encode_times = []
+        decode_times = []
+        for backend in backends:
+            serialized = ss.json_encode(data_type, obj, backend=backend)
+            encode_times.append(common.best_time(
+                lambda: ss.json_encode(data_type, obj, backend=backend),
+                number))
+            decode_times.append(common.best_time(
+                lambda: ss.json_decode(data_type, serialized, backend=backend),
+                number))
+        common.print_row('encode %s' % label,
+                         *map(common.format_time, encode_times))
+        common.print_row('decode %s' % label,
+                         *map(common.format_time, decode_times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Measures encoding structs whose list fields were assigned through their
+property setters, which validate them, and after the lists were modified
+in place, which makes the encoder validate them again.
+
+    $ python benchmark/bench_lists.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import common
+
+
+def main():
+    types = common.generate_modules()
+    files = types.files
+    ss = types.stone_serializers
+    bv = types.stone_validators
+    data_type = bv.Struct(files.ListFolderResult)
+    result = common.make_list_folder_result(files, 1000)
+    file_metadata = common.make_file(files, 1)
+    fields = [files.PropertyField(name='tag%d' % i, value='value')
+              for i in range(100)]
+
+    def touch_entries():
+        result.entries.append(result.entries.pop())
+
+    def touch_fields():
+        file_metadata.property_fields.append(
+            file_metadata.property_fields.pop())
+
+    file_metadata.property_fields = fields
+    # Lists assigned to fields are validated the same way.
+    path_list = bv.List(files.Path_validator)
+    paths = path_list.validate(
+        ['/documents/reports/report-%d.txt' % i for i in range(1000)])
+
+    def touch_paths():
+        paths.append(paths.pop())
+
+    cases = [
+        ('List(Path) (1000)', path_list, paths, touch_paths, 200),
+        ('ListFolderResult (1000)', data_type, result, touch_entries, 50),
+        ('FileMetadata (100 properties)', bv.Struct(files.FileMetadata),
+         file_metadata, touch_fields, 500),
+    ]
+    common.print_row('', 'unchanged', 'modified')
+    for label, case_data_type, obj, touch, number in cases:
+        unchanged = common.best_time(
+            lambda: ss.json_compat_obj_encode(case_data_type, obj), number,
+            repeat=10)
+
+        def encode_modified():
+            touch()
+            ss.json_compat_obj_encode(case_data_type, obj)
+        modified = common.best_time(encode_modified, number, repeat=10)
+        common.print_row('encode %s' % label, common.format_time(unchanged),
+                         common.format_time(modified))
+
+
+if __name__ == '__main__':
+    main()
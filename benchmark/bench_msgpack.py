@@ -0,0 +1,61 @@
+"""
+Compares msgpack with JSON on encoding and decoding throughput for
+representative generated types, and decoding msgpack from bytes with
+decoding it from a memoryview, which doesn't copy bytes values.
+
+    $ python benchmark/bench_msgpack.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import common
+
+
+def main():
+    types = common.generate_modules()
+    files = types.files
+    ss = types.stone_serializers
+    bv = types.stone_validators
+    if not hasattr(ss, 'msgpack_encode'):
+        raise SystemExit('msgpack is not installed.')
+
+    cases = [
+        ('FileMetadata', bv.StructTree(files.Metadata),
+         common.make_file(files, 1), 20000),
+        ('FileMetadata (1 MB thumbnail)', bv.StructTree(files.Metadata),
+         common.make_file(files, 1, thumbnail_size=1 << 20), 100),
+        ('ListFolderResult (100)', bv.Struct(files.ListFolderResult),
+         common.make_list_folder_result(files, 100), 200),
+        ('ListFolderResult (10000)', bv.Struct(files.ListFolderResult),
+         common.make_list_folder_result(files, 10000), 2),
+    ]
+    print('JSON backend: %s' % ss.get_json_backend().name)
+    print()
+    common.print_row('', 'json', 'msgpack', 'memoryview')
+    for label, data_type, obj, number in cases:
+        serialized_json = ss.json_encode(data_type, obj)
+        serialized_msgpack = ss.msgpack_encode(data_type, obj)
+        view = memoryview(serialized_msgpack)
+        common.print_row(
+            'size %s' % label,
+            '%d B' % len(serialized_json.encode('utf-8')),
+            '%d B' % len(serialized_msgpack))
+        common.print_row(
+            'encode %s' % label,
+            common.format_time(common.best_time(
+                lambda: ss.json_encode(data_type, obj), number)),
+            common.format_time(common.best_time(
+                lambda: ss.msgpack_encode(data_type, obj), number)))
+        common.print_row(
+            'decode %s' % label,
+            common.format_time(common.best_time(
+                lambda: ss.json_decode(data_type, serialized_json), number)),
+            common.format_time(common.best_time(
+                lambda: ss.msgpack_decode(data_type, serialized_msgpack),
+                number)),
+            common.format_time(common.best_time(
+                lambda: ss.msgpack_decode(data_type, view), number)))
+
+
+if __name__ == '__main__':
+    main()
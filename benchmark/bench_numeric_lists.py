@@ -0,0 +1,45 @@
+"""
+Measures validating, decoding and encoding large lists of numbers, such as
+the samples of a telemetry payload.
+
+    $ python benchmark/bench_numeric_lists.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import random
+
+import common
+
+ITEMS = 100000
+
+
+def main():
+    types = common.generate_modules()
+    ss = types.stone_serializers
+    bv = types.stone_validators
+    rng = random.Random(0)
+    cases = [
+        ('List(Int64)', bv.List(bv.Int64()),
+         [rng.randint(-2**40, 2**40) for _ in range(ITEMS)]),
+        ('List(UInt32)', bv.List(bv.UInt32()),
+         [rng.randint(0, 2**32 - 1) for _ in range(ITEMS)]),
+        ('List(Float64)', bv.List(bv.Float64()),
+         [rng.uniform(-1e6, 1e6) for _ in range(ITEMS)]),
+    ]
+    print('%d items' % ITEMS)
+    print()
+    common.print_row('', 'validate', 'decode', 'encode')
+    for label, data_type, items in cases:
+        validate = common.best_time(lambda: data_type.validate(items), 10)
+        decode = common.best_time(
+            lambda: ss.json_compat_obj_decode(data_type, items), 10)
+        encode = common.best_time(
+            lambda: ss.json_compat_obj_encode(data_type, items), 10)
+        common.print_row(label, common.format_time(validate),
+                         common.format_time(decode),
+                         common.format_time(encode))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Measures the memory used by instances of generated classes, mostly structs:
+
+* A struct with 30 fields in the default slot layout, which has a value slot
+  and a presence flag slot per field, and in the layout that --compact-slots
+  generates, with one slot per field. Half of the fields are set, to values
+  shared by all instances, so that only the instances themselves are
+  measured.
+* A union with only void tags, such as a permission level, which has no value
+  slot, and a union with a tag that has a value.
+
+    $ python benchmark/bench_struct_memory.py [instances]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import gc
+import sys
+import time
+import tracemalloc
+
+import common
+
+FIELDS = 30
+
+memory_spec = """\
+namespace memory
+
+union AccessLevel
+    owner
+    editor
+    viewer
+
+union SharedLinkPolicy
+    anyone
+    team_only
+    password String
+""" + '\nstruct WideStruct\n' + ''.join(
+    '    f%d String?\n' % i for i in range(FIELDS))
+
+
+def measure(make, instances):
+    """
+    Returns the number of bytes allocated by calling make() for each
+    instance, and the time that took.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    objs = [make() for _ in range(instances)]
+    elapsed = time.time() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objs
+    return size, elapsed
+
+
+def main():
+    instances = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    default = common.generate_modules(
+        spec=memory_spec, package='memory_default').memory
+    compact = common.generate_modules(
+        ['--compact-slots'], spec=memory_spec,
+        package='memory_compact').memory
+    values = dict(('f%d' % i, 'value') for i in range(0, FIELDS, 2))
+    cases = [
+        ('struct (%d fields)' % FIELDS,
+         lambda: default.WideStruct(**values)),
+        ('struct, compact slots', lambda: compact.WideStruct(**values)),
+        ('union, void tags only', lambda: default.AccessLevel('editor')),
+        ('union, with values',
+         lambda: default.SharedLinkPolicy('team_only')),
+    ]
+    print('%d instances' % instances)
+    print()
+    common.print_row('', 'memory', 'per instance', 'create')
+    for label, make in cases:
+        size, elapsed = measure(make, instances)
+        common.print_row(label, '%.1f MB' % (size / 1e6),
+                         '%d B' % (size // instances),
+                         common.format_time(elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Compares encoding and decoding representative generated types, whose file
+entries have two timestamps each, with the compiled timestamp codecs and with
+plain strptime() and strftime().
+
+    $ python benchmark/bench_timestamps.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import common
+
+
+def main():
+    types = common.generate_modules()
+    files = types.files
+    ss = types.stone_serializers
+    bv = types.stone_validators
+
+    cases = [
+        ('FileMetadata', bv.StructTree(files.Metadata),
+         common.make_file(files, 1), 20000),
+        ('ListFolderResult (100)', bv.Struct(files.ListFolderResult),
+         common.make_list_folder_result(files, 100), 200),
+        ('ListFolderResult (10000)', bv.Struct(files.ListFolderResult),
+         common.make_list_folder_result(files, 10000), 2),
+    ]
+
+    def time_cases():
+        times = []
+        for _, data_type, obj, number in cases:
+            serialized = ss.json_encode(data_type, obj)
+            times.append((
+                common.best_time(
+                    lambda: ss.json_encode(data_type, obj), number),
+                common.best_time(
+                    lambda: ss.json_decode(data_type, serialized), number)))
+        return times
+
+    compiled = time_cases()
+
+    # Compile the plans again with codecs that call strptime() and
+    # strftime().
+    def get_strptime_codec(fmt):
+        return (lambda val: ss.datetime.datetime.strptime(val, fmt),
+                lambda val: val.strftime(fmt))
+    get_timestamp_codec = ss._get_timestamp_codec
+    ss._get_timestamp_codec = get_strptime_codec
+    ss._encoder_plans.clear()
+    ss._decoder_plans.clear()
+    try:
+        strptime = time_cases()
+    finally:
+        ss._get_timestamp_codec = get_timestamp_codec
+        ss._encoder_plans.clear()
+        ss._decoder_plans.clear()
+
+    print('JSON backend: %s' % ss.get_json_backend().name)
+    print()
+    common.print_row('', 'strptime', 'compiled', 'speedup')
+    for (label, _, _, _), before, after in zip(cases, strptime, compiled):
+        for i, operation in enumerate(('encode', 'decode')):
+            common.print_row(
+                '%s %s' % (operation, label), common.format_time(before[i]),
+                common.format_time(after[i]),
+                '%.2fx' % (before[i] / after[i]))
+
+
+if __name__ == '__main__':
+    main()
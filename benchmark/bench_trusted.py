@@ -0,0 +1,51 @@
+"""
+Compares decoding representative generated types with full validation and in
+trusted mode, which skips constraints such as string patterns and integer
+ranges.
+
+    $ python benchmark/bench_trusted.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import common
+
+
+def main():
+    types = common.generate_modules()
+    files = types.files
+    ss = types.stone_serializers
+    bv = types.stone_validators
+
+    cases = [
+        ('FileMetadata', bv.StructTree(files.Metadata),
+         common.make_file(files, 1), 20000),
+        ('ListFolderResult (100)', bv.Struct(files.ListFolderResult),
+         common.make_list_folder_result(files, 100), 200),
+        ('ListFolderResult (10000)', bv.Struct(files.ListFolderResult),
+         common.make_list_folder_result(files, 10000), 2),
+    ]
+    print('JSON backend: %s' % ss.get_json_backend().name)
+    print()
+    common.print_row('', 'validated', 'trusted', '1% sampled')
+    for label, data_type, obj, number in cases:
+        serialized = ss.json_encode(data_type, obj)
+        validated = common.best_time(
+            lambda: ss.json_decode(data_type, serialized), number)
+        trusted = common.best_time(
+            lambda: ss.json_decode(data_type, serialized, trusted=True),
+            number)
+        ss.set_trusted_sample_rate(0.01)
+        try:
+            sampled = common.best_time(
+                lambda: ss.json_decode(data_type, serialized, trusted=True),
+                number)
+        finally:
+            ss.set_trusted_sample_rate(0)
+        common.print_row('decode %s' % label, common.format_time(validated),
+                         common.format_time(trusted),
+                         common.format_time(sampled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Measures decoding a list of unions that are mostly void tags, such as the
+permissions or error codes of a large listing, with and without the JSON
+codecs generated by --json-codecs. Memory is that retained by the decoded
+list.
+
+    $ python benchmark/bench_unions.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import gc
+import json
+import tracemalloc
+
+import common
+
+ITEMS = 10000
+
+
+def retained(func):
+    """
+    Returns the number of bytes allocated by func() that are still in use
+    after it returns.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    tags = ['not_found', 'not_file', 'not_folder', 'restricted_content',
+            'malformed_path']
+    symbols = json.dumps([tags[i % len(tags)] for i in range(ITEMS)])
+    objects = json.dumps([{'.tag': tags[i % len(tags)]}
+                          for i in range(ITEMS)])
+    print('%d unions' % ITEMS)
+    print()
+    common.print_row('', 'decode', 'retained')
+    for label, generator_args in [('', []), (', JSON codecs', ['--json-codecs'])]:
+        types = common.generate_modules(
+            generator_args, package='union_types%d' % len(generator_args))
+        ss = types.stone_serializers
+        bv = types.stone_validators
+        data_type = bv.List(bv.Union(types.files.LookupError))
+        for form, serialized in [('symbols', symbols), ('objects', objects)]:
+            def decode():
+                return ss.json_decode(data_type, serialized)
+            elapsed = common.best_time(decode, 20, repeat=10)
+            size = retained(decode)
+            common.print_row('decode %s%s' % (form, label),
+                             common.format_time(elapsed),
+                             '%.1f KB' % (size / 1e3))
+
+
+if __name__ == '__main__':
+    main()
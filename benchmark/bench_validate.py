@@ -0,0 +1,36 @@
+"""
+Compares decoding a ListFolderResult with checking it with json_validate(),
+which runs the same checks without creating the objects, as a service that
+only accepts or rejects payloads would.
+
+    $ python benchmark/bench_validate.py [entries]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+
+import common
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    types = common.generate_modules()
+    files = types.files
+    ss = types.stone_serializers
+    bv = types.stone_validators
+    data_type = bv.Struct(files.ListFolderResult)
+    result = common.make_list_folder_result(files, entries)
+    serialized = ss.json_encode(data_type, result)
+
+    print('ListFolderResult with %d entries' % entries)
+    print()
+    common.print_row('', 'time')
+    for label, func in [('json_decode', ss.json_decode),
+                        ('json_validate', ss.json_validate)]:
+        common.print_row(label, common.format_time(common.best_time(
+            lambda: func(data_type, serialized), 20)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Shared helpers for the serialization benchmarks.
+
+The benchmarks generate Python modules for a spec that resembles a typical
+API: a file listing with nested metadata, a union of metadata types, and an
+error union. Run them from the root of the repository, for example:
+
+    $ python benchmark/bench_json_backends.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import atexit
+import datetime
+import gc
+import importlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+benchmark_spec = """\
+namespace files
+
+alias Path = String(pattern="/(.|[\\\\r\\\\n])*")
+
+struct SharingInfo
+    read_only Boolean
+    parent_shared_folder_id String?
+    modified_by String?
+
+struct PropertyField
+    name String
+    value String
+
+struct Metadata
+    union
+        file FileMetadata
+        folder FolderMetadata
+    name String
+    path_lower Path?
+    path_display Path?
+
+struct FileMetadata extends Metadata
+    id String(min_length=1)
+    client_modified Timestamp("%Y-%m-%dT%H:%M:%SZ")
+    server_modified Timestamp("%Y-%m-%dT%H:%M:%SZ")
+    rev String(min_length=9, pattern="[0-9a-f]+")
+    size UInt64
+    sharing_info SharingInfo?
+    property_fields List(PropertyField)?
+    content_hash String?
+    thumbnail Bytes?
+
+struct FolderMetadata extends Metadata
+    id String(min_length=1)
+    sharing_info SharingInfo?
+
+struct ListFolderResult
+    entries List(Metadata)
+    cursor String
+    has_more Boolean
+
+union LookupError
+    malformed_path String?
+    not_found
+    not_file
+    not_folder
+    restricted_content
+
+union ListFolderError
+    path LookupError
+"""
+
+
+def generate_modules(generator_args=(), spec=benchmark_spec,
+                     package='benchmark_types'):
+    """
+    Generates the Python modules for spec, which defaults to benchmark_spec,
+    as a package in a temporary directory, and returns the package with its
+    namespace modules and its stone_serializers and stone_validators modules
+    imported. generator_args are passed to the Python types generator.
+    """
+    output = tempfile.mkdtemp(prefix='stone-benchmark-')
+    atexit.register(shutil.rmtree, output, True)
+    package_dir = os.path.join(output, package)
+    p = subprocess.Popen(
+        [sys.executable, '-m', 'stone.cli', 'python_types', package_dir, '-',
+         '--'] + list(generator_args),
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    _, stderr = p.communicate(input=spec.encode('utf-8'))
+    if p.wait() != 0:
+        raise AssertionError('Could not execute stone tool: %s' %
+                             stderr.decode('utf-8'))
+    open(os.path.join(package_dir, '__init__.py'), 'w').close()
+    sys.path.insert(0, output)
+    for name in os.listdir(package_dir):
+        if name.endswith('.py') and name != '__init__.py':
+            importlib.import_module('%s.%s' % (package, name[:-3]))
+    return sys.modules[package]
+
+
+def make_file(files, i, thumbnail_size=0):
+    """
+    Returns a representative FileMetadata. It has a thumbnail with
+    thumbnail_size bytes if thumbnail_size isn't zero.
+    """
+    modified = datetime.datetime(2016, 1, 1) + datetime.timedelta(seconds=i)
+    return files.FileMetadata(
+        name='report-%d.txt' % i,
+        path_lower='/documents/reports/report-%d.txt' % i,
+        path_display='/Documents/Reports/report-%d.txt' % i,
+        id='id:a4ayc_80_OEAAAAAAAAA%04d' % (i % 10000),
+        client_modified=modified,
+        server_modified=modified,
+        rev='%09x' % (i + 0x100000000),
+        size=1024 * i,
+        sharing_info=files.SharingInfo(
+            read_only=bool(i % 2),
+            parent_shared_folder_id='84528192421',
+            modified_by='dbid:AAH4f99T0taONIb-OurWxbNQ6ywGRopQngc'),
+        property_fields=[
+            files.PropertyField(name='owner', value='user%d' % (i % 7)),
+            files.PropertyField(name='status', value='final'),
+        ],
+        content_hash='%064x' % i,
+        thumbnail=b'\x89PNG' * (thumbnail_size // 4) if thumbnail_size else None)
+
+
+def make_folder(files, i):
+    """
+    Returns a representative FolderMetadata.
+    """
+    return files.FolderMetadata(
+        name='folder-%d' % i,
+        path_lower='/documents/folder-%d' % i,
+        path_display='/Documents/Folder-%d' % i,
+        id='id:a4ayc_80_OEAAAAAAAAB%04d' % (i % 10000),
+        sharing_info=files.SharingInfo(read_only=False))
+
+
+def make_list_folder_result(files, entries):
+    """
+    Returns a ListFolderResult with the given number of entries, one in ten
+    of which is a folder.
+    """
+    return files.ListFolderResult(
+        entries=[make_folder(files, i) if i % 10 == 0 else make_file(files, i)
+                 for i in range(entries)],
+        cursor='ZtkX9_EHj3x7PMkVuFIhwKYXEpwpLwyxp9vMKomUhllil9q7eWiAu',
+        has_more=False)
+
+
+def best_time(func, number, repeat=5):
+    """
+    Returns the best time per call in seconds of calling func number times,
+    out of repeat runs. Garbage collection stays enabled, since the
+    benchmarks allocate.
+    """
+    timer = timeit.Timer(func, setup=gc.enable)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def print_row(label, *columns):
+    print('%-36s' % label + ''.join('%14s' % c for c in columns))
+
+
+def format_time(seconds):
+    if seconds >= 1:
+        return '%.2f s' % seconds
+    elif seconds >= 1e-3:
+        return '%.2f ms' % (seconds * 1e3)
+    else:
+        return '%.2f us' % (seconds * 1e6)
@@ -16,11 +16,114 @@ except (SystemError, ValueError):
     import stone_validators as bv
 
 
+class _Absent(object):
+    """Type of ABSENT."""
+
+    __slots__ = []
+
+    def __repr__(self):
+        return 'ABSENT'
+
+    def __reduce__(self):
+        # Unpickles to the same object. Python 2 requires a str.
+        return str('ABSENT')
+
+
+# The value of an unset field of a struct class generated with
+# --compact-slots.
+ABSENT = _Absent()
+
+
+def structs_from_rows(cls, field_names, rows, validate=True):
+    """
+    Returns a list of instances of a generated struct class, one per row.
+    This is what the from_rows() class method of generated structs calls.
+
+    Each row is a sequence of the values of the fields named by field_names,
+    in that order. As with the constructor, a value of None leaves the field
+    unset, and the fields that aren't named are unset.
+
+    Rather than going through the constructor for each row, the instances
+    are created and their slots are set a field at a time, and the values of
+    a field are validated together if validate is set. This is much faster
+    for large numbers of rows.
+    """
+    field_names = list(field_names)
+    field_validators = dict(cls._all_fields_)
+    for field_name in field_names:
+        assert field_name in field_validators, (
+            '%r has no field %r' % (cls, field_name))
+    assert len(set(field_names)) == len(field_names), (
+        'Duplicate field names in %r' % field_names)
+    rows = list(rows)
+    if not rows:
+        return []
+    if set(map(len, rows)) != {len(field_names)}:
+        raise ValueError('Expected rows of %d values' % len(field_names))
+    columns = dict(zip(field_names, zip(*rows)))
+    instances = list(map(object.__new__, [cls] * len(rows)))
+    compact_slots = getattr(cls, '_compact_slots_', False)
+    unset = ABSENT if compact_slots else None
+    for field_name, validator in cls._all_fields_:
+        set_value = getattr(cls, '_%s_value' % field_name).__set__
+        column = columns.get(field_name)
+        if column is None:
+            column = [unset] * len(rows)
+            present = [False] * len(rows)
+        else:
+            if validate:
+                try:
+                    column = _validate_column(validator, column)
+                except bv.ValidationError as e:
+                    e.add_parent(field_name)
+                    raise
+            if None in column:
+                present = [val is not None for val in column]
+                if compact_slots:
+                    column = [ABSENT if val is None else val
+                              for val in column]
+            else:
+                present = [True] * len(rows)
+        # The slots are set with builtins that run in C.
+        list(map(set_value, instances, column))
+        if not compact_slots:
+            set_present = getattr(cls, '_%s_present' % field_name).__set__
+            list(map(set_present, instances, present))
+    return instances
+
+
+def _validate_column(validator, column):
+    """
+    Returns the validated values of a field for structs_from_rows(), where
+    None stands for an unset field.
+    """
+    if isinstance(validator, bv.Nullable):
+        validator = validator.validator
+    values = [val for val in column if val is not None]
+    if isinstance(validator, (bv.Struct, bv.Union)):
+        # As in the setters of generated classes.
+        list(map(validator.validate_type_only, values))
+        return column
+    validate_items = (bv.numeric_items_validator(validator) or
+                      bv.string_items_validator(validator))
+    validated = validate_items(values) if validate_items else None
+    if validated is None:
+        validated = list(map(validator.validate, values))
+    if len(validated) == len(column):
+        return validated
+    validated = iter(validated)
+    return [None if val is None else next(validated) for val in column]
+
+
 class Union(object):
 
-    # TODO(kelkabany): Possible optimization is to remove _value if a
-    # union is composed of only symbols.
-    __slots__ = ['_tag', '_value']
+    # Unions whose tags are all void (symbols) carry just the tag, and read
+    # the _value of None below. Generated unions with values add a _value
+    # slot, and set _has_value_slot_ so that a value of None is stored in it.
+    __slots__ = ['_tag']
+
+    _value = None
+    _has_value_slot_ = False
 
     def __init__(self, tag, value=None):
         assert tag in self._tagmap, 'Invalid tag %r.' % tag
@@ -32,7 +135,13 @@ class Union(object):
         else:
             validator.validate(value)
         self._tag = tag
-        self._value = value
+        if value is not None or self._has_value_slot_:
+            self._value = value
+
+    def __reduce__(self):
+        # Unions of symbols have no slots for pickle protocols 0 and 1 to
+        # save, so they're pickled by their tag and value instead.
+        return type(self), (self._tag, self._value)
 
 
 class Route(object):
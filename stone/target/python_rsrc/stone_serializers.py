@@ -2,8 +2,8 @@
 Serializers for Stone data types.
 
 Currently, only JSON is officially supported, but there's an experimental
-msgpack integration. If possible, serializers should be kept separate from the
-RPC format.
+msgpack integration, and a compact binary format for peers that share the same
+specs. If possible, serializers should be kept separate from the RPC format.
 
 This module should be dropped into a project that requires the use of Stone. In
 the future, this could be imported from a pre-installed Python package, rather
@@ -12,25 +12,341 @@ than being added to a project.
 
 from __future__ import absolute_import, unicode_literals
 
+import array
 import base64
+import codecs
 import collections
 import datetime
 import functools
+import hashlib
+import importlib
+import io
+import itertools
 import json
+import logging
+import multiprocessing
+import operator
+import random
+import re
 import six
+import struct
+import sys
+import threading
+import weakref
+
+from six.moves import copyreg
 
 try:
+    from . import stone_base as bb
     from . import stone_validators as bv
 except (SystemError, ValueError):
     # Catch errors raised when importing a relative module when not in a package.
     # This makes testing this file directly (outside of a package) easier.
+    import stone_base as bb
     import stone_validators as bv
 
 
+# --------------------------------------------------------------
+# JSON Backends
+
+class JsonBackend(object):
+    """
+    A JSON library that json_encode() and json_decode() can use.
+
+    Attributes:
+        name (str): The name the backend is registered under.
+        dumps (Callable[[object], str]): Serializes a JSON-compatible object
+            without whitespace between tokens. Must raise a bv.ValidationError
+            on objects that the library can't serialize.
+        loads (Callable[[Union[str, bytes]], object]): Deserializes JSON. Must
+            raise a ValueError on invalid input.
+    """
+
+    __slots__ = ('name', 'dumps', 'loads')
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return 'JsonBackend(%r)' % self.name
+
+
+# Registered backends by name, in the order in which they were registered.
+_json_backends = collections.OrderedDict()
+# The backend used when none is given to a function, or None for the standard
+# library's json module.
+_default_json_backend = [None]
+
+
+def register_json_backend(backend):
+    """
+    Makes a JsonBackend available by its name, replacing any backend that was
+    registered under the same name.
+    """
+    _json_backends[backend.name] = backend
+
+
+def get_json_backend(backend=None):
+    """
+    Returns the JsonBackend with the given name. If backend is already a
+    JsonBackend, it's returned as is, and if it's None, the default backend is
+    returned.
+    """
+    if backend is None:
+        return _default_json_backend[0] or _json_backends['json']
+    elif isinstance(backend, JsonBackend):
+        return backend
+    try:
+        return _json_backends[backend]
+    except KeyError:
+        raise ValueError('Unknown JSON backend %r. Available: %s' %
+                         (backend, ', '.join(_json_backends)))
+
+
+def set_default_json_backend(backend):
+    """
+    Sets the JsonBackend that is used when none is given to a function, by
+    name or itself. If backend is None, the standard library's json module is
+    used.
+
+    The faster backends that are registered if their library is installed,
+    orjson and ujson, don't escape non-ASCII characters, and fail on strings
+    with lone surrogates and on values that nest more deeply than their
+    limit, even if iterative is set.
+    """
+    if backend is not None:
+        backend = get_json_backend(backend)
+    _default_json_backend[0] = backend
+
+
+def _make_orjson_backend():
+    import orjson
+
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj).decode('utf-8')
+        except orjson.JSONEncodeError as e:
+            raise bv.ValidationError('could not encode as JSON: %s' % e)
+    return JsonBackend('orjson', dumps, orjson.loads)
+
+
+def _make_ujson_backend():
+    import ujson
+
+    def dumps(obj):
+        try:
+            return ujson.dumps(obj, escape_forward_slashes=False)
+        except (OverflowError, UnicodeEncodeError) as e:
+            raise bv.ValidationError('could not encode as JSON: %s' % e)
+    return JsonBackend('ujson', dumps, ujson.loads)
+
+
+def _make_stdlib_backend():
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    return JsonBackend('json', encoder.encode, json.loads)
+
+
+# The fastest first. The standard library's json module is always available,
+# and is the default.
+for _make_backend in (_make_orjson_backend, _make_ujson_backend,
+                      _make_stdlib_backend):
+    try:
+        register_json_backend(_make_backend())
+    except ImportError:
+        pass
+del _make_backend
+
+# Type of the dicts that represent JSON objects. Dicts preserve insertion order
+# as of Python 3.7.
+if sys.version_info >= (3, 7):
+    _dict_type = dict
+else:
+    _dict_type = collections.OrderedDict
+
+
+# --------------------------------------------------------------
+# Timestamp Codecs
+#
+# strptime() is slow, and serializes callers on a global lock. Instead, each
+# Timestamp format is compiled into a regular expression that matches the
+# zero-padded fields that strftime() writes, and a %-style template that
+# writes them. Anything the compiled parser doesn't match is handed to
+# strptime(), which then either accepts it or raises its usual error, so both
+# accept exactly the same input.
+
+# The datetime attribute, regular expression and %-style conversion of each
+# supported strftime() directive. Formats with other directives use
+# strptime() and strftime() directly.
+_timestamp_directives = {
+    'Y': ('year', r'(\d{4})', '%04d'),
+    'm': ('month', r'(\d{2})', '%02d'),
+    'd': ('day', r'(\d{2})', '%02d'),
+    'H': ('hour', r'(\d{2})', '%02d'),
+    'M': ('minute', r'(\d{2})', '%02d'),
+    'S': ('second', r'(\d{2})', '%02d'),
+    'f': ('microsecond', r'(\d{6})', '%06d'),
+}
+
+# The positional arguments of the datetime constructor.
+_datetime_args = ('year', 'month', 'day', 'hour', 'minute', 'second',
+                  'microsecond')
+
+# The format used by most specs.
+_ISO_8601_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+_timestamp_codecs = {}
+
+
+def _get_timestamp_codec(fmt):
+    """
+    Returns a tuple of (parse, format) functions for a Timestamp format, which
+    behave like datetime.datetime.strptime(val, fmt) and val.strftime(fmt).
+    The functions are compiled once per format.
+    """
+    try:
+        return _timestamp_codecs[fmt]
+    except KeyError:
+        pass
+    if fmt == _ISO_8601_FORMAT:
+        codec = _compile_iso_8601_codec()
+    else:
+        codec = _compile_timestamp_codec(fmt)
+    return _timestamp_codecs.setdefault(fmt, codec)
+
+
+def _split_timestamp_format(fmt):
+    """
+    Splits fmt into a list of alternating literal strings and directive
+    characters that starts and ends with a literal. Returns None if fmt has
+    directives that timestamp codecs don't support, or none at all.
+    """
+    parts = []
+    literal = []
+    i = 0
+    while i < len(fmt):
+        if fmt[i] != '%':
+            literal.append(fmt[i])
+        elif fmt[i + 1:i + 2] == '%':
+            literal.append('%')
+            i += 1
+        elif fmt[i + 1:i + 2] in _timestamp_directives:
+            parts.append(''.join(literal))
+            parts.append(fmt[i + 1])
+            literal = []
+            i += 1
+        else:
+            return None
+        i += 1
+    parts.append(''.join(literal))
+    directives = parts[1::2]
+    if not directives or len(set(directives)) != len(directives):
+        return None
+    return parts
+
+
+def _compile_timestamp_codec(fmt):
+    """
+    Returns a tuple of (parse, format) functions for a Timestamp format. See
+    _get_timestamp_codec().
+    """
+    strptime = datetime.datetime.strptime
+    parts = _split_timestamp_format(fmt)
+    if parts is None:
+        def parse_slow(val):
+            return strptime(val, fmt)
+
+        def format_slow(val):
+            return val.strftime(fmt)
+        return parse_slow, format_slow
+
+    pattern = []
+    template = []
+    attrs = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            attr, regex, conversion = _timestamp_directives[part]
+            attrs.append(attr)
+            pattern.append(regex)
+            template.append(conversion)
+        else:
+            pattern.append(re.escape(part))
+            template.append(part.replace('%', '%%'))
+    match = re.compile(''.join(pattern) + r'\Z').match
+    template = ''.join(template)
+    attrs = tuple(attrs)
+    # strptime() defaults the date to 1900-01-01, and the time to midnight.
+    defaults = {'year': 1900, 'month': 1, 'day': 1}
+    datetime_type = datetime.datetime
+
+    if attrs == _datetime_args[:len(attrs)] and len(attrs) >= 3:
+        def make_datetime(groups):
+            return datetime_type(*map(int, groups))
+    else:
+        def make_datetime(groups):
+            kwargs = dict(defaults)
+            kwargs.update(zip(attrs, map(int, groups)))
+            return datetime_type(**kwargs)
+
+    def parse(val):
+        try:
+            m = match(val)
+            if m is not None:
+                return make_datetime(m.groups())
+        except (TypeError, ValueError):
+            pass
+        return strptime(val, fmt)
+
+    if len(attrs) == 1:
+        attr = attrs[0]
+
+        def get_fields(val):
+            return (getattr(val, attr),)
+    else:
+        get_fields = operator.attrgetter(*attrs)
+
+    def format(val):
+        if val.year < 1000:
+            # strftime() doesn't zero-pad such years on all platforms.
+            return val.strftime(fmt)
+        return template % get_fields(val)
+    return parse, format
+
+
+def _compile_iso_8601_codec():
+    """
+    Returns a tuple of (parse, format) functions for _ISO_8601_FORMAT, which
+    are equivalent to the ones _compile_timestamp_codec() returns, but
+    avoid its indirections.
+    """
+    strptime = datetime.datetime.strptime
+    match = re.compile(
+        r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})Z\Z').match
+    datetime_type = datetime.datetime
+
+    def parse_iso_8601(val):
+        try:
+            m = match(val)
+            if m is not None:
+                return datetime_type(*map(int, m.groups()))
+        except (TypeError, ValueError):
+            pass
+        return strptime(val, _ISO_8601_FORMAT)
+
+    def format_iso_8601(val):
+        if val.year < 1000:
+            return val.strftime(_ISO_8601_FORMAT)
+        return '%04d-%02d-%02dT%02d:%02d:%02dZ' % (
+            val.year, val.month, val.day, val.hour, val.minute, val.second)
+    return parse_iso_8601, format_iso_8601
+
+
 # --------------------------------------------------------------
 # JSON Encoder
 
-def json_encode(data_type, obj, alias_validators=None, old_style=False):
+def json_encode(data_type, obj, alias_validators=None, old_style=False,
+                backend=None, iterative=False, field_mask=None):
     """Encodes an object into JSON based on its type.
 
     Args:
@@ -39,6 +355,20 @@ def json_encode(data_type, obj, alias_validators=None, old_style=False):
         alias_validators (Optional[Mapping[bv.Validator, Callable[[], None]]]):
             Custom validation functions. These must raise bv.ValidationError on
             failure.
+        backend (Optional[Union[str, JsonBackend]]): The JSON library to use,
+            or the name it's registered under. Defaults to the backend set
+            with set_default_json_backend().
+        iterative (bool): If set, nested structs and unions are encoded off
+            an explicit stack rather than by recursive calls, so that the
+            depth of values of recursive types isn't limited by the
+            recursion limit. The JSON backend may still have a limit of its
+            own.
+        field_mask (Optional[Iterable[str]]): If set, only these fields are
+            encoded, given as dotted paths through structs and the lists and
+            nullables of structs that they contain, such as 'entries.name'.
+            A field without a path below it is encoded whole. Required
+            fields outside the mask aren't checked. It can't be combined with
+            iterative.
 
     Returns:
         str: JSON-encoded object.
@@ -81,14 +411,15 @@ def json_encode(data_type, obj, alias_validators=None, old_style=False):
     > JsonEncoder.encode(um)
     "{'update': {'path': 'a/b/c', 'rev': '1234'}}"
     """
-    return json.dumps(
+    return get_json_backend(backend).dumps(
         json_compat_obj_encode(
-            data_type, obj, alias_validators, old_style))
+            data_type, obj, alias_validators, old_style,
+            iterative=iterative, field_mask=field_mask))
 
 
 def json_compat_obj_encode(
         data_type, obj, alias_validators=None, old_style=False,
-        for_msgpack=False):
+        for_msgpack=False, iterative=False, field_mask=None):
     """Encodes an object into a JSON-compatible dict based on its type.
 
     Args:
@@ -97,252 +428,1020 @@ def json_compat_obj_encode(
 
     Returns:
         An object that when passed to json.dumps() will produce a string
-        giving the JSON-encoded object.
+        giving the JSON-encoded object. JSON objects are represented as dicts
+        that preserve the order of their keys.
+
+    See json_encode() for additional information about validation, and for
+    iterative and field_mask.
+    """
+    _top_level_validator(data_type)(obj)
+    if field_mask is not None:
+        assert not iterative, 'Masked fields are encoded recursively.'
+        encode = _get_encoder(data_type, old_style, for_msgpack,
+                              _get_field_mask(data_type, field_mask))
+    elif iterative:
+        encode = _get_stack_encoder(data_type, old_style, for_msgpack)
+    else:
+        encode = _get_encoder(data_type, old_style, for_msgpack)
+    return encode(obj, alias_validators)
+
+
+def _top_level_validator(data_type):
+    """
+    Returns the function that validates an object before it's encoded. Only
+    the type of structs and unions is validated, because their fields are
+    validated on assignment. Lists are validated by their encoders.
+    """
+    if isinstance(data_type, (bv.Struct, bv.Union)):
+        return data_type.validate_type_only
+    elif isinstance(data_type, bv.Nullable):
+        value_data_type = data_type.validator
+    else:
+        value_data_type = data_type
+    if isinstance(value_data_type, bv.List):
+        return _validate_nothing
+    return data_type.validate
+
+
+def _validate_nothing(obj):
+    pass
 
-    See json_encode() for additional information about validation.
+
+# Compiled encoders, keyed first by the object that owns them and then by the
+# encoding options. Struct and union validators are routinely re-created around
+# the same generated class, so their plans are owned by the class. All other
+# validators own their plans directly. Weak keys let plans be collected along
+# with throwaway validators.
+_encoder_plans = weakref.WeakKeyDictionary()
+
+
+def _plan_owner(data_type):
+    """
+    Returns the object that compiled plans for data_type should be cached on.
     """
     if isinstance(data_type, (bv.Struct, bv.Union)):
-        # Only validate the type because fields are validated on assignment.
-        data_type.validate_type_only(obj)
+        return data_type.definition
+    else:
+        return data_type
+
+
+# Compiling a plan compiles the plans of nested types, and plans of
+# user-defined types are registered before their members are compiled so that
+# recursive references resolve to them. Plans are compiled under _plan_lock,
+# and registered in _pending_plans, which only the thread that holds the lock
+# uses, until the outermost compilation returns. Only then are they published
+# to their caches together, so other threads, which read the caches without
+# the lock, never see a plan that is incomplete or refers to one that is.
+_plan_lock = threading.RLock()
+# Map of (id of the plans that a plan is compiled into, key) to (plans, key,
+# plan), in the order the plans were registered.
+_pending_plans = collections.OrderedDict()
+# Number of compilations in progress in the thread that holds _plan_lock.
+_plan_depth = [0]
+
+
+def _owner_plans(cache, owner):
+    """
+    Returns the dict of the plans of owner in cache, adding it if needed.
+    """
+    plans = cache.get(owner)
+    if plans is None:
+        plans = cache.setdefault(owner, {})
+    return plans
+
+
+def _compile_plan(plans, key, compile_plan):
+    """
+    Returns the plan for key in plans, compiling it with compile_plan() if
+    there's none yet. compile_plan() returns a tuple of (plan,
+    compile_members), where compile_members is None or a function that
+    completes the plan, and may compile plans that refer to it.
+    """
+    with _plan_lock:
+        try:
+            # Another thread may have compiled it while this one waited for
+            # the lock.
+            return plans[key]
+        except KeyError:
+            pass
+        pending_key = (id(plans), key)
+        if pending_key in _pending_plans:
+            return _pending_plans[pending_key][2]
+        pending_count = len(_pending_plans)
+        _plan_depth[0] += 1
+        completed = False
+        try:
+            plan, compile_members = compile_plan()
+            _pending_plans[pending_key] = (plans, key, plan)
+            if compile_members is not None:
+                compile_members()
+            completed = True
+        except Exception:
+            # Drop the plan, along with those registered while compiling it,
+            # which may refer to it.
+            while len(_pending_plans) > pending_count:
+                _pending_plans.popitem()
+            raise
+        finally:
+            _plan_depth[0] -= 1
+            if not _plan_depth[0]:
+                if completed:
+                    for pending_plans, pending_key, pending_plan in (
+                            _pending_plans.values()):
+                        pending_plans[pending_key] = pending_plan
+                _pending_plans.clear()
+        return plan
+
+
+def _generated_codec(definition, member_names):
+    """
+    Returns the (encode, decode, member names) functions that the Python
+    generator emits for a struct or union class when run with --json-codecs,
+    or None if the class has none. Codecs inherited from a parent class or
+    generated for other members than the class has are ignored.
+    """
+    codec = getattr(definition, '__dict__', {}).get('_json_codec_')
+    if codec is None or set(codec[2]) != set(member_names):
+        return None
+    return codec
+
+
+def _get_encoder(data_type, old_style, for_msgpack, field_mask=None):
+    """
+    Returns a function `encode(obj, alias_validators)` that converts an
+    already type-checked obj into its JSON-compatible representation. The
+    function is compiled once per data type and set of options.
+
+    field_mask is None, or a mask returned by _get_field_mask() for
+    data_type.
+
+    See json_encode() for argument descriptions.
+    """
+    owner = _plan_owner(data_type)
+    key = (type(data_type), old_style, for_msgpack)
+    if field_mask is None:
+        try:
+            return _encoder_plans[owner][key]
+        except KeyError:
+            pass
+        plans = _owner_plans(_encoder_plans, owner)
     else:
-        data_type.validate(obj)
-    return _json_compat_obj_encode_helper(
-        data_type, obj, alias_validators, old_style, for_msgpack)
+        key = (owner,) + key + (field_mask,)
+        plans = _masked_encoder_plans
+        try:
+            return plans[key]
+        except KeyError:
+            pass
 
+    def compile_plan():
+        if isinstance(data_type, (bv.Struct, bv.Union)):
+            # User-defined types can refer to themselves. The encoder is
+            # registered before its fields are compiled so that recursive
+            # references resolve to it.
+            return _compile_user_defined_encoder(
+                data_type, old_style, for_msgpack, field_mask)
+        return _compile_encoder(
+            data_type, old_style, for_msgpack, field_mask), None
+    return _compile_plan(plans, key, compile_plan)
 
-def _json_compat_obj_encode_helper(
-        data_type, obj, alias_validators, old_style, for_msgpack):
+
+def _compile_encoder(data_type, old_style, for_msgpack, field_mask=None):
     """
+    The data_type argument must not be a Struct or Union.
     See json_encode() for argument descriptions.
     """
     if isinstance(data_type, bv.List):
-        return _encode_list(
-            data_type, obj, alias_validators, old_style=old_style,
-            for_msgpack=for_msgpack)
+        return _compile_list_encoder(
+            data_type, old_style, for_msgpack, field_mask)
     elif isinstance(data_type, bv.Nullable):
-        return _encode_nullable(
-            data_type, obj, alias_validators, old_style=old_style,
-            for_msgpack=for_msgpack)
+        return _compile_nullable_encoder(
+            data_type, old_style, for_msgpack, field_mask)
     elif isinstance(data_type, bv.Primitive):
-        return _make_json_friendly(
-            data_type, obj, alias_validators, for_msgpack=for_msgpack)
-    elif isinstance(data_type, bv.StructTree):
-        return _encode_struct_tree(
-            data_type, obj, alias_validators, old_style=old_style,
-            for_msgpack=for_msgpack)
-    elif isinstance(data_type, bv.Struct):
-        return _encode_struct(
-            data_type, obj, alias_validators, old_style=old_style,
-            for_msgpack=for_msgpack)
-    elif isinstance(data_type, bv.Union):
-        if old_style:
-            return _encode_union_old(
-                data_type, obj, alias_validators, for_msgpack=for_msgpack)
-        else:
-            return _encode_union(
-                data_type, obj, alias_validators, for_msgpack=for_msgpack)
+        return _compile_primitive_encoder(data_type, for_msgpack)
     else:
         raise AssertionError('Unsupported data type %r' %
                              type(data_type).__name__)
 
 
-def _encode_list(data_type, obj, alias_validators, old_style, for_msgpack):
+def _compile_user_defined_encoder(data_type, old_style, for_msgpack,
+                                  field_mask=None):
+    """
+    Returns a tuple of (encoder, compile_members). The encoder must not be
+    called until compile_members() has returned.
+    """
+    if isinstance(data_type, bv.StructTree):
+        return _compile_struct_tree_encoder(
+            data_type, old_style, for_msgpack, field_mask)
+    elif isinstance(data_type, bv.Struct):
+        return _compile_struct_encoder(
+            data_type, old_style, for_msgpack, field_mask)
+    elif old_style:
+        return _compile_union_old_encoder(data_type, for_msgpack)
+    else:
+        return _compile_union_encoder(data_type, for_msgpack)
+
+
+def _compile_list_encoder(data_type, old_style, for_msgpack, field_mask=None):
     """
     The data_type argument must be a List.
     See json_encode() for argument descriptions.
     """
-    # Because Lists are mutable, we always validate them during serialization.
-    obj = data_type.validate(obj)
-    return [
-        _json_compat_obj_encode_helper(
-            data_type.item_validator, item, alias_validators, old_style, for_msgpack)
-        for item in obj
-    ]
+    check_list = _list_checker(data_type)
+    validate_item = data_type.item_validator.validate
+    validate_numeric_items = bv.numeric_items_validator(
+        data_type.item_validator)
+    encode_item = _get_encoder(
+        data_type.item_validator, old_style, for_msgpack, field_mask)
+
+    def encode_list(obj, alias_validators):
+        if validate_numeric_items is not None and alias_validators is None:
+            # Validated numbers are their own JSON representation, and
+            # validating them all at once costs less than encoding them one
+            # by one.
+            check_list(obj)
+            items = validate_numeric_items(obj)
+            if items is not None:
+                return items
+        # Because Lists are mutable, they're validated during serialization,
+        # unless they haven't changed since they were validated.
+        if type(obj) is bv.ValidatedList and obj._validator is data_type:
+            return [encode_item(item, alias_validators) for item in obj]
+        check_list(obj)
+        encoded = [encode_item(validate_item(item), alias_validators)
+                   for item in obj]
+        if type(obj) is bv.ValidatedList:
+            obj._validator = data_type
+        return encoded
+    return encode_list
+
+
+def _list_checker(data_type):
+    """
+    Returns a function that checks the type and length of a list of
+    data_type, a List, but not its items.
+    """
+    min_items = data_type.min_items
+    max_items = data_type.max_items
 
+    def check_list(obj):
+        if not isinstance(obj, (tuple, list)):
+            raise bv.ValidationError('%r is not a valid list' % obj)
+        elif max_items is not None and len(obj) > max_items:
+            raise bv.ValidationError('%r has more than %s items'
+                                     % (obj, max_items))
+        elif min_items is not None and len(obj) < min_items:
+            raise bv.ValidationError('%r has fewer than %s items'
+                                     % (obj, min_items))
+    return check_list
 
-def _encode_nullable(data_type, obj, alias_validators, old_style, for_msgpack):
+
+def _list_validator(data_type):
+    """
+    Returns a function that validates a list of data_type, a List, and
+    returns the validated list. A ValidatedList that data_type validated and
+    that hasn't changed since is returned as is.
+    """
+    validate = data_type.validate
+
+    def validate_list(obj):
+        if type(obj) is bv.ValidatedList and obj._validator is data_type:
+            return obj
+        return validate(obj)
+    return validate_list
+
+
+def _compile_nullable_encoder(data_type, old_style, for_msgpack,
+                              field_mask=None):
     """
     The data_type argument must be a Nullable.
     See json_encode() for argument descriptions.
     """
-    if obj is not None:
-        return _json_compat_obj_encode_helper(
-            data_type.validator, obj, alias_validators, old_style, for_msgpack)
+    encode_value = _get_encoder(
+        data_type.validator, old_style, for_msgpack, field_mask)
+
+    def encode_nullable(obj, alias_validators):
+        if obj is not None:
+            return encode_value(obj, alias_validators)
+        else:
+            return None
+    return encode_nullable
+
+
+def _is_passthrough_primitive(data_type, for_msgpack):
+    """
+    Returns whether values of a primitive type are already JSON-compatible,
+    in which case only alias validators need to be applied to them.
+    """
+    if isinstance(data_type, bv.Bytes):
+        return for_msgpack
+    return (isinstance(data_type, bv.Primitive) and
+            not isinstance(data_type, (bv.Void, bv.Timestamp, bv.Integer)))
+
+
+def _compile_primitive_encoder(data_type, for_msgpack):
+    """
+    Returns an encoder that converts a primitive type to a Python type that can
+    be serialized by the json package.
+    """
+    if isinstance(data_type, bv.Void):
+        def convert(val):
+            return None
+    elif isinstance(data_type, bv.Timestamp):
+        convert = _get_timestamp_codec(data_type.format)[1]
+    elif isinstance(data_type, bv.Bytes) and not for_msgpack:
+        def convert(val):
+            collected = _attachment_state.collected
+            if (collected is not None and
+                    len(val) >= _attachment_state.threshold):
+                collected.append(memoryview(val))
+                return {_ATTACHMENT_KEY: len(collected) - 1}
+            return base64.b64encode(val).decode('ascii')
+    elif isinstance(data_type, bv.Integer):
+        def convert(val):
+            # A bool is a subclass of an int so it passes Integer validation.
+            # But, we want the bool to be encoded as an Integer (1/0) rather
+            # than T/F.
+            if isinstance(val, bool):
+                return int(val)
+            return val
     else:
-        return None
+        def encode_passthrough(val, alias_validators):
+            if alias_validators is not None and data_type in alias_validators:
+                alias_validators[data_type](val)
+            return val
+        return encode_passthrough
 
+    def encode_primitive(val, alias_validators):
+        if alias_validators is not None and data_type in alias_validators:
+            alias_validators[data_type](val)
+        return convert(val)
+    return encode_primitive
 
-def _encode_struct(data_type, obj, alias_validators, old_style, for_msgpack):
+
+def _compile_struct_encoder(data_type, old_style, for_msgpack,
+                            field_mask=None):
     """
     The data_type argument must be a Struct or StructTree.
     See json_encode() for argument descriptions.
+
+    The returned encoder accepts an optional third argument, a dict that the
+    fields are added to. This lets enclosing unions and struct trees place
+    their '.tag' key first without copying the encoded fields.
+
+    If field_mask is set, only the fields in it are encoded.
     """
-    # We skip validation of fields with primitive data types in structs and
-    # unions because they've already been validated on assignment.
-    d = collections.OrderedDict()
-    for field_name, field_data_type in data_type.definition._all_fields_:
-        try:
-            val = getattr(obj, field_name)
-        except AttributeError as e:
-            raise bv.ValidationError(e.args[0])
-        presence_key = '_%s_present' % field_name
-        if val is not None and getattr(obj, presence_key):
-            # This check makes sure that we don't serialize absent struct
-            # fields as null, even if there is a default.
+    # Each entry is (field_name, presence_key, field_data_type, encode), where
+    # encode is None if the field's values need no conversion.
+    fields = []
+    # The generated encoder, if any, and the encoders of the fields it uses.
+    generated = [None]
+    generated_encoders = []
+
+    def encode_struct(obj, alias_validators, d=None):
+        # We skip validation of fields with primitive data types in structs
+        # and unions because they've already been validated on assignment.
+        if d is None:
+            d = _dict_type()
+        if generated[0] is not None and alias_validators is None:
+            collected = _attachment_state.collected
+            if collected is not None:
+                collected_count = len(collected)
+            if generated[0](obj, d, generated_encoders) is not None:
+                return d
+            if collected is not None:
+                # The fields are encoded again below, along with their
+                # attachments.
+                del collected[collected_count:]
+        for field_name, presence_key, field_data_type, encode in fields:
             try:
-                d[field_name] = _json_compat_obj_encode_helper(
-                    field_data_type, val, alias_validators, old_style,
-                    for_msgpack)
-            except bv.ValidationError as e:
-                e.add_parent(field_name)
-                raise
-    return d
+                val = getattr(obj, field_name)
+            except AttributeError as e:
+                raise bv.ValidationError(e.args[0])
+            if val is not None and getattr(obj, presence_key):
+                # This check makes sure that we don't serialize absent struct
+                # fields as null, even if there is a default.
+                try:
+                    if encode is not None:
+                        d[field_name] = encode(val, alias_validators)
+                    else:
+                        if (alias_validators is not None and
+                                field_data_type in alias_validators):
+                            alias_validators[field_data_type](val)
+                        d[field_name] = val
+                except bv.ValidationError as e:
+                    e.add_parent(field_name)
+                    raise
+        return d
 
+    def compile_members():
+        definition = data_type.definition
+        masks = None if field_mask is None else dict(field_mask)
+        for field_name, field_data_type in definition._all_fields_:
+            if masks is None:
+                mask = None
+            elif field_name in masks:
+                mask = masks[field_name]
+            else:
+                continue
+            if mask is None and _is_passthrough_primitive(
+                    field_data_type, for_msgpack):
+                encode = None
+            else:
+                encode = _get_encoder(
+                    field_data_type, old_style, for_msgpack, mask)
+            fields.append(
+                (field_name, '_%s_present' % field_name, field_data_type,
+                 encode))
+        codec = _generated_codec(
+            definition, [field[0] for field in definition._all_fields_])
+        if codec is not None and field_mask is None:
+            field_data_types = dict(definition._all_fields_)
+            generated_encoders.extend(
+                _get_encoder(field_data_types[name], old_style, for_msgpack)
+                for name in codec[2])
+            generated[0] = codec[0]
+    return encode_struct, compile_members
 
-def _encode_union(data_type, obj, alias_validators, for_msgpack):
+
+def _compile_union_encoder(data_type, for_msgpack):
     """
     The data_type argument must be a Union.
     See json_encode() for argument descriptions.
     """
-    if obj._tag is None:
-        raise bv.ValidationError('no tag set')
-    field_data_type = data_type.definition._tagmap[obj._tag]
+    # Map of tag to (is_symbol, is_nullable, is_flat_struct, encode). A
+    # symbol is a void member; a flat struct is a struct member without
+    # enumerated subtypes, whose fields are inlined next to the '.tag' key.
+    variants = {}
+    # The generated encoder, if any, and the encoders of the tags it uses.
+    generated = [None]
+    generated_encoders = []
 
-    if (isinstance(field_data_type, bv.Void) or
-            (isinstance(field_data_type, bv.Nullable) and obj._value is None)):
-        return {'.tag': obj._tag}
-    else:
+    def encode_union(obj, alias_validators):
+        if generated[0] is not None and alias_validators is None:
+            d = generated[0](obj, generated_encoders, _dict_type)
+            if d is not None:
+                return d
+        tag = obj._tag
+        if tag is None:
+            raise bv.ValidationError('no tag set')
+        is_symbol, is_nullable, is_flat_struct, encode = variants[tag]
+        if is_symbol or (is_nullable and obj._value is None):
+            return {'.tag': tag}
+        d = _dict_type()
+        d['.tag'] = tag
         try:
-            encoded_val = _json_compat_obj_encode_helper(
-                field_data_type, obj._value, alias_validators, False,
-                for_msgpack)
+            if is_flat_struct:
+                encode(obj._value, alias_validators, d)
+            else:
+                d[tag] = encode(obj._value, alias_validators)
         except bv.ValidationError as e:
-            e.add_parent(obj._tag)
+            e.add_parent(tag)
             raise
-        else:
-            if isinstance(field_data_type, bv.Nullable):
-                # We've already checked for the null case above, so now we're
-                # only interested in what the wrapped validator is.
+        return d
+
+    def compile_members():
+        definition = data_type.definition
+        for tag, field_data_type in definition._tagmap.items():
+            if isinstance(field_data_type, bv.Void):
+                variants[tag] = (True, False, False, None)
+                continue
+            is_nullable = isinstance(field_data_type, bv.Nullable)
+            if is_nullable:
+                # The null case is handled by the union, so we're only
+                # interested in what the wrapped validator is.
                 field_data_type = field_data_type.validator
-            if (isinstance(field_data_type, bv.Struct) and
-                    not isinstance(field_data_type, bv.StructTree)):
-                d = collections.OrderedDict()
-                d['.tag'] = obj._tag
-                d.update(encoded_val)
-                return d
-            else:
-                return collections.OrderedDict([
-                    ('.tag', obj._tag),
-                    (obj._tag, encoded_val)])
+            is_flat_struct = (isinstance(field_data_type, bv.Struct) and
+                              not isinstance(field_data_type, bv.StructTree))
+            variants[tag] = (
+                False, is_nullable, is_flat_struct,
+                _get_encoder(field_data_type, False, for_msgpack))
+        codec = _generated_codec(definition, definition._tagmap)
+        if codec is not None:
+            generated_encoders.extend(
+                variants[tag][3] for tag in codec[2])
+            generated[0] = codec[0]
+    return encode_union, compile_members
 
 
-def _encode_union_old(data_type, obj, alias_validators, for_msgpack):
+def _compile_union_old_encoder(data_type, for_msgpack):
     """
     The data_type argument must be a Union.
     See json_encode() for argument descriptions.
     """
-    if obj._tag is None:
-        raise bv.ValidationError('no tag set')
-    field_data_type = data_type.definition._tagmap[obj._tag]
-    if field_data_type is None:
-        return obj._tag
-    else:
-        if (isinstance(field_data_type, bv.Void) or
-                (isinstance(field_data_type, bv.Nullable) and
-                 obj._value is None)):
-            return obj._tag
-        else:
-            try:
-                encoded_val = _json_compat_obj_encode_helper(
-                    field_data_type, obj._value, alias_validators, True,
-                    for_msgpack)
-            except bv.ValidationError as e:
-                e.add_parent(obj._tag)
-                raise
+    # Map of tag to (is_symbol, is_nullable, encode).
+    variants = {}
+
+    def encode_union_old(obj, alias_validators):
+        tag = obj._tag
+        if tag is None:
+            raise bv.ValidationError('no tag set')
+        is_symbol, is_nullable, encode = variants[tag]
+        if is_symbol or (is_nullable and obj._value is None):
+            return tag
+        try:
+            encoded_val = encode(obj._value, alias_validators)
+        except bv.ValidationError as e:
+            e.add_parent(tag)
+            raise
+        return {tag: encoded_val}
+
+    def compile_members():
+        for tag, field_data_type in data_type.definition._tagmap.items():
+            if field_data_type is None or isinstance(field_data_type, bv.Void):
+                variants[tag] = (True, False, None)
             else:
-                return {obj._tag: encoded_val}
+                variants[tag] = (
+                    False,
+                    isinstance(field_data_type, bv.Nullable),
+                    _get_encoder(field_data_type, True, for_msgpack))
+    return encode_union_old, compile_members
 
 
-def _encode_struct_tree(
-        data_type, obj, alias_validators, old_style, for_msgpack):
+def _compile_struct_tree_encoder(data_type, old_style, for_msgpack,
+                                 field_mask=None):
     """
-    Args:
-        data_type (StructTree)
-        as_root (bool): If a struct with enumerated subtypes is designated as a
-            root, then its fields including those that are inherited are
-            encoded in the outermost JSON object together.
+    The data_type argument must be a StructTree.
+    See json_encode() for argument descriptions.
+    """
+    # Map of Python class to (tag, encode) for the subtypes that have been
+    # encountered so far.
+    subtypes = {}
 
-    See json_encode() for other argument descriptions.
+    def encode_struct_tree(obj, alias_validators):
+        try:
+            tag, encode = subtypes[type(obj)]
+        except KeyError:
+            tag, encode = subtypes[type(obj)] = _resolve_struct_tree_subtype(
+                data_type, type(obj), old_style, for_msgpack, field_mask)
+        if old_style:
+            return {tag: encode(obj, alias_validators)}
+        d = _dict_type()
+        d['.tag'] = tag
+        return encode(obj, alias_validators, d)
+
+    def compile_members():
+        pass
+    return encode_struct_tree, compile_members
+
+
+def _resolve_struct_tree_subtype(data_type, pytype, old_style, for_msgpack,
+                                 field_mask=None):
+    """
+    Returns a tuple of (tag, encode) for serializing instances of pytype as the
+    struct with enumerated subtypes described by data_type.
+    """
+    tag, subtype = _struct_tree_subtype(data_type, pytype)
+    return tag, _get_encoder(subtype, old_style, for_msgpack,
+                             _restrict_field_mask(field_mask, subtype))
+
+
+def _struct_tree_subtype(data_type, pytype):
+    """
+    Returns a tuple of (tag, subtype), the tag and the Struct validator that
+    instances of pytype are serialized with as the struct with enumerated
+    subtypes described by data_type.
     """
-    assert type(obj) in data_type.definition._pytype_to_tag_and_subtype_, (
+    assert pytype in data_type.definition._pytype_to_tag_and_subtype_, (
         '%r is not a serializable subtype of %r.' %
-        (type(obj), data_type.definition))
-    tags, subtype = data_type.definition._pytype_to_tag_and_subtype_[type(obj)]
+        (pytype, data_type.definition))
+    tags, subtype = data_type.definition._pytype_to_tag_and_subtype_[pytype]
     assert len(tags) == 1, tags
     assert not isinstance(subtype, bv.StructTree), (
         'Cannot serialize type %r because it enumerates subtypes.' %
         subtype.definition)
-    if old_style:
-        return {
-            tags[0]:
-                _encode_struct(
-                    subtype, obj, alias_validators, old_style, for_msgpack)
-        }
-    d = collections.OrderedDict()
-    d['.tag'] = tags[0]
-    d.update(
-        _encode_struct(subtype, obj, alias_validators, old_style, for_msgpack))
-    return d
+    return tags[0], subtype
 
 
-def _make_json_friendly(data_type, val, alias_validators, for_msgpack):
-    """
-    Convert a primitive type to a Python type that can be serialized by the
-    json package.
+# --------------------------------------------------------------
+# Streaming JSON Encoder
+
+# Number of characters that json_encode_chunks() collects before yielding.
+_STREAM_CHUNK_SIZE = 64 * 1024
+# Number of bytes that are base64-encoded at a time. Must be a multiple of 3
+# so that the encoded pieces concatenate without padding.
+_BASE64_CHUNK_SIZE = 48 * 1024
+# Number of list items without lists or bytes that are encoded at a time.
+_LIST_BATCH_SIZE = 1024
+
+
+def json_encode_to(stream, data_type, obj, alias_validators=None,
+                   old_style=False, backend=None):
+    """Encodes an object into JSON like json_encode(), but writes the result
+    to a stream while traversing obj instead of building it in memory.
+
+    Args:
+        stream: A writable file-like object. If it's an instance of
+            io.TextIOBase, text is written to it. Otherwise, UTF-8 encoded
+            bytes are.
+
+    See json_encode() for the other arguments. Since the JSON is written as
+    it's produced, a ValidationError may be raised after part of it has been
+    written.
     """
-    if alias_validators is not None and data_type in alias_validators:
-        alias_validators[data_type](val)
-    if isinstance(data_type, bv.Void):
-        return None
-    elif isinstance(data_type, bv.Timestamp):
-        return val.strftime(data_type.format)
-    elif isinstance(data_type, bv.Bytes):
-        if for_msgpack:
-            return val
+    is_text = isinstance(stream, io.TextIOBase)
+    for chunk in _iter_json_chunks(data_type, obj, alias_validators,
+                                   old_style, _STREAM_CHUNK_SIZE, backend):
+        if is_text:
+            stream.write(six.text_type(chunk))
         else:
-            return base64.b64encode(val).decode('ascii')
-    elif isinstance(data_type, bv.Integer) and isinstance(val, bool):
-        # A bool is a subclass of an int so it passes Integer validation. But,
-        # we want the bool to be encoded as an Integer (1/0) rather than T/F.
-        return int(val)
-    else:
-        return val
+            stream.write(chunk.encode('utf-8'))
 
 
-# --------------------------------------------------------------
-# JSON Decoder
-
-def json_decode(
-        data_type, serialized_obj, alias_validators=None, strict=True,
-        old_style=False):
-    """Performs the reverse operation of json_encode.
+def json_encode_chunks(data_type, obj, alias_validators=None, old_style=False,
+                       chunk_size=_STREAM_CHUNK_SIZE, backend=None):
+    """Encodes an object into JSON like json_encode(), but returns an iterator
+    of UTF-8 encoded chunks of it, which is suitable for a chunked HTTP
+    response body.
 
     Args:
-        data_type (Validator): Validator for serialized_obj.
-        serialized_obj (str): The JSON string to deserialize.
-        alias_validators (Optional[Mapping[bv.Validator, Callable[[], None]]]):
-            Custom validation functions. These must raise bv.ValidationError on
-            failure.
-        strict (bool): If strict, then unknown struct fields will raise an
-            error, and unknown union variants will raise an error even if a
-            catch all field is specified. strict should only be used by a
-            recipient of serialized JSON if it's guaranteed that its Stone
-            specs are at least as recent as the senders it receives messages
-            from.
+        chunk_size (int): Minimum size of the chunks, except for the last one.
+            Chunks exceed it by at most the size of one piece of the JSON, such
+            as a string or a part of a base64-encoded bytes value.
 
-    Returns:
-        The returned object depends on the input data_type.
-            - Boolean -> bool
+    See json_encode() for the other arguments. obj is validated before this
+    function returns, but the values within it are validated as the chunks are
+    produced.
+    """
+    chunks = _iter_json_chunks(
+        data_type, obj, alias_validators, old_style, chunk_size, backend)
+    return (chunk.encode('utf-8') for chunk in chunks)
+
+
+def _iter_json_chunks(data_type, obj, alias_validators, old_style, chunk_size,
+                      backend):
+    """
+    Validates obj, and returns an iterator of strings of at least chunk_size
+    characters that make up its JSON representation.
+    """
+    _top_level_validator(data_type)(obj)
+    streamer = _get_streamer(data_type, old_style, get_json_backend(backend))
+    fragments = streamer(obj, alias_validators)
+    return _join_fragments(fragments, chunk_size)
+
+
+def _join_fragments(fragments, chunk_size):
+    buf = []
+    size = 0
+    for fragment in fragments:
+        buf.append(fragment)
+        size += len(fragment)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf)
+
+
+# Compiled streamers, cached the same way as _encoder_plans.
+_streamer_plans = weakref.WeakKeyDictionary()
+
+
+def _get_streamer(data_type, old_style, backend):
+    """
+    Returns a function `stream(obj, alias_validators)` that returns an
+    iterator of strings that make up the JSON representation of an already
+    type-checked obj. The function is compiled once per data type, set of
+    options and JsonBackend.
+
+    Values are written piece by piece only if they may contain lists or bytes.
+    Anything else is encoded at once with the function from _get_encoder(),
+    and serialized with the backend.
+    """
+    owner = _plan_owner(data_type)
+    key = (type(data_type), old_style, backend)
+    try:
+        return _streamer_plans[owner][key]
+    except KeyError:
+        pass
+
+    def compile_plan():
+        if not _is_streamed(data_type):
+            return _compile_encoding_streamer(
+                data_type, old_style, backend), None
+        elif isinstance(data_type, bv.StructTree):
+            # See _get_encoder() for why registration precedes compilation.
+            return _compile_struct_tree_streamer(data_type, old_style, backend)
+        elif isinstance(data_type, bv.Struct):
+            return _compile_struct_streamer(data_type, old_style, backend)
+        elif isinstance(data_type, bv.Union):
+            return _compile_union_streamer(data_type, old_style, backend)
+        elif isinstance(data_type, bv.List):
+            return _compile_list_streamer(data_type, old_style, backend), None
+        elif isinstance(data_type, bv.Nullable):
+            return _compile_nullable_streamer(
+                data_type, old_style, backend), None
+        else:
+            return _compile_bytes_streamer(data_type), None
+    return _compile_plan(
+        _owner_plans(_streamer_plans, owner), key, compile_plan)
+
+
+def _is_streamed(data_type, seen=None):
+    """
+    Returns whether values of data_type may contain lists or bytes.
+    """
+    if isinstance(data_type, bv.Nullable):
+        data_type = data_type.validator
+    if isinstance(data_type, (bv.List, bv.Bytes)):
+        return True
+    elif not isinstance(data_type, (bv.Struct, bv.Union)):
+        return False
+    definition = data_type.definition
+    if seen is None:
+        seen = set()
+    elif definition in seen:
+        # The type refers to itself; whether it contains a list or bytes
+        # is decided by its other members.
+        return False
+    seen.add(definition)
+    if isinstance(data_type, bv.Union):
+        members = list(definition._tagmap.values())
+    else:
+        members = [
+            field_data_type
+            for _, field_data_type in definition._all_fields_]
+        if isinstance(data_type, bv.StructTree):
+            members.extend(
+                subtype for _, subtype in
+                definition._pytype_to_tag_and_subtype_.values())
+    return any(_is_streamed(member, seen) for member in members)
+
+
+def _compile_encoding_streamer(data_type, old_style, backend):
+    encode = _get_encoder(data_type, old_style, False)
+    dumps = backend.dumps
+
+    def stream_encoded(obj, alias_validators):
+        yield dumps(encode(obj, alias_validators))
+    return stream_encoded
+
+
+def _compile_list_streamer(data_type, old_style, backend):
+    """
+    The data_type argument must be a List.
+    """
+    validate = _list_validator(data_type)
+    item_data_type = data_type.item_validator
+    dumps = backend.dumps
+
+    if not _is_streamed(item_data_type):
+        encode_item = _get_encoder(item_data_type, old_style, False)
+
+        def stream_list(obj, alias_validators):
+            # See encode_list() in _compile_list_encoder().
+            obj = validate(obj)
+            yield '['
+            for i in six.moves.range(0, len(obj), _LIST_BATCH_SIZE):
+                batch = [encode_item(item, alias_validators)
+                         for item in obj[i:i + _LIST_BATCH_SIZE]]
+                fragment = dumps(batch)[1:-1]
+                yield fragment if i == 0 else ',' + fragment
+            yield ']'
+        return stream_list
+
+    stream_item = _get_streamer(item_data_type, old_style, backend)
+
+    def stream_streamed_list(obj, alias_validators):
+        obj = validate(obj)
+        yield '['
+        sep = ''
+        for item in obj:
+            if sep:
+                yield sep
+            else:
+                sep = ','
+            for fragment in stream_item(item, alias_validators):
+                yield fragment
+        yield ']'
+    return stream_streamed_list
+
+
+def _compile_nullable_streamer(data_type, old_style, backend):
+    """
+    The data_type argument must be a Nullable.
+    """
+    stream_value = _get_streamer(data_type.validator, old_style, backend)
+
+    def stream_nullable(obj, alias_validators):
+        if obj is None:
+            return iter(('null',))
+        return stream_value(obj, alias_validators)
+    return stream_nullable
+
+
+def _compile_bytes_streamer(data_type):
+    """
+    The data_type argument must be a Bytes.
+    """
+    def stream_bytes(obj, alias_validators):
+        if alias_validators is not None and data_type in alias_validators:
+            alias_validators[data_type](obj)
+        yield '"'
+        for i in six.moves.range(0, len(obj), _BASE64_CHUNK_SIZE):
+            yield base64.b64encode(
+                obj[i:i + _BASE64_CHUNK_SIZE]).decode('ascii')
+        yield '"'
+    return stream_bytes
+
+
+def _compile_struct_streamer(data_type, old_style, backend):
+    """
+    The data_type argument must be a Struct or StructTree.
+
+    The returned streamer accepts an optional third argument, the opening of
+    the JSON object with the members that precede the fields. See
+    _compile_struct_encoder().
+    """
+    # Each entry is (field_name, presence_key, prefix, encode, stream), where
+    # prefix is the JSON-encoded name of the field and one of encode and
+    # stream is set.
+    fields = []
+    dumps = backend.dumps
+
+    def stream_struct(obj, alias_validators, opening=None):
+        if opening is None:
+            yield '{'
+            sep = ''
+        else:
+            yield opening
+            sep = ','
+        for field_name, presence_key, prefix, encode, stream in fields:
+            try:
+                val = getattr(obj, field_name)
+            except AttributeError as e:
+                raise bv.ValidationError(e.args[0])
+            if val is None or not getattr(obj, presence_key):
+                continue
+            try:
+                if encode is not None:
+                    yield sep + prefix + dumps(
+                        encode(val, alias_validators))
+                else:
+                    yield sep + prefix
+                    for fragment in stream(val, alias_validators):
+                        yield fragment
+            except bv.ValidationError as e:
+                e.add_parent(field_name)
+                raise
+            sep = ','
+        yield '}'
+
+    def compile_members():
+        for field_name, field_data_type in data_type.definition._all_fields_:
+            prefix = dumps(field_name) + ':'
+            if _is_streamed(field_data_type):
+                encode = None
+                stream = _get_streamer(field_data_type, old_style, backend)
+            else:
+                encode = _get_encoder(field_data_type, old_style, False)
+                stream = None
+            fields.append(
+                (field_name, '_%s_present' % field_name, prefix, encode,
+                 stream))
+    return stream_struct, compile_members
+
+
+def _compile_struct_tree_streamer(data_type, old_style, backend):
+    """
+    The data_type argument must be a StructTree.
+    """
+    encode_struct_tree = _get_encoder(data_type, old_style, False)
+    # Map of Python class to (tag, stream) for the subtypes that have been
+    # encountered so far. Subtypes that don't need to be streamed have a
+    # stream of None.
+    subtypes = {}
+    dumps = backend.dumps
+
+    def stream_struct_tree(obj, alias_validators):
+        try:
+            tag, stream = subtypes[type(obj)]
+        except KeyError:
+            tag, _ = _resolve_struct_tree_subtype(
+                data_type, type(obj), old_style, False)
+            _, subtype = data_type.definition._pytype_to_tag_and_subtype_[
+                type(obj)]
+            if _is_streamed(subtype):
+                stream = _get_streamer(subtype, old_style, backend)
+            else:
+                stream = None
+            subtypes[type(obj)] = tag, stream
+        if stream is None:
+            yield dumps(encode_struct_tree(obj, alias_validators))
+        elif old_style:
+            yield '{%s:' % dumps(tag)
+            for fragment in stream(obj, alias_validators):
+                yield fragment
+            yield '}'
+        else:
+            opening = '{".tag":%s' % dumps(tag)
+            for fragment in stream(obj, alias_validators, opening):
+                yield fragment
+
+    def compile_members():
+        pass
+    return stream_struct_tree, compile_members
+
+
+def _compile_union_streamer(data_type, old_style, backend):
+    """
+    The data_type argument must be a Union.
+    """
+    encode_union = _get_encoder(data_type, old_style, False)
+    # Map of tag to (is_flat_struct, stream) for tags with values that need to
+    # be streamed. Other members are encoded at once.
+    variants = {}
+    dumps = backend.dumps
+
+    def stream_union(obj, alias_validators):
+        variant = variants.get(obj._tag)
+        if variant is None or obj._value is None:
+            yield dumps(encode_union(obj, alias_validators))
+            return
+        tag = obj._tag
+        is_flat_struct, stream = variant
+        try:
+            if old_style:
+                yield '{%s:' % dumps(tag)
+                for fragment in stream(obj._value, alias_validators):
+                    yield fragment
+                yield '}'
+            elif is_flat_struct:
+                opening = '{".tag":%s' % dumps(tag)
+                for fragment in stream(obj._value, alias_validators,
+                                       opening):
+                    yield fragment
+            else:
+                yield '{".tag":%s,%s:' % (dumps(tag), dumps(tag))
+                for fragment in stream(obj._value, alias_validators):
+                    yield fragment
+                yield '}'
+        except bv.ValidationError as e:
+            e.add_parent(tag)
+            raise
+
+    def compile_members():
+        for tag, field_data_type in data_type.definition._tagmap.items():
+            if isinstance(field_data_type, bv.Nullable):
+                field_data_type = field_data_type.validator
+            if not _is_streamed(field_data_type):
+                continue
+            is_flat_struct = (isinstance(field_data_type, bv.Struct) and
+                              not isinstance(field_data_type, bv.StructTree))
+            variants[tag] = (
+                is_flat_struct,
+                _get_streamer(field_data_type, old_style, backend))
+    return stream_union, compile_members
+
+
+# --------------------------------------------------------------
+# JSON Decoder
+
+def json_decode(
+        data_type, serialized_obj, alias_validators=None, strict=True,
+        old_style=False, backend=None, lazy=False, trusted=False,
+        iterative=False, field_mask=None):
+    """Performs the reverse operation of json_encode.
+
+    Args:
+        data_type (Validator): Validator for serialized_obj.
+        serialized_obj (str): The JSON string to deserialize.
+        alias_validators (Optional[Mapping[bv.Validator, Callable[[], None]]]):
+            Custom validation functions. These must raise bv.ValidationError on
+            failure.
+        strict (bool): If strict, then unknown struct fields will raise an
+            error, and unknown union variants will raise an error even if a
+            catch all field is specified. strict should only be used by a
+            recipient of serialized JSON if it's guaranteed that its Stone
+            specs are at least as recent as the senders it receives messages
+            from.
+        backend (Optional[Union[str, JsonBackend]]): The JSON library to use,
+            or the name it's registered under. Defaults to the backend set
+            with set_default_json_backend().
+        lazy (bool): If set, the fields of generated structs are decoded and
+            validated the first time they're read, rather than up front. The
+            struct keeps their JSON-compatible values until then. Unknown
+            fields and missing required fields are still reported up front,
+            and errors in a field's value are raised by its getter. Use
+            materialize() to decode the remaining fields of an object.
+        trusted (bool): If set, only the structure of serialized_obj is
+            validated: the types of values, union tags and required fields.
+            Constraints such as string patterns and lengths, integer ranges
+            and list sizes are assumed to have been checked by the sender.
+            Alias validators still run. See set_trusted_sample_rate() for
+            fully validating a fraction of trusted input.
+        iterative (bool): If set, nested structs and unions are decoded off
+            an explicit stack. See json_encode(). It can't be combined with
+            lazy.
+        field_mask (Optional[Iterable[str]]): If set, only these fields are
+            decoded, in the format of json_encode(). The other fields are left
+            unset without being decoded, but the object is still checked for
+            unknown fields if strict, and for the masked fields that are
+            required. It can't be combined with iterative.
+
+    Returns:
+        The returned object depends on the input data_type.
+            - Boolean -> bool
             - Bytes -> bytes
             - Float -> float
             - Integer -> long
@@ -354,396 +1453,3903 @@ def json_decode(
             - Union -> An instance of its definition attribute.
     """
     try:
-        deserialized_obj = json.loads(serialized_obj)
-    except ValueError:
-        raise bv.ValidationError('could not decode input as JSON')
-    else:
-        return json_compat_obj_decode(
-            data_type, deserialized_obj, alias_validators, strict, old_style)
+        deserialized_obj = get_json_backend(backend).loads(serialized_obj)
+    except ValueError:
+        raise bv.ValidationError('could not decode input as JSON')
+    else:
+        return json_compat_obj_decode(
+            data_type, deserialized_obj, alias_validators, strict, old_style,
+            lazy=lazy, trusted=trusted, iterative=iterative,
+            field_mask=field_mask)
+
+
+def json_compat_obj_decode(
+        data_type, obj, alias_validators=None, strict=True, old_style=False,
+        for_msgpack=False, lazy=False, trusted=False, iterative=False,
+        field_mask=None):
+    """
+    Decodes a JSON-compatible object based on its data type into a
+    representative Python object.
+
+    Args:
+        data_type (Validator): Validator for serialized_obj.
+        obj: The JSON-compatible object to decode based on data_type.
+        strict (bool): If strict, then unknown struct fields will raise an
+            error, and unknown union variants will raise an error even if a
+            catch all field is specified. See json_decode() for more.
+        lazy (bool): Whether to decode struct fields on first access. See
+            json_decode().
+        trusted (bool): Whether to validate only the structure of obj. See
+            json_decode().
+        iterative (bool): Whether to decode nested structs and unions off an
+            explicit stack. See json_decode().
+        field_mask (Optional[Iterable[str]]): The fields to decode. See
+            json_decode().
+
+    Returns:
+        See json_decode().
+    """
+    if field_mask is not None:
+        assert not iterative, 'Masked fields are decoded recursively.'
+        field_mask = _get_field_mask(data_type, field_mask)
+        get_decoder = functools.partial(_get_decoder, field_mask=field_mask)
+    elif iterative:
+        get_decoder = _get_stack_decoder
+    else:
+        get_decoder = _get_decoder
+    decode = get_decoder(
+        data_type, strict, old_style, for_msgpack, lazy, trusted)
+    if trusted:
+        rate, report = _trusted_sampling
+        if rate and random.random() < rate:
+            try:
+                return get_decoder(data_type, strict, old_style, for_msgpack)(
+                    obj, alias_validators)
+            except bv.ValidationError as e:
+                # Input that isn't even structurally valid is an error either
+                # way, rather than a discrepancy.
+                ins = decode(obj, alias_validators)
+                report(data_type, e)
+                return ins
+    return decode(obj, alias_validators)
+
+
+def _log_trusted_discrepancy(data_type, error):
+    logging.getLogger(__name__).warning(
+        'Trusted input for %r failed full validation: %s', data_type, error)
+
+
+# The fraction of trusted decodes that are fully validated, and the function
+# that is called with the data type and ValidationError when one fails.
+_trusted_sampling = [0, _log_trusted_discrepancy]
+
+
+def set_trusted_sample_rate(rate, report=None):
+    """
+    Sets the fraction of decodes in trusted mode, from 0 to 1, that validate
+    their input fully anyway. When a sampled input passes the structural
+    checks of trusted mode but fails full validation, it's decoded as usual,
+    and report(data_type, error) is called with the ValidationError. If
+    report is None, such discrepancies are logged as warnings.
+    """
+    if not 0 <= rate <= 1:
+        raise ValueError('rate must be between 0 and 1, got %r' % rate)
+    _trusted_sampling[:] = [rate, report or _log_trusted_discrepancy]
+
+
+def materialize(obj):
+    """
+    Decodes the fields of a lazily decoded object that haven't been read yet,
+    as well as those of the objects nested in it, and returns obj. This
+    raises any validation errors that lazy decoding has deferred.
+
+    See json_decode() for lazy decoding.
+    """
+    if isinstance(obj, list):
+        for item in obj:
+            materialize(item)
+    elif isinstance(obj, bb.Union):
+        try:
+            materialize(obj._value)
+        except bv.ValidationError as e:
+            e.add_parent(obj._tag)
+            raise
+    elif hasattr(obj, '_all_fields_'):
+        for field_name, _ in obj._all_fields_:
+            if getattr(obj, '_%s_present' % field_name, True) is False:
+                continue
+            # Reading a field decodes it if it's pending.
+            val = getattr(obj, field_name)
+            try:
+                materialize(val)
+            except bv.ValidationError as e:
+                e.add_parent(field_name)
+                raise
+    return obj
+
+
+# Compiled decoders, cached the same way as _encoder_plans.
+_decoder_plans = weakref.WeakKeyDictionary()
+
+# Placeholder for keys that are missing from a JSON object.
+_MISSING = object()
+
+
+class _PendingFields(object):
+    """
+    Marks the fields of a lazily decoded struct that haven't been decoded yet.
+    It's stored in their presence slots in place of True, and since it's
+    falsy, only the fallback path of the generated getters has to check for
+    it. Their value slots hold the JSON-compatible values until then.
+    """
+
+    __slots__ = ['fields', 'alias_validators']
+
+    def __init__(self, fields, alias_validators):
+        # Map of field name to (field_data_type, validate, decode,
+        # value_attr, presence_attr). See _compile_struct_decoder().
+        self.fields = fields
+        self.alias_validators = alias_validators
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__  # Python 2
+
+    def load(self, ins, field_name):
+        """
+        Decodes the pending field of ins, stores it and returns it. This is
+        called by the field's getter.
+        """
+        (field_data_type, validate, decode, value_attr,
+         presence_attr) = self.fields[field_name]
+        alias_validators = self.alias_validators
+        try:
+            if validate is not None:
+                val = validate(getattr(ins, value_attr))
+                if (alias_validators is not None and
+                        field_data_type in alias_validators):
+                    alias_validators[field_data_type](val)
+            else:
+                val = decode(getattr(ins, value_attr), alias_validators)
+        except bv.ValidationError as e:
+            e.add_parent(field_name)
+            raise
+        setattr(ins, value_attr, val)
+        setattr(ins, presence_attr, val is not None)
+        return val
+
+
+def _get_decoder(data_type, strict, old_style, for_msgpack, lazy=False,
+                 trusted=False, field_mask=None):
+    """
+    Returns a function `decode(obj, alias_validators)` that converts a
+    JSON-compatible obj into its representative Python object. The function
+    is compiled once per data type and set of options.
+
+    Every value is fully validated by the decoder, so decoded objects are
+    populated without going through the validating property setters.
+
+    field_mask is None, or a mask returned by _get_field_mask() for
+    data_type.
+
+    See json_compat_obj_decode() for argument descriptions.
+    """
+    owner = _plan_owner(data_type)
+    key = (type(data_type), strict, old_style, for_msgpack, lazy, trusted)
+    if field_mask is None:
+        try:
+            return _decoder_plans[owner][key]
+        except KeyError:
+            pass
+        plans = _owner_plans(_decoder_plans, owner)
+    else:
+        key = (owner,) + key + (field_mask,)
+        plans = _masked_decoder_plans
+        try:
+            return plans[key]
+        except KeyError:
+            pass
+
+    def compile_plan():
+        if isinstance(data_type, (bv.Struct, bv.Union)):
+            # See _get_encoder() for why registration precedes compilation.
+            return _compile_user_defined_decoder(
+                data_type, strict, old_style, for_msgpack, lazy, trusted,
+                field_mask)
+        return _compile_decoder(
+            data_type, strict, old_style, for_msgpack, lazy, trusted,
+            field_mask), None
+    return _compile_plan(plans, key, compile_plan)
+
+
+def _compile_decoder(data_type, strict, old_style, for_msgpack, lazy, trusted,
+                     field_mask=None):
+    """
+    The data_type argument must not be a Struct or Union.
+    See json_compat_obj_decode() for argument descriptions.
+    """
+    if isinstance(data_type, bv.List):
+        return _compile_list_decoder(
+            data_type, strict, old_style, for_msgpack, lazy, trusted,
+            field_mask)
+    elif isinstance(data_type, bv.Nullable):
+        return _compile_nullable_decoder(
+            data_type, strict, old_style, for_msgpack, lazy, trusted,
+            field_mask)
+    elif isinstance(data_type, bv.Primitive):
+        return _compile_primitive_decoder(
+            data_type, strict, for_msgpack, trusted)
+    else:
+        raise AssertionError('Cannot handle type %r.' % data_type)
+
+
+def _compile_user_defined_decoder(
+        data_type, strict, old_style, for_msgpack, lazy, trusted,
+        field_mask=None):
+    """
+    Returns a tuple of (decoder, compile_members). The decoder must not be
+    called until compile_members() has returned.
+    """
+    if isinstance(data_type, bv.StructTree):
+        return _compile_struct_tree_decoder(
+            data_type, strict, for_msgpack, lazy, trusted, field_mask)
+    elif isinstance(data_type, bv.Struct):
+        return _compile_struct_decoder(
+            data_type, strict, old_style, for_msgpack, lazy, trusted,
+            field_mask)
+    elif old_style:
+        return _compile_union_old_decoder(
+            data_type, strict, for_msgpack, lazy, trusted)
+    else:
+        return _compile_union_decoder(
+            data_type, strict, for_msgpack, lazy, trusted)
+
+
+def _is_plain_primitive(data_type):
+    """
+    Returns whether decoding a value of a primitive type amounts to validating
+    it, in which case only alias validators need to be applied on top.
+    """
+    return (isinstance(data_type, bv.Primitive) and
+            not isinstance(data_type, (bv.Void, bv.Timestamp, bv.Bytes)))
+
+
+def _primitive_validate(data_type, trusted):
+    """
+    Returns the function that validates decoded values of a primitive type.
+    In trusted mode, it only checks their type.
+    """
+    return data_type.validate_type_only if trusted else data_type.validate
+
+
+def _is_generated_struct_field(definition, field_name):
+    """
+    Returns whether a field of a struct class uses the storage layout emitted
+    by the Python generator, which lets decoders store values directly.
+    Hand-written classes fall back to their property setters.
+    """
+    return _struct_field_attrs(definition, field_name)[0] is not None
+
+
+def _struct_field_attrs(definition, field_name):
+    """
+    Returns a tuple of (value_attr, presence_attr), the names of the slots
+    that a generated struct class stores a field in. presence_attr is None
+    for classes generated with --compact-slots, whose value slots hold
+    bb.ABSENT while unset. Both are None for hand-written classes.
+    """
+    value_attr = '_%s_value' % field_name
+    if not hasattr(definition, value_attr):
+        return None, None
+    elif getattr(definition, '_compact_slots_', False):
+        return value_attr, None
+    presence_attr = '_%s_present' % field_name
+    if not hasattr(definition, presence_attr):
+        return None, None
+    return value_attr, presence_attr
+
+
+def _compile_struct_decoder(
+        data_type, strict, old_style, for_msgpack, lazy, trusted,
+        field_mask=None):
+    """
+    The data_type argument must be a Struct.
+    See json_compat_obj_decode() for argument descriptions.
+
+    If field_mask is set, only the fields in it are decoded, and checked for
+    if they're required. The others are left unset.
+    """
+    definition = data_type.definition
+    # Keys that may appear in a JSON object without being a field.
+    known_keys = set()
+    # Each entry is (field_name, field_data_type, validate, decode,
+    # value_attr, presence_attr). If validate is set, the field is decoded by
+    # validating its value. If value_attr is None, the field is set through
+    # its property. If only presence_attr is None, the class has compact
+    # slots, and the field is decoded up front even if lazy.
+    fields = []
+    # The generated decoder, if any, and the decoders of the fields it uses.
+    generated = [None]
+    generated_decoders = []
+    # If lazy, the _PendingFields marker shared by the instances that are
+    # decoded without alias validators, and the fields it decodes.
+    pending_fields = {}
+    shared_pending = _PendingFields(pending_fields, None)
+
+    def decode_struct(obj, alias_validators):
+        if obj is None and data_type.has_default():
+            return data_type.get_default()
+        elif not isinstance(obj, dict):
+            raise bv.ValidationError('expected object, got %s' %
+                                     bv.generic_type_name(obj))
+        if strict and not known_keys.issuperset(obj):
+            for key in obj:
+                if key not in known_keys and not key.startswith('.tag'):
+                    raise bv.ValidationError("unknown field '%s'" % key)
+        if generated[0] is not None and alias_validators is None:
+            ins = generated[0](obj, generated_decoders)
+            if ins is not None:
+                return ins
+        ins = definition()
+        absent = None
+        if not lazy:
+            pending = None
+        elif alias_validators is None:
+            pending = shared_pending
+        else:
+            pending = _PendingFields(pending_fields, alias_validators)
+        for (field_name, field_data_type, validate, decode, value_attr,
+                presence_attr) in fields:
+            raw_val = obj.get(field_name, _MISSING)
+            if raw_val is _MISSING:
+                if absent is None:
+                    absent = [field_name]
+                else:
+                    absent.append(field_name)
+                continue
+            if pending is not None and presence_attr is not None:
+                setattr(ins, value_attr, raw_val)
+                setattr(ins, presence_attr, pending)
+                continue
+            try:
+                if validate is not None:
+                    val = validate(raw_val)
+                    if (alias_validators is not None and
+                            field_data_type in alias_validators):
+                        alias_validators[field_data_type](val)
+                else:
+                    val = decode(raw_val, alias_validators)
+                if value_attr is None:
+                    setattr(ins, field_name, val)
+                elif val is not None:
+                    setattr(ins, value_attr, val)
+                    if presence_attr is not None:
+                        setattr(ins, presence_attr, True)
+            except bv.ValidationError as e:
+                e.add_parent(field_name)
+                raise
+        if absent is not None:
+            _decode_absent_struct_fields(ins, definition, absent)
+        return ins
+
+    def compile_members():
+        known_keys.update(definition._all_field_names_)
+        known_keys.add('.tag')
+        masks = None if field_mask is None else dict(field_mask)
+        for field_name, field_data_type in definition._all_fields_:
+            if masks is None:
+                mask = None
+            elif field_name in masks:
+                mask = masks[field_name]
+            else:
+                continue
+            if mask is None and _is_plain_primitive(field_data_type):
+                validate = _primitive_validate(field_data_type, trusted)
+                decode = None
+            else:
+                validate = None
+                decode = _get_decoder(field_data_type, strict, old_style,
+                                      for_msgpack, lazy, trusted, mask)
+            value_attr, presence_attr = _struct_field_attrs(
+                definition, field_name)
+            fields.append((field_name, field_data_type, validate, decode,
+                           value_attr, presence_attr))
+            pending_fields[field_name] = (
+                field_data_type, validate, decode, value_attr, presence_attr)
+        if (lazy and any(field[5] is not None for field in fields) and
+                definition not in copyreg.dispatch_table):
+            copyreg.pickle(definition, _reduce_lazy_struct)
+        if lazy or field_mask is not None:
+            # Generated decoders decode every field up front.
+            return
+        codec = _generated_codec(
+            definition, [field[0] for field in fields])
+        if codec is not None:
+            field_decoders = dict(
+                (field[0], field[2] or field[3]) for field in fields)
+            generated_decoders.extend(field_decoders[name]
+                                      for name in codec[2])
+            generated[0] = codec[1]
+    return decode_struct, compile_members
+
+
+def _reduce_lazy_struct(ins):
+    """
+    Reduces an instance of a struct class that may have been decoded lazily
+    for pickle and copy. Its pending fields are decoded first, since the
+    _PendingFields marker holds the compiled decoders, which can't be pickled.
+    """
+    materialize(ins)
+    return ins.__reduce_ex__(2)
+
+
+def _decode_absent_struct_fields(ins, definition, field_names):
+    """
+    Sets the defaults of fields that were missing from a JSON object, and
+    checks that none of them was required.
+    """
+    required = getattr(definition, '_required_fields_', None)
+    for field_name, field_data_type in definition._all_fields_:
+        if field_name not in field_names:
+            continue
+        if field_data_type.has_default():
+            default = field_data_type.get_default()
+            if (default is not None or
+                    not _is_generated_struct_field(definition, field_name)):
+                setattr(ins, field_name, default)
+        elif required is not None and field_name in required:
+            raise bv.ValidationError("missing required field '%s'" %
+                                     field_name)
+    if required is None:
+        # Hand-written classes don't list their required fields, and fields
+        # with a default in the spec aren't distinguishable from required
+        # fields in the validator, so let the getters decide.
+        for field_name in field_names:
+            if not hasattr(ins, field_name):
+                raise bv.ValidationError("missing required field '%s'" %
+                                         field_name)
+
+
+def _struct_required_fields(definition):
+    """
+    Returns the names of the fields of a struct class that JSON objects must
+    have.
+    """
+    required = getattr(definition, '_required_fields_', None)
+    if required is None:
+        # See _decode_absent_struct_fields().
+        blank = definition()
+        required = [field_name for field_name, _ in definition._all_fields_
+                    if not hasattr(blank, field_name)]
+    field_data_types = dict(definition._all_fields_)
+    return [field_name for field_name in required
+            if not field_data_types[field_name].has_default()]
+
+
+def _compile_struct_tree_decoder(
+        data_type, strict, for_msgpack, lazy, trusted, field_mask=None):
+    """
+    The data_type argument must be a StructTree.
+    See json_compat_obj_decode() for argument descriptions.
+    """
+    # Map of subtype validator to its decoder.
+    subtypes = {}
+
+    def decode_struct_tree(obj, alias_validators):
+        subtype = _determine_struct_tree_subtype(data_type, obj, strict)
+        try:
+            decode = subtypes[subtype]
+        except KeyError:
+            if subtype is data_type:
+                # A catch-all base is decoded as a regular struct.
+                subtype_struct = bv.Struct(data_type.definition)
+            else:
+                subtype_struct = subtype
+            decode = subtypes[subtype] = _get_decoder(
+                subtype_struct, strict, False, for_msgpack, lazy, trusted,
+                _restrict_field_mask(field_mask, subtype_struct))
+        return decode(obj, alias_validators)
+
+    def compile_members():
+        pass
+    return decode_struct_tree, compile_members
+
+
+def _determine_struct_tree_subtype(data_type, obj, strict):
+    """
+    Searches through the JSON-object-compatible dict using the data type
+    definition to determine which of the enumerated subtypes `obj` is.
+    """
+    if '.tag' not in obj:
+        raise bv.ValidationError("missing '.tag' key")
+    if not isinstance(obj['.tag'], six.string_types):
+        raise bv.ValidationError('expected string, got %s' %
+                                 bv.generic_type_name(obj['.tag']),
+                                 parent='.tag')
+
+    # Find the subtype the tags refer to
+    full_tags_tuple = (obj['.tag'],)
+    if full_tags_tuple in data_type.definition._tag_to_subtype_:
+        subtype = data_type.definition._tag_to_subtype_[full_tags_tuple]
+        if isinstance(subtype, bv.StructTree):
+            raise bv.ValidationError("tag '%s' refers to non-leaf subtype" %
+                                     ('.'.join(full_tags_tuple)))
+        return subtype
+    else:
+        if strict:
+            # In strict mode, the entirety of the tag hierarchy should
+            # point to a known subtype.
+            raise bv.ValidationError("unknown subtype '%s'" %
+                                     '.'.join(full_tags_tuple))
+        else:
+            # If subtype was not found, use the base.
+            if data_type.definition._is_catch_all_:
+                return data_type
+            else:
+                raise bv.ValidationError(
+                    "unknown subtype '%s' and '%s' is not a catch-all" %
+                    ('.'.join(full_tags_tuple), data_type.definition.__name__))
+
+
+def _union_constructor(definition):
+    """
+    Returns a function `make(tag, value)` that creates an instance of a union
+    class from an already validated tag and value. Instances hold the tag
+    strings of the class's tag map rather than decoded ones, and an instance
+    with a value of None, such as for a void tag, is shared: the class
+    attribute for the tag if the class has one, or else the first one made.
+    """
+    if not (isinstance(definition, type) and issubclass(definition, bb.Union)):
+        return definition
+
+    tags = dict((tag, tag) for tag in definition._tagmap)
+    # Map of tag to the shared instance with a value of None.
+    shared = {}
+    for tag in tags:
+        ins = getattr(definition, tag, None)
+        # Subclasses inherit the class attributes of their parent's tags.
+        if type(ins) is definition and ins._tag == tag and ins._value is None:
+            shared[tag] = ins
+
+    def make_union(tag, value):
+        if value is None:
+            ins = shared.get(tag)
+            if ins is not None:
+                return ins
+        # Generated unions would otherwise revalidate the value in __init__.
+        ins = definition.__new__(definition)
+        ins._tag = tag = tags.get(tag, tag)
+        if value is not None:
+            ins._value = value
+        else:
+            if definition._has_value_slot_:
+                ins._value = None
+            shared[tag] = ins
+        return ins
+    return make_union
+
+
+# Kinds of union members, as far as their JSON representation is concerned.
+_UNION_VOID = 0
+# Value is stored under a key named after the tag. Errors in primitive values
+# are reported without the tag, as they were when unions validated their
+# values on construction.
+_UNION_PRIMITIVE = 1
+_UNION_VALUE = 2
+# Struct fields are stored next to the '.tag' key.
+_UNION_STRUCT = 3
+
+
+def _compile_union_decoder(data_type, strict, for_msgpack, lazy, trusted,
+                           check_only=False):
+    """
+    The data_type argument must be a Union.
+    See json_compat_obj_decode() for argument descriptions.
+
+    If check_only is set, the decoder checks obj like json_compat_obj_validate()
+    and returns None.
+    """
+    definition = data_type.definition
+    catch_all = getattr(definition, '_catch_all', None)
+    # Map of tag to (kind, is_nullable, decode).
+    variants = {}
+    make_union = [None]
+    # The generated decoder, if any, and the decoders of the tags it uses.
+    generated = [None]
+    generated_decoders = []
+
+    def decode_union(obj, alias_validators):
+        if generated[0] is not None and alias_validators is None:
+            ins = generated[0](obj, generated_decoders)
+            if ins is not None:
+                return ins
+        if isinstance(obj, six.string_types):
+            # Handles the shorthand format where the union is serialized as
+            # only the string of the tag.
+            tag = obj
+            variant = variants.get(tag)
+            if variant is not None:
+                if not (variant[0] == _UNION_VOID or variant[1]):
+                    raise bv.ValidationError(
+                        "expected object for '%s', got symbol" % tag)
+                if tag == catch_all:
+                    raise bv.ValidationError(
+                        "unexpected use of the catch-all tag '%s'" % tag)
+            elif not strict and catch_all:
+                tag = catch_all
+            else:
+                raise bv.ValidationError("unknown tag '%s'" % tag)
+            return make_union[0](tag, None)
+        elif isinstance(obj, dict):
+            return decode_union_dict(obj, alias_validators)
+        else:
+            raise bv.ValidationError("expected string or object, got %s" %
+                                     bv.generic_type_name(obj))
+
+    def decode_union_dict(obj, alias_validators):
+        if '.tag' not in obj:
+            raise bv.ValidationError("missing '.tag' key")
+        tag = obj['.tag']
+        if not isinstance(tag, six.string_types):
+            raise bv.ValidationError(
+                'tag must be string, got %s' % bv.generic_type_name(tag))
+        variant = variants.get(tag)
+        if variant is None:
+            if not strict and catch_all:
+                return make_union[0](catch_all, None)
+            else:
+                raise bv.ValidationError("unknown tag '%s'" % tag)
+        if tag == catch_all:
+            raise bv.ValidationError(
+                "unexpected use of the catch-all tag '%s'" % tag)
+
+        kind, is_nullable, decode = variant
+        if kind == _UNION_VOID:
+            raw_val = obj.get(tag)
+            if raw_val is not None:
+                raise bv.ValidationError('expected null, got %s' %
+                                         bv.generic_type_name(raw_val))
+            _check_union_dict_keys(obj, tag)
+            val = None
+        elif kind == _UNION_PRIMITIVE:
+            raw_val = obj.get(tag, _MISSING)
+            if raw_val is _MISSING or (raw_val is None and is_nullable):
+                if not is_nullable:
+                    raise bv.ValidationError("missing '%s' key" % tag)
+                val = None
+            else:
+                val = decode(raw_val, alias_validators)
+            _check_union_dict_keys(obj, tag)
+        elif kind == _UNION_VALUE:
+            raw_val = obj.get(tag, _MISSING)
+            if raw_val is _MISSING or (raw_val is None and is_nullable):
+                if not is_nullable:
+                    raise bv.ValidationError("missing '%s' key" % tag)
+                val = None
+            else:
+                try:
+                    val = decode(raw_val, alias_validators)
+                except bv.ValidationError as e:
+                    e.add_parent(tag)
+                    raise
+            _check_union_dict_keys(obj, tag)
+        else:
+            if is_nullable and len(obj) == 1:  # only has a .tag key
+                val = None
+            else:
+                # assume it's not null
+                try:
+                    val = decode(obj, alias_validators)
+                except bv.ValidationError as e:
+                    e.add_parent(tag)
+                    raise
+        return make_union[0](tag, val)
+
+    def compile_members():
+        if check_only:
+            make_union[0] = _discard_union
+        else:
+            make_union[0] = _union_constructor(definition)
+        for tag, field_data_type in definition._tagmap.items():
+            is_nullable = isinstance(field_data_type, bv.Nullable)
+            if is_nullable:
+                field_data_type = field_data_type.validator
+            if isinstance(field_data_type, bv.Void):
+                variants[tag] = (_UNION_VOID, is_nullable, None)
+                continue
+            if check_only:
+                decode = _get_payload_checker(
+                    field_data_type, strict, False, for_msgpack)
+            else:
+                decode = _get_decoder(
+                    field_data_type, strict, False, for_msgpack, lazy, trusted)
+            if isinstance(field_data_type, bv.Primitive):
+                variants[tag] = (_UNION_PRIMITIVE, is_nullable, decode)
+            elif isinstance(field_data_type, (bv.List, bv.StructTree,
+                                              bv.Union)):
+                variants[tag] = (_UNION_VALUE, is_nullable, decode)
+            elif isinstance(field_data_type, bv.Struct):
+                variants[tag] = (_UNION_STRUCT, is_nullable, decode)
+            else:
+                assert False, type(field_data_type)
+        codec = _generated_codec(definition, definition._tagmap)
+        if codec is not None and not check_only:
+            for tag in codec[2]:
+                field_data_type = definition._tagmap[tag]
+                if isinstance(field_data_type, bv.Nullable):
+                    field_data_type = field_data_type.validator
+                if _is_plain_primitive(field_data_type):
+                    generated_decoders.append(
+                        _primitive_validate(field_data_type, trusted))
+                else:
+                    generated_decoders.append(variants[tag][2])
+            # The generated decoder makes instances with the last one.
+            generated_decoders.append(make_union[0])
+            generated[0] = codec[1]
+    return decode_union, compile_members
+
+
+def _check_union_dict_keys(obj, tag):
+    """
+    Raises a ValidationError if a JSON object representing a union member has
+    keys other than '.tag' and tag.
+    """
+    if len(obj) > (2 if tag in obj else 1):
+        for key in obj:
+            if key != tag and key != '.tag':
+                raise bv.ValidationError("unexpected key '%s'" % key)
+
+
+def _compile_union_old_decoder(data_type, strict, for_msgpack, lazy, trusted,
+                               check_only=False):
+    """
+    The data_type argument must be a Union.
+    See json_compat_obj_decode() for argument descriptions, and
+    _compile_union_decoder() for check_only.
+    """
+    definition = data_type.definition
+    catch_all = getattr(definition, '_catch_all', None)
+    # Map of tag to (is_void, is_nullable, is_primitive, decode).
+    variants = {}
+    make_union = [None]
+
+    def decode_union_old(obj, alias_validators):
+        val = None
+        if isinstance(obj, six.string_types):
+            # Union member has no associated value
+            tag = obj
+            variant = variants.get(tag)
+            if variant is not None:
+                if not (variant[0] or variant[1]):
+                    raise bv.ValidationError(
+                        "expected object for '%s', got symbol" % tag)
+            elif not strict and catch_all:
+                tag = catch_all
+            else:
+                raise bv.ValidationError("unknown tag '%s'" % tag)
+        elif isinstance(obj, dict):
+            # Union member has value
+            if len(obj) != 1:
+                raise bv.ValidationError('expected 1 key, got %s' % len(obj))
+            tag = list(obj)[0]
+            raw_val = obj[tag]
+            variant = variants.get(tag)
+            if variant is not None:
+                is_void, is_nullable, is_primitive, decode = variant
+                if is_nullable and raw_val is None:
+                    val = None
+                elif is_void:
+                    if raw_val is not None and strict:
+                        raise bv.ValidationError(
+                            'expected null, got %s' %
+                            bv.generic_type_name(raw_val))
+                    # If raw_val is None, then this is the more verbose
+                    # representation of a void union member. If raw_val isn't
+                    # None, then maybe the spec has changed, so check if
+                    # we're in strict mode.
+                elif is_primitive:
+                    # See _UNION_PRIMITIVE.
+                    val = decode(raw_val, alias_validators)
+                else:
+                    try:
+                        val = decode(raw_val, alias_validators)
+                    except bv.ValidationError as e:
+                        e.add_parent(tag)
+                        raise
+            elif not strict and catch_all:
+                tag = catch_all
+            else:
+                raise bv.ValidationError("unknown tag '%s'" % tag)
+        else:
+            raise bv.ValidationError("expected string or object, got %s" %
+                                     bv.generic_type_name(obj))
+        return make_union[0](tag, val)
+
+    def compile_members():
+        if check_only:
+            make_union[0] = _discard_union
+        else:
+            make_union[0] = _union_constructor(definition)
+        for tag, field_data_type in definition._tagmap.items():
+            if isinstance(field_data_type, bv.Void):
+                variants[tag] = (True, False, False, None)
+                continue
+            is_nullable = isinstance(field_data_type, bv.Nullable)
+            value_data_type = (field_data_type.validator if is_nullable
+                               else field_data_type)
+            if check_only:
+                decode = _get_payload_checker(
+                    field_data_type, strict, True, for_msgpack)
+            else:
+                decode = _get_decoder(field_data_type, strict, True,
+                                      for_msgpack, lazy, trusted)
+            variants[tag] = (
+                False,
+                is_nullable,
+                isinstance(value_data_type, bv.Primitive),
+                decode)
+    return decode_union_old, compile_members
+
+
+def _compile_list_decoder(
+        data_type, strict, old_style, for_msgpack, lazy, trusted,
+        field_mask=None):
+    """
+    The data_type argument must be a List.
+    See json_compat_obj_decode() for argument descriptions.
+    """
+    if trusted:
+        min_items = max_items = None
+    else:
+        min_items = data_type.min_items
+        max_items = data_type.max_items
+    item_data_type = data_type.item_validator
+    validate_numeric_items = bv.numeric_items_validator(
+        item_data_type, type_only=trusted)
+    if _is_plain_primitive(item_data_type):
+        validate_item = _primitive_validate(item_data_type, trusted)
+
+        def decode_item(item, alias_validators):
+            item = validate_item(item)
+            if (alias_validators is not None and
+                    item_data_type in alias_validators):
+                alias_validators[item_data_type](item)
+            return item
+    else:
+        decode_item = _get_decoder(
+            item_data_type, strict, old_style, for_msgpack, lazy, trusted,
+            field_mask)
+
+    def decode_list(obj, alias_validators):
+        if not isinstance(obj, list):
+            raise bv.ValidationError(
+                'expected list, got %s' % bv.generic_type_name(obj))
+        elif max_items is not None and len(obj) > max_items:
+            raise bv.ValidationError('%r has more than %s items'
+                                     % (obj, max_items))
+        elif min_items is not None and len(obj) < min_items:
+            raise bv.ValidationError('%r has fewer than %s items'
+                                     % (obj, min_items))
+        if validate_numeric_items is not None and (
+                alias_validators is None or
+                item_data_type not in alias_validators):
+            items = validate_numeric_items(obj)
+            if items is not None:
+                return items
+        return [decode_item(item, alias_validators) for item in obj]
+    return decode_list
+
+
+def _compile_nullable_decoder(
+        data_type, strict, old_style, for_msgpack, lazy, trusted,
+        field_mask=None):
+    """
+    The data_type argument must be a Nullable.
+    See json_compat_obj_decode() for argument descriptions.
+    """
+    decode_value = _get_decoder(
+        data_type.validator, strict, old_style, for_msgpack, lazy, trusted,
+        field_mask)
+
+    def decode_nullable(obj, alias_validators):
+        if obj is not None:
+            return decode_value(obj, alias_validators)
+        else:
+            return None
+    return decode_nullable
+
+
+def _compile_primitive_decoder(data_type, strict, for_msgpack, trusted):
+    """
+    Returns a decoder that converts a Python object to a type that passes
+    validation by its validator, and validates it.
+
+    Validation by ``alias_validators`` is performed after the value has been
+    converted.
+    """
+    if isinstance(data_type, bv.Void):
+        def decode_void(val, alias_validators):
+            if strict and val is not None:
+                raise bv.ValidationError("expected null, got value")
+            return None
+        return decode_void
+    elif isinstance(data_type, bv.Timestamp):
+        parse = _get_timestamp_codec(data_type.format)[0]
+
+        def convert(val):
+            try:
+                return parse(val)
+            except (TypeError, ValueError) as e:
+                raise bv.ValidationError(e.args[0])
+    elif isinstance(data_type, bv.Bytes):
+        validate = _primitive_validate(data_type, trusted)
+        if for_msgpack:
+            convert = validate
+        else:
+            def convert(val):
+                if isinstance(val, dict):
+                    return validate(_resolve_attachment(val))
+                try:
+                    val = base64.b64decode(val)
+                except (TypeError, ValueError):
+                    raise bv.ValidationError('invalid base64-encoded bytes')
+                return validate(val)
+    else:
+        convert = _primitive_validate(data_type, trusted)
+
+    def decode_primitive(val, alias_validators):
+        ret = convert(val)
+        if alias_validators is not None and data_type in alias_validators:
+            alias_validators[data_type](ret)
+        return ret
+    return decode_primitive
+
+
+# --------------------------------------------------------------
+# Field Masks
+#
+# A field mask limits encoding and decoding to some of the fields of a struct,
+# given as dotted paths such as 'entries.name'. Lists and nullables are passed
+# through, so that 'entries.name' names the name field of the structs in the
+# entries list. Masks are compiled into a tree of (field name, mask of the
+# field's value or None) tuples, which are part of the keys that compiled
+# encoders and decoders are cached under.
+#
+# Masks usually come from clients, so compiled masks and the plans compiled
+# for them are kept in caches of bounded size rather than along with the
+# plans of their data types.
+
+
+class _LruCache(object):
+    """
+    A mapping that holds up to maxsize items, dropping the least recently
+    used item to make room for another.
+    """
+
+    def __init__(self, maxsize):
+        self._maxsize = maxsize
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            # Reinserted rather than moved to the end, which Python 2 lacks.
+            value = self._items.pop(key)
+            self._items[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self._maxsize:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+# Compiled masks, keyed by the owner of the data type, the data type's type,
+# and the frozenset of paths.
+_field_masks = _LruCache(256)
+# Plans compiled for masks, keyed by (owner,) followed by the key that the
+# plan would otherwise be cached under in _encoder_plans or _decoder_plans.
+# Masking a type compiles a plan per masked struct in it, so these hold more.
+_masked_encoder_plans = _LruCache(1024)
+_masked_decoder_plans = _LruCache(1024)
+
+
+def _get_field_mask(data_type, paths):
+    """
+    Returns the compiled field mask for a struct type, or a list or nullable
+    of one, from an iterable of paths. It's cached per data type and set of
+    paths.
+    """
+    assert not isinstance(paths, six.string_types), (
+        'field_mask must be an iterable of paths, not the string %r' % paths)
+    paths = frozenset(paths)
+    key = (_plan_owner(data_type), type(data_type), paths)
+    try:
+        return _field_masks[key]
+    except KeyError:
+        pass
+    # Map of field name to the same for the field's value, or None if the
+    # whole value is kept.
+    tree = {}
+    for path in paths:
+        node = tree
+        names = path.split('.')
+        for name in names[:-1]:
+            if name in node and node[name] is None:
+                break
+            node = node.setdefault(name, {})
+        else:
+            node[names[-1]] = None
+    mask = _field_masks[key] = _compile_field_mask(data_type, tree, '')
+    return mask
+
+
+def _compile_field_mask(data_type, tree, prefix):
+    while isinstance(data_type, (bv.List, bv.Nullable)):
+        if isinstance(data_type, bv.List):
+            data_type = data_type.item_validator
+        else:
+            data_type = data_type.validator
+    assert isinstance(data_type, bv.Struct), (
+        'Field masks only apply to the fields of structs, but %r is a %s' %
+        (prefix or 'the value', type(data_type).__name__))
+    field_data_types = _masked_struct_fields(data_type)
+    mask = []
+    for field_name, subtree in sorted(tree.items()):
+        assert field_name in field_data_types, (
+            '%r has no field %r' % (data_type.definition, field_name))
+        if subtree is not None:
+            subtree = _compile_field_mask(
+                field_data_types[field_name], subtree,
+                prefix + field_name + '.')
+        mask.append((field_name, subtree))
+    return tuple(mask)
+
+
+def _masked_struct_fields(data_type):
+    """
+    Returns a dict of the names of the fields of a struct type to their data
+    types, including those of all subtypes of a struct with enumerated
+    subtypes.
+    """
+    fields = dict(data_type.definition._all_fields_)
+    if isinstance(data_type, bv.StructTree):
+        for subtype in data_type.definition._tag_to_subtype_.values():
+            for field_name, field_data_type in _masked_struct_fields(
+                    subtype).items():
+                fields.setdefault(field_name, field_data_type)
+    return fields
+
+
+def _restrict_field_mask(field_mask, data_type):
+    """
+    Returns the part of a field mask for a struct with enumerated subtypes
+    that applies to the subtype data_type.
+    """
+    if field_mask is None:
+        return None
+    field_names = data_type.definition._all_field_names_
+    return tuple(entry for entry in field_mask if entry[0] in field_names)
+
+
+# --------------------------------------------------------------
+# Explicit-Stack Encoder and Decoder
+#
+# The compiled encoders and decoders call each other for nested values, so
+# deeply nested values of recursive types can exceed the recursion limit. With
+# iterative=True, values of user-defined types are instead encoded and decoded
+# by steps run off an explicit stack, with the same results and errors.
+#
+# A step is called as `step(obj, state, value, path, alias_validators,
+# stack)`, and either returns the result for obj, or pushes a step that
+# resumes it followed by a step for a nested value, whose result the resuming
+# step receives as value. path is the linked list (name, parent path) of the
+# fields and tags that lead to obj, which are added to the errors that steps
+# raise.
+
+# Compiled steps, cached the same way as _encoder_plans.
+_stack_plans = weakref.WeakKeyDictionary()
+
+
+def _run_stack(step, obj, alias_validators):
+    """
+    Returns the result of step for obj, running the steps it pushes.
+    """
+    stack = [(step, obj, None, None)]
+    value = None
+    while stack:
+        step, obj, state, path = stack.pop()
+        try:
+            value = step(obj, state, value, path, alias_validators, stack)
+        except bv.ValidationError as e:
+            while path is not None:
+                e.add_parent(path[0])
+                path = path[1]
+            raise
+    return value
+
+
+def _resume_tagged(obj, tag, value, path, alias_validators, stack):
+    """
+    A resuming step that returns the result of a nested value under its tag,
+    as in old-style unions and struct trees.
+    """
+    return {tag: value}
+
+
+def _nests_user_defined_type(data_type):
+    """
+    Returns whether values of data_type may nest user-defined types, and so
+    aren't bounded in depth by the spec.
+    """
+    while isinstance(data_type, (bv.List, bv.Nullable)):
+        if isinstance(data_type, bv.List):
+            data_type = data_type.item_validator
+        else:
+            data_type = data_type.validator
+    return isinstance(data_type, (bv.Struct, bv.Union))
+
+
+def _get_stack_plan(key, data_type, compile_plan):
+    """
+    Returns the step that compile_plan(data_type) compiles, cached under key,
+    or None if data_type doesn't nest user-defined types. compile_plan
+    returns a tuple of (step, compile_members), as for _compile_plan().
+    """
+    if not _nests_user_defined_type(data_type):
+        return None
+    owner = _plan_owner(data_type)
+    try:
+        return _stack_plans[owner][key]
+    except KeyError:
+        pass
+    return _compile_plan(
+        _owner_plans(_stack_plans, owner), key,
+        functools.partial(compile_plan, data_type))
+
+
+def _get_stack_encoder(data_type, old_style, for_msgpack):
+    """
+    Returns a function `encode(obj, alias_validators)` like _get_encoder(),
+    that encodes nested values of user-defined types off an explicit stack.
+    """
+    step = _get_encoder_step(data_type, old_style, for_msgpack)
+    if step is None:
+        return _get_encoder(data_type, old_style, for_msgpack)
+    return functools.partial(_run_stack, step)
+
+
+def _get_encoder_step(data_type, old_style, for_msgpack):
+    """
+    Returns the encoding step for data_type, or None if its values are
+    encoded by _get_encoder() without nesting user-defined types.
+    """
+    def compile_plan(data_type):
+        if isinstance(data_type, bv.StructTree):
+            return _compile_struct_tree_encoder_step(
+                data_type, old_style, for_msgpack)
+        elif isinstance(data_type, bv.Struct):
+            return _compile_struct_encoder_step(
+                data_type, old_style, for_msgpack)
+        elif isinstance(data_type, bv.Union):
+            return _compile_union_encoder_step(
+                data_type, old_style, for_msgpack)
+        elif isinstance(data_type, bv.List):
+            return _compile_list_encoder_step(
+                data_type, old_style, for_msgpack)
+        else:
+            return _compile_nullable_step(
+                _get_encoder_step(data_type.validator, old_style, for_msgpack))
+    return _get_stack_plan(('encode', type(data_type), old_style, for_msgpack),
+                           data_type, compile_plan)
+
+
+def _compile_nullable_step(value_step):
+    """
+    Returns a tuple of (step, compile_members) for a Nullable whose values
+    are processed by value_step.
+    """
+    def nullable_step(obj, state, value, path, alias_validators, stack):
+        if obj is None:
+            return None
+        return value_step(obj, state, value, path, alias_validators, stack)
+
+    def compile_members():
+        pass
+    return nullable_step, compile_members
+
+
+def _compile_struct_encoder_step(data_type, old_style, for_msgpack):
+    """
+    Like _compile_struct_encoder(). The step's state is the dict that the
+    fields are added to, or None.
+    """
+    # Each entry is (field_name, presence_key, field_data_type, encode, step),
+    # where step is set for the fields that nest user-defined types, and
+    # encode is None if the field's values need no conversion.
+    fields = []
+
+    def encode_struct(obj, d, value, path, alias_validators, stack):
+        if d is None:
+            d = _dict_type()
+        return encode_fields(obj, d, 0, path, alias_validators, stack)
+
+    def resume_struct(obj, state, value, path, alias_validators, stack):
+        d, index = state
+        d[fields[index][0]] = value
+        return encode_fields(obj, d, index + 1, path, alias_validators, stack)
+
+    def encode_fields(obj, d, start, path, alias_validators, stack):
+        for index in range(start, len(fields)):
+            field_name, presence_key, field_data_type, encode, step = (
+                fields[index])
+            try:
+                val = getattr(obj, field_name)
+            except AttributeError as e:
+                raise bv.ValidationError(e.args[0])
+            if val is None or not getattr(obj, presence_key):
+                continue
+            if step is not None:
+                stack.append((resume_struct, obj, (d, index), path))
+                stack.append((step, val, None, (field_name, path)))
+                return None
+            try:
+                if encode is not None:
+                    d[field_name] = encode(val, alias_validators)
+                else:
+                    if (alias_validators is not None and
+                            field_data_type in alias_validators):
+                        alias_validators[field_data_type](val)
+                    d[field_name] = val
+            except bv.ValidationError as e:
+                e.add_parent(field_name)
+                raise
+        return d
+
+    def compile_members():
+        for field_name, field_data_type in data_type.definition._all_fields_:
+            step = _get_encoder_step(field_data_type, old_style, for_msgpack)
+            if step is not None or _is_passthrough_primitive(
+                    field_data_type, for_msgpack):
+                encode = None
+            else:
+                encode = _get_encoder(field_data_type, old_style, for_msgpack)
+            fields.append((field_name, '_%s_present' % field_name,
+                           field_data_type, encode, step))
+    return encode_struct, compile_members
+
+
+def _compile_struct_tree_encoder_step(data_type, old_style, for_msgpack):
+    """
+    Like _compile_struct_tree_encoder().
+    """
+    # Map of Python class to (tag, step) for the subtypes that have been
+    # encountered so far.
+    subtypes = {}
+
+    def encode_struct_tree(obj, state, value, path, alias_validators, stack):
+        try:
+            tag, step = subtypes[type(obj)]
+        except KeyError:
+            tag, subtype = _struct_tree_subtype(data_type, type(obj))
+            step = _get_encoder_step(subtype, old_style, for_msgpack)
+            subtypes[type(obj)] = tag, step
+        if old_style:
+            stack.append((_resume_tagged, None, tag, path))
+            stack.append((step, obj, None, path))
+            return None
+        d = _dict_type()
+        d['.tag'] = tag
+        return step(obj, d, value, path, alias_validators, stack)
+
+    def compile_members():
+        pass
+    return encode_struct_tree, compile_members
+
+
+def _compile_union_encoder_step(data_type, old_style, for_msgpack):
+    """
+    Like _compile_union_encoder() and _compile_union_old_encoder(). Members
+    that don't nest user-defined types are encoded by the compiled encoder of
+    the union.
+    """
+    encode_union = _get_encoder(data_type, old_style, for_msgpack)
+    # Map of tag to (is_flat_struct, step) for the members that nest
+    # user-defined types. See _compile_union_encoder().
+    variants = {}
+
+    def encode_union_step(obj, state, value, path, alias_validators, stack):
+        variant = variants.get(obj._tag)
+        if variant is None or obj._value is None:
+            return encode_union(obj, alias_validators)
+        tag = obj._tag
+        is_flat_struct, step = variant
+        if old_style:
+            stack.append((_resume_tagged, None, tag, path))
+            stack.append((step, obj._value, None, (tag, path)))
+            return None
+        d = _dict_type()
+        d['.tag'] = tag
+        if is_flat_struct:
+            stack.append((step, obj._value, d, (tag, path)))
+        else:
+            stack.append((resume_union, d, tag, path))
+            stack.append((step, obj._value, None, (tag, path)))
+        return None
+
+    def resume_union(d, tag, value, path, alias_validators, stack):
+        d[tag] = value
+        return d
+
+    def compile_members():
+        for tag, field_data_type in data_type.definition._tagmap.items():
+            if not old_style and isinstance(field_data_type, bv.Nullable):
+                field_data_type = field_data_type.validator
+            step = _get_encoder_step(field_data_type, old_style, for_msgpack)
+            if step is not None:
+                is_flat_struct = (
+                    not old_style and
+                    isinstance(field_data_type, bv.Struct) and
+                    not isinstance(field_data_type, bv.StructTree))
+                variants[tag] = (is_flat_struct, step)
+    return encode_union_step, compile_members
+
+
+def _compile_list_encoder_step(data_type, old_style, for_msgpack):
+    """
+    Like _compile_list_encoder(). The state of the resuming step is a tuple
+    of (encoded items, whether items are validated).
+    """
+    check_list = _list_checker(data_type)
+    validate_item = data_type.item_validator.validate
+    item_step = [None]
+
+    def encode_list(obj, state, value, path, alias_validators, stack):
+        if type(obj) is bv.ValidatedList and obj._validator is data_type:
+            validate = False
+        else:
+            check_list(obj)
+            validate = True
+        return encode_items(obj, ([], validate), path, stack)
+
+    def resume_list(obj, state, value, path, alias_validators, stack):
+        state[0].append(value)
+        return encode_items(obj, state, path, stack)
+
+    def encode_items(obj, state, path, stack):
+        encoded, validate = state
+        if len(encoded) == len(obj):
+            if validate and type(obj) is bv.ValidatedList:
+                obj._validator = data_type
+            return encoded
+        item = obj[len(encoded)]
+        if validate:
+            item = validate_item(item)
+        stack.append((resume_list, obj, state, path))
+        stack.append((item_step[0], item, None, path))
+        return None
+
+    def compile_members():
+        item_step[0] = _get_encoder_step(
+            data_type.item_validator, old_style, for_msgpack)
+    return encode_list, compile_members
+
+
+def _get_stack_decoder(data_type, strict, old_style, for_msgpack, lazy=False,
+                       trusted=False):
+    """
+    Returns a function `decode(obj, alias_validators)` like _get_decoder(),
+    that decodes nested values of user-defined types off an explicit stack.
+    """
+    assert not lazy, 'Lazily decoded fields are decoded recursively.'
+    step = _get_decoder_step(data_type, strict, old_style, for_msgpack,
+                             trusted)
+    if step is None:
+        return _get_decoder(data_type, strict, old_style, for_msgpack,
+                            trusted=trusted)
+    return functools.partial(_run_stack, step)
+
+
+def _get_decoder_step(data_type, strict, old_style, for_msgpack, trusted):
+    """
+    Returns the decoding step for data_type, or None if its values are
+    decoded by _get_decoder() without nesting user-defined types.
+    """
+    def compile_plan(data_type):
+        if isinstance(data_type, bv.StructTree):
+            return _compile_struct_tree_decoder_step(
+                data_type, strict, for_msgpack, trusted)
+        elif isinstance(data_type, bv.Struct):
+            return _compile_struct_decoder_step(
+                data_type, strict, old_style, for_msgpack, trusted)
+        elif isinstance(data_type, bv.Union):
+            return _compile_union_decoder_step(
+                data_type, strict, old_style, for_msgpack, trusted)
+        elif isinstance(data_type, bv.List):
+            return _compile_list_decoder_step(
+                data_type, strict, old_style, for_msgpack, trusted)
+        else:
+            return _compile_nullable_step(_get_decoder_step(
+                data_type.validator, strict, old_style, for_msgpack, trusted))
+    return _get_stack_plan(
+        ('decode', type(data_type), strict, old_style, for_msgpack, trusted),
+        data_type, compile_plan)
+
+
+def _compile_struct_decoder_step(
+        data_type, strict, old_style, for_msgpack, trusted):
+    """
+    Like _compile_struct_decoder(). The state of the resuming step is a
+    tuple of (instance, index of the field being decoded, names of absent
+    fields or None).
+    """
+    definition = data_type.definition
+    known_keys = set()
+    # Each entry is (field_name, field_data_type, validate, decode, step,
+    # value_attr, presence_attr), where step is set for the fields that nest
+    # user-defined types. See _compile_struct_decoder().
+    fields = []
+
+    def decode_struct(obj, state, value, path, alias_validators, stack):
+        if obj is None and data_type.has_default():
+            return data_type.get_default()
+        elif not isinstance(obj, dict):
+            raise bv.ValidationError('expected object, got %s' %
+                                     bv.generic_type_name(obj))
+        if strict and not known_keys.issuperset(obj):
+            for key in obj:
+                if key not in known_keys and not key.startswith('.tag'):
+                    raise bv.ValidationError("unknown field '%s'" % key)
+        return decode_fields(obj, definition(), 0, None, path,
+                             alias_validators, stack)
+
+    def resume_struct(obj, state, value, path, alias_validators, stack):
+        ins, index, absent = state
+        field_name, _, _, _, _, value_attr, presence_attr = fields[index]
+        try:
+            _set_decoded_field(ins, field_name, value, value_attr,
+                               presence_attr)
+        except bv.ValidationError as e:
+            e.add_parent(field_name)
+            raise
+        return decode_fields(obj, ins, index + 1, absent, path,
+                             alias_validators, stack)
+
+    def decode_fields(obj, ins, start, absent, path, alias_validators, stack):
+        for index in range(start, len(fields)):
+            (field_name, field_data_type, validate, decode, step, value_attr,
+             presence_attr) = fields[index]
+            raw_val = obj.get(field_name, _MISSING)
+            if raw_val is _MISSING:
+                if absent is None:
+                    absent = [field_name]
+                else:
+                    absent.append(field_name)
+                continue
+            if step is not None:
+                stack.append((resume_struct, obj, (ins, index, absent), path))
+                stack.append((step, raw_val, None, (field_name, path)))
+                return None
+            try:
+                if validate is not None:
+                    val = validate(raw_val)
+                    if (alias_validators is not None and
+                            field_data_type in alias_validators):
+                        alias_validators[field_data_type](val)
+                else:
+                    val = decode(raw_val, alias_validators)
+                _set_decoded_field(ins, field_name, val, value_attr,
+                                   presence_attr)
+            except bv.ValidationError as e:
+                e.add_parent(field_name)
+                raise
+        if absent is not None:
+            _decode_absent_struct_fields(ins, definition, absent)
+        return ins
+
+    def compile_members():
+        known_keys.update(definition._all_field_names_)
+        known_keys.add('.tag')
+        for field_name, field_data_type in definition._all_fields_:
+            step = _get_decoder_step(field_data_type, strict, old_style,
+                                     for_msgpack, trusted)
+            validate = decode = None
+            if step is not None:
+                pass
+            elif _is_plain_primitive(field_data_type):
+                validate = _primitive_validate(field_data_type, trusted)
+            else:
+                decode = _get_decoder(field_data_type, strict, old_style,
+                                      for_msgpack, trusted=trusted)
+            value_attr, presence_attr = _struct_field_attrs(
+                definition, field_name)
+            fields.append((field_name, field_data_type, validate, decode,
+                           step, value_attr, presence_attr))
+    return decode_struct, compile_members
+
+
+def _set_decoded_field(ins, field_name, val, value_attr, presence_attr):
+    """
+    Stores the decoded value of a field in an instance, as
+    _compile_struct_decoder() does.
+    """
+    if value_attr is None:
+        setattr(ins, field_name, val)
+    elif val is not None:
+        setattr(ins, value_attr, val)
+        if presence_attr is not None:
+            setattr(ins, presence_attr, True)
+
+
+def _compile_struct_tree_decoder_step(data_type, strict, for_msgpack, trusted):
+    """
+    Like _compile_struct_tree_decoder().
+    """
+    # Map of subtype validator to its step.
+    subtypes = {}
+
+    def decode_struct_tree(obj, state, value, path, alias_validators, stack):
+        subtype = _determine_struct_tree_subtype(data_type, obj, strict)
+        try:
+            step = subtypes[subtype]
+        except KeyError:
+            if subtype is data_type:
+                # A catch-all base is decoded as a regular struct.
+                subtype_struct = bv.Struct(data_type.definition)
+            else:
+                subtype_struct = subtype
+            step = subtypes[subtype] = _get_decoder_step(
+                subtype_struct, strict, False, for_msgpack, trusted)
+        return step(obj, None, value, path, alias_validators, stack)
+
+    def compile_members():
+        pass
+    return decode_struct_tree, compile_members
+
+
+def _compile_union_decoder_step(
+        data_type, strict, old_style, for_msgpack, trusted):
+    """
+    Like _compile_union_decoder() and _compile_union_old_decoder(). Only
+    well-formed JSON objects for members that nest user-defined types are
+    decoded by steps. Everything else, including errors in the tag and the
+    keys of the object, is left to the compiled decoder of the union.
+    """
+    decode_union = _get_decoder(data_type, strict, old_style, for_msgpack,
+                                trusted=trusted)
+    # Map of tag to (kind, step) for the members that nest user-defined
+    # types, where kind is _UNION_VALUE or _UNION_STRUCT.
+    variants = {}
+    make_union = [None]
+
+    def decode_union_step(obj, state, value, path, alias_validators, stack):
+        if not isinstance(obj, dict):
+            return decode_union(obj, alias_validators)
+        if old_style:
+            variant = variants.get(next(iter(obj))) if len(obj) == 1 else None
+            if variant is not None:
+                tag = next(iter(obj))
+                raw_val = obj[tag]
+                if raw_val is not None:
+                    stack.append((resume_union, None, tag, path))
+                    stack.append((variant[1], raw_val, None, (tag, path)))
+                    return None
+            return decode_union(obj, alias_validators)
+        tag = obj.get('.tag')
+        if isinstance(tag, six.string_types):
+            variant = variants.get(tag)
+        else:
+            variant = None
+        if variant is None:
+            return decode_union(obj, alias_validators)
+        kind, step = variant
+        if kind == _UNION_VALUE:
+            raw_val = obj.get(tag)
+            if raw_val is not None:
+                stack.append((resume_union_value, obj, tag, path))
+                stack.append((step, raw_val, None, (tag, path)))
+                return None
+        elif len(obj) > 1:
+            # Unlike the fields of a nullable struct member.
+            stack.append((resume_union, None, tag, path))
+            stack.append((step, obj, None, (tag, path)))
+            return None
+        return decode_union(obj, alias_validators)
+
+    def resume_union(obj, tag, value, path, alias_validators, stack):
+        return make_union[0](tag, value)
+
+    def resume_union_value(obj, tag, value, path, alias_validators, stack):
+        _check_union_dict_keys(obj, tag)
+        return make_union[0](tag, value)
+
+    def compile_members():
+        make_union[0] = _union_constructor(data_type.definition)
+        for tag, field_data_type in data_type.definition._tagmap.items():
+            if not old_style and isinstance(field_data_type, bv.Nullable):
+                field_data_type = field_data_type.validator
+            step = _get_decoder_step(field_data_type, strict, old_style,
+                                     for_msgpack, trusted)
+            if step is None:
+                continue
+            if (isinstance(field_data_type, bv.Struct) and
+                    not isinstance(field_data_type, bv.StructTree)):
+                variants[tag] = (_UNION_STRUCT, step)
+            else:
+                variants[tag] = (_UNION_VALUE, step)
+    return decode_union_step, compile_members
+
+
+def _compile_list_decoder_step(
+        data_type, strict, old_style, for_msgpack, trusted):
+    """
+    Like _compile_list_decoder(). The state of the resuming step is the list
+    of decoded items.
+    """
+    if trusted:
+        min_items = max_items = None
+    else:
+        min_items = data_type.min_items
+        max_items = data_type.max_items
+    item_step = [None]
+
+    def decode_list(obj, state, value, path, alias_validators, stack):
+        if not isinstance(obj, list):
+            raise bv.ValidationError(
+                'expected list, got %s' % bv.generic_type_name(obj))
+        elif max_items is not None and len(obj) > max_items:
+            raise bv.ValidationError('%r has more than %s items'
+                                     % (obj, max_items))
+        elif min_items is not None and len(obj) < min_items:
+            raise bv.ValidationError('%r has fewer than %s items'
+                                     % (obj, min_items))
+        return decode_items(obj, [], path, stack)
+
+    def resume_list(obj, items, value, path, alias_validators, stack):
+        items.append(value)
+        return decode_items(obj, items, path, stack)
+
+    def decode_items(obj, items, path, stack):
+        if len(items) == len(obj):
+            return items
+        stack.append((resume_list, obj, items, path))
+        stack.append((item_step[0], obj[len(items)], None, path))
+        return None
+
+    def compile_members():
+        item_step[0] = _get_decoder_step(
+            data_type.item_validator, strict, old_style, for_msgpack, trusted)
+    return decode_list, compile_members
+
+
+# --------------------------------------------------------------
+# Validate-Only Decoding
+#
+# Services that only accept or reject a payload, or forward it unchanged,
+# can check it with the checks of the decoder without building the objects
+# it would return. Structs and unions aren't instantiated; values that don't
+# nest them are decoded and dropped.
+
+def json_validate(data_type, serialized_obj, alias_validators=None,
+                  strict=True, old_style=False, backend=None):
+    """
+    Checks that serialized_obj would be decoded by json_decode() without
+    error, without creating the objects it would return.
+
+    Args:
+        data_type (Validator): Validator for serialized_obj.
+        serialized_obj (str): The JSON string to check.
+        strict (bool): Whether unknown struct fields and union variants are
+            errors. See json_decode().
+        backend (Optional[Union[str, JsonBackend]]): The JSON library to use.
+            See json_decode().
+
+    Raises:
+        bv.ValidationError: The error json_decode() would raise.
+    """
+    try:
+        deserialized_obj = get_json_backend(backend).loads(serialized_obj)
+    except ValueError:
+        raise bv.ValidationError('could not decode input as JSON')
+    else:
+        json_compat_obj_validate(
+            data_type, deserialized_obj, alias_validators, strict, old_style)
+
+
+def json_compat_obj_validate(data_type, obj, alias_validators=None,
+                             strict=True, old_style=False, for_msgpack=False):
+    """
+    Checks that a JSON-compatible object would be decoded by
+    json_compat_obj_decode() without error. See json_validate().
+    """
+    _get_payload_checker(data_type, strict, old_style, for_msgpack)(
+        obj, alias_validators)
+
+
+# Compiled checkers, cached the same way as _encoder_plans.
+_checker_plans = weakref.WeakKeyDictionary()
+
+
+def _get_payload_checker(data_type, strict, old_style, for_msgpack):
+    """
+    Returns a function `check(obj, alias_validators)` that raises the
+    bv.ValidationError that the decoder of data_type would raise for obj, if
+    any. Values that can't nest structs or unions are checked by their
+    decoder, and the function returns what it decoded. Otherwise, it returns
+    None.
+    """
+    if not _nests_user_defined_type(data_type):
+        return _get_decoder(data_type, strict, old_style, for_msgpack)
+    owner = _plan_owner(data_type)
+    key = (type(data_type), strict, old_style, for_msgpack)
+    try:
+        return _checker_plans[owner][key]
+    except KeyError:
+        pass
+
+    def compile_plan():
+        # See _get_encoder() for why registration precedes compilation.
+        if isinstance(data_type, bv.StructTree):
+            return _compile_struct_tree_checker(data_type, strict, for_msgpack)
+        elif isinstance(data_type, bv.Struct):
+            return _compile_struct_checker(
+                data_type, strict, old_style, for_msgpack)
+        elif isinstance(data_type, bv.Union):
+            compile_union = (_compile_union_old_decoder if old_style
+                             else _compile_union_decoder)
+            return compile_union(
+                data_type, strict, for_msgpack, False, False, check_only=True)
+        elif isinstance(data_type, bv.List):
+            return _compile_list_checker(
+                data_type, strict, old_style, for_msgpack)
+        else:
+            return _compile_nullable_checker(
+                data_type, strict, old_style, for_msgpack)
+    return _compile_plan(
+        _owner_plans(_checker_plans, owner), key, compile_plan)
+
+
+def _discard_union(tag, value):
+    """Stands in for _union_constructor() in checking union decoders."""
+    return None
+
+
+def _compile_struct_checker(data_type, strict, old_style, for_msgpack):
+    """
+    The data_type argument must be a Struct. Returns a tuple of (checker,
+    compile_members), as for user-defined types in _get_encoder().
+    See _compile_struct_decoder() for the checks.
+    """
+    definition = data_type.definition
+    known_keys = set()
+    required = set()
+    # Each entry is (field_name, field_data_type, validate, check). If
+    # validate is set, the field is checked by validating its value.
+    fields = []
+
+    def check_struct(obj, alias_validators):
+        if obj is None and data_type.has_default():
+            return
+        elif not isinstance(obj, dict):
+            raise bv.ValidationError('expected object, got %s' %
+                                     bv.generic_type_name(obj))
+        if strict and not known_keys.issuperset(obj):
+            for key in obj:
+                if key not in known_keys and not key.startswith('.tag'):
+                    raise bv.ValidationError("unknown field '%s'" % key)
+        # Errors in values take precedence, as the decoder checks for missing
+        # fields last.
+        missing = None
+        for field_name, field_data_type, validate, check in fields:
+            raw_val = obj.get(field_name, _MISSING)
+            if raw_val is _MISSING:
+                if missing is None and field_name in required:
+                    missing = field_name
+                continue
+            try:
+                if validate is not None:
+                    val = validate(raw_val)
+                    if (alias_validators is not None and
+                            field_data_type in alias_validators):
+                        alias_validators[field_data_type](val)
+                else:
+                    check(raw_val, alias_validators)
+            except bv.ValidationError as e:
+                e.add_parent(field_name)
+                raise
+        if missing is not None:
+            raise bv.ValidationError("missing required field '%s'" %
+                                     missing)
+
+    def compile_members():
+        known_keys.update(definition._all_field_names_)
+        known_keys.add('.tag')
+        required.update(_struct_required_fields(definition))
+        for field_name, field_data_type in definition._all_fields_:
+            if _is_plain_primitive(field_data_type):
+                validate = field_data_type.validate
+                check = None
+            else:
+                validate = None
+                check = _get_payload_checker(
+                    field_data_type, strict, old_style, for_msgpack)
+            fields.append((field_name, field_data_type, validate, check))
+    return check_struct, compile_members
+
+
+def _compile_struct_tree_checker(data_type, strict, for_msgpack):
+    """
+    The data_type argument must be a StructTree.
+    See _compile_struct_checker().
+    """
+    # Map of subtype validator to its checker.
+    subtypes = {}
+
+    def check_struct_tree(obj, alias_validators):
+        subtype = _determine_struct_tree_subtype(data_type, obj, strict)
+        try:
+            check = subtypes[subtype]
+        except KeyError:
+            if subtype is data_type:
+                # A catch-all base is checked as a regular struct.
+                subtype_struct = bv.Struct(data_type.definition)
+            else:
+                subtype_struct = subtype
+            check = subtypes[subtype] = _get_payload_checker(
+                subtype_struct, strict, False, for_msgpack)
+        check(obj, alias_validators)
+
+    def compile_members():
+        pass
+    return check_struct_tree, compile_members
+
+
+def _compile_list_checker(data_type, strict, old_style, for_msgpack):
+    """
+    The data_type argument must be a List whose items nest user-defined
+    types. See _compile_struct_checker().
+    """
+    min_items = data_type.min_items
+    max_items = data_type.max_items
+    # The checker of the items, once compiled.
+    check_item = [None]
+
+    def check_list(obj, alias_validators):
+        if not isinstance(obj, list):
+            raise bv.ValidationError(
+                'expected list, got %s' % bv.generic_type_name(obj))
+        elif max_items is not None and len(obj) > max_items:
+            raise bv.ValidationError('%r has more than %s items'
+                                     % (obj, max_items))
+        elif min_items is not None and len(obj) < min_items:
+            raise bv.ValidationError('%r has fewer than %s items'
+                                     % (obj, min_items))
+        check = check_item[0]
+        for item in obj:
+            check(item, alias_validators)
+
+    def compile_members():
+        check_item[0] = _get_payload_checker(
+            data_type.item_validator, strict, old_style, for_msgpack)
+    return check_list, compile_members
+
+
+def _compile_nullable_checker(data_type, strict, old_style, for_msgpack):
+    """
+    The data_type argument must be a Nullable whose value nests user-defined
+    types. See _compile_struct_checker().
+    """
+    # The checker of the value, once compiled.
+    check_value = [None]
+
+    def check_nullable(obj, alias_validators):
+        if obj is not None:
+            check_value[0](obj, alias_validators)
+
+    def compile_members():
+        check_value[0] = _get_payload_checker(
+            data_type.validator, strict, old_style, for_msgpack)
+    return check_nullable, compile_members
+
+
+# --------------------------------------------------------------
+# Decoding Into Instances
+#
+# Loops that decode many values of a struct type, and are done with each
+# before decoding the next, can decode into an existing instance instead of
+# allocating a new one, along with new ones for its nested structs.
+
+def json_decode_into(
+        data_type, serialized_obj, instance, alias_validators=None,
+        strict=True, old_style=False, backend=None, trusted=False):
+    """Like json_decode(), but decodes into an existing instance. See
+    json_compat_obj_decode_into().
+
+    Returns:
+        instance
+    """
+    try:
+        deserialized_obj = get_json_backend(backend).loads(serialized_obj)
+    except ValueError:
+        raise bv.ValidationError('could not decode input as JSON')
+    else:
+        return json_compat_obj_decode_into(
+            data_type, deserialized_obj, instance, alias_validators, strict,
+            old_style, trusted=trusted)
+
+
+def json_compat_obj_decode_into(
+        data_type, obj, instance, alias_validators=None, strict=True,
+        old_style=False, for_msgpack=False, trusted=False):
+    """
+    Decodes a JSON-compatible object into an existing instance of the
+    definition of data_type, which must be a Struct without enumerated
+    subtypes, rather than into a new one.
+
+    Every field of instance is reset. Fields that are missing from obj are
+    unset, or set to their default. If a field of a struct type holds an
+    instance of that type, that instance is decoded into too, rather than
+    replaced. Other values are replaced. If decoding fails, instance is left
+    partly decoded.
+
+    See json_compat_obj_decode() for the other arguments.
+
+    Returns:
+        instance
+    """
+    assert (isinstance(data_type, bv.Struct) and
+            not isinstance(data_type, bv.StructTree)), (
+        'Expected a struct without enumerated subtypes, got %r' % data_type)
+    assert type(instance) is data_type.definition, (
+        'Expected an instance of %r, got %r' %
+        (data_type.definition, type(instance)))
+    decode_into = _get_decoder_into(
+        data_type, strict, old_style, for_msgpack, trusted)
+    if trusted:
+        rate, report = _trusted_sampling
+        if rate and random.random() < rate:
+            try:
+                return _get_decoder_into(
+                    data_type, strict, old_style, for_msgpack, False)(
+                        obj, instance, alias_validators)
+            except bv.ValidationError as e:
+                decode_into(obj, instance, alias_validators)
+                report(data_type, e)
+                return instance
+    return decode_into(obj, instance, alias_validators)
+
+
+class StructPool(object):
+    """
+    A free list of instances of a struct class to decode into. Instances that
+    the caller is done with are released to the pool, and reused by later
+    decodes:
+
+    > pool = StructPool(bv.Struct(FileMetadata))
+    > for line in lines:
+    >     metadata = pool.decode(json.loads(line))
+    >     process(metadata)
+    >     pool.release(metadata)
+
+    Nested struct values are reused along with the instances that hold them,
+    so no references to them may be kept either.
+    """
+
+    def __init__(self, data_type, max_size=64, alias_validators=None,
+                 strict=True, old_style=False, for_msgpack=False,
+                 trusted=False):
+        """
+        Args:
+            data_type (Validator): A Struct without enumerated subtypes.
+            max_size (int): The most instances that the pool holds. Instances
+                released to a full pool are left to be collected.
+
+        See json_compat_obj_decode() for the other arguments.
+        """
+        assert (isinstance(data_type, bv.Struct) and
+                not isinstance(data_type, bv.StructTree)), (
+            'Expected a struct without enumerated subtypes, got %r' %
+            data_type)
+        self._data_type = data_type
+        self._max_size = max_size
+        self._alias_validators = alias_validators
+        self._options = (strict, old_style, for_msgpack, trusted)
+        # Trusted decodes go through json_compat_obj_decode_into(), which
+        # samples them for full validation.
+        self._decode_into = None if trusted else _get_decoder_into(
+            data_type, strict, old_style, for_msgpack, trusted)
+        self._free = []
+
+    def acquire(self):
+        """
+        Returns an instance from the pool, with the fields it had when it was
+        released, or a new instance if the pool is empty.
+        """
+        free = self._free
+        return free.pop() if free else self._data_type.definition()
+
+    def release(self, instance):
+        """
+        Returns an instance to the pool, unless the pool is full.
+        """
+        if len(self._free) < self._max_size:
+            self._free.append(instance)
+
+    def decode(self, obj):
+        """
+        Decodes a JSON-compatible object into an instance from the pool. The
+        instance is released again if decoding fails.
+        """
+        instance = self.acquire()
+        try:
+            if self._decode_into is not None:
+                return self._decode_into(obj, instance, self._alias_validators)
+            return json_compat_obj_decode_into(
+                self._data_type, obj, instance, self._alias_validators,
+                *self._options)
+        except bv.ValidationError:
+            self.release(instance)
+            raise
+
+
+# Compiled decoders into instances, cached the same way as _encoder_plans.
+_decoder_into_plans = weakref.WeakKeyDictionary()
+
+
+def _get_decoder_into(data_type, strict, old_style, for_msgpack, trusted):
+    """
+    Returns a function `decode_into(obj, ins, alias_validators)` that decodes
+    a JSON-compatible obj into ins, an instance of the definition of
+    data_type, and returns it. data_type must be a Struct without enumerated
+    subtypes. See json_compat_obj_decode_into().
+    """
+    owner = data_type.definition
+    key = (strict, old_style, for_msgpack, trusted)
+    try:
+        return _decoder_into_plans[owner][key]
+    except KeyError:
+        pass
+    # See _get_encoder() for why registration precedes compilation.
+    return _compile_plan(
+        _owner_plans(_decoder_into_plans, owner), key,
+        lambda: _compile_struct_decoder_into(
+            data_type, strict, old_style, for_msgpack, trusted))
+
+
+def _compile_struct_decoder_into(
+        data_type, strict, old_style, for_msgpack, trusted):
+    """
+    The data_type argument must be a Struct without enumerated subtypes.
+    See json_compat_obj_decode_into() for argument descriptions.
+    """
+    definition = data_type.definition
+    # Keys that may appear in a JSON object without being a field.
+    known_keys = set()
+    # Each entry is (field_name, field_data_type, validate, decode,
+    # struct_type, value_attr, presence_attr), as for
+    # _compile_struct_decoder(). If struct_type is set, the field is of that
+    # struct class, and its current value is decoded into if it's an
+    # instance of the class.
+    fields = []
+    # The decoder into each struct_type.
+    decoders_into = {}
+
+    def decode_struct_into(obj, ins, alias_validators):
+        if not isinstance(obj, dict):
+            raise bv.ValidationError('expected object, got %s' %
+                                     bv.generic_type_name(obj))
+        if strict and not known_keys.issuperset(obj):
+            for key in obj:
+                if key not in known_keys and not key.startswith('.tag'):
+                    raise bv.ValidationError("unknown field '%s'" % key)
+        absent = None
+        for (field_name, field_data_type, validate, decode, struct_type,
+                value_attr, presence_attr) in fields:
+            raw_val = obj.get(field_name, _MISSING)
+            if raw_val is _MISSING:
+                if absent is None:
+                    absent = [field_name]
+                else:
+                    absent.append(field_name)
+                _reset_struct_field(ins, field_name, value_attr, presence_attr)
+                continue
+            try:
+                if validate is not None:
+                    val = validate(raw_val)
+                    if (alias_validators is not None and
+                            field_data_type in alias_validators):
+                        alias_validators[field_data_type](val)
+                elif (struct_type is not None and
+                      isinstance(raw_val, dict) and
+                      type(getattr(ins, value_attr)) is struct_type):
+                    val = decoders_into[struct_type](
+                        raw_val, getattr(ins, value_attr), alias_validators)
+                else:
+                    val = decode(raw_val, alias_validators)
+                if value_attr is None:
+                    setattr(ins, field_name, val)
+                elif val is not None:
+                    setattr(ins, value_attr, val)
+                    if presence_attr is not None:
+                        setattr(ins, presence_attr, True)
+                else:
+                    _reset_struct_field(
+                        ins, field_name, value_attr, presence_attr)
+            except bv.ValidationError as e:
+                e.add_parent(field_name)
+                raise
+        if absent is not None:
+            _decode_absent_struct_fields(ins, definition, absent)
+        return ins
+
+    def compile_members():
+        known_keys.update(definition._all_field_names_)
+        known_keys.add('.tag')
+        for field_name, field_data_type in definition._all_fields_:
+            if _is_plain_primitive(field_data_type):
+                validate = _primitive_validate(field_data_type, trusted)
+                decode = None
+            else:
+                validate = None
+                decode = _get_decoder(field_data_type, strict, old_style,
+                                      for_msgpack, False, trusted)
+            value_attr, presence_attr = _struct_field_attrs(
+                definition, field_name)
+            value_data_type = field_data_type
+            if isinstance(value_data_type, bv.Nullable):
+                value_data_type = value_data_type.validator
+            if (value_attr is not None and
+                    isinstance(value_data_type, bv.Struct) and
+                    not isinstance(value_data_type, bv.StructTree)):
+                struct_type = value_data_type.definition
+                decoders_into[struct_type] = _get_decoder_into(
+                    value_data_type, strict, old_style, for_msgpack, trusted)
+            else:
+                struct_type = None
+            fields.append((field_name, field_data_type, validate, decode,
+                           struct_type, value_attr, presence_attr))
+    return decode_struct_into, compile_members
+
+
+def _reset_struct_field(ins, field_name, value_attr, presence_attr):
+    """
+    Unsets a field of a struct instance that is decoded into.
+    """
+    if value_attr is None:
+        # Hand-written classes may not have a deleter.
+        try:
+            delattr(ins, field_name)
+        except AttributeError:
+            pass
+    elif presence_attr is None:
+        setattr(ins, value_attr, bb.ABSENT)
+    else:
+        setattr(ins, value_attr, None)
+        setattr(ins, presence_attr, False)
+
+
+# --------------------------------------------------------------
+# Columnar Decoding
+#
+# Jobs that only read a few fields of a long list of structs can decode them
+# into columns, without creating an object per struct.
+
+# The values and null mask of a field in the result of
+# json_compat_obj_decode_columns().
+Column = collections.namedtuple('Column', ['values', 'nulls'])
+
+# Typecodes of the arrays that hold the values of numeric and boolean fields,
+# by validator type. Float32 values are held as doubles, since they aren't
+# rounded to single precision when decoded either.
+_column_typecodes = [
+    (bv.Boolean, 'B'),
+    (bv.Int32, 'i'),
+    (bv.UInt32, 'I'),
+    (bv.Int64, 'q' if six.PY3 else 'l'),
+    (bv.UInt64, 'Q' if six.PY3 else 'L'),
+    (bv.Float32, 'd'),
+    (bv.Float64, 'd'),
+]
+_bool_types = frozenset([bool])
+
+
+def json_decode_columns(data_type, serialized_obj, field_names,
+                        alias_validators=None, strict=True, backend=None,
+                        trusted=False):
+    """Like json_decode(), but decodes a list of structs into columns. See
+    json_compat_obj_decode_columns().
+    """
+    try:
+        deserialized_obj = get_json_backend(backend).loads(serialized_obj)
+    except ValueError:
+        raise bv.ValidationError('could not decode input as JSON')
+    else:
+        return json_compat_obj_decode_columns(
+            data_type, deserialized_obj, field_names, alias_validators,
+            strict, trusted=trusted)
+
+
+def json_compat_obj_decode_columns(data_type, obj, field_names,
+                                   alias_validators=None, strict=True,
+                                   trusted=False):
+    """
+    Decodes the values of some fields of a list of structs into a column per
+    field, without creating an object per struct.
+
+    The values of numeric and boolean fields are returned as an array.array,
+    which can be wrapped without copying by numpy.frombuffer(), for example.
+    Those of other fields are returned as a list of decoded values. Missing
+    fields take their default, as for json_compat_obj_decode().
+
+    Only the values of the fields that are decoded are validated, along with
+    the presence of required fields and, if strict, the absence of unknown
+    ones.
+
+    Args:
+        data_type (Validator): A List of a Struct without enumerated
+            subtypes.
+        field_names (Iterable[str]): The names of the fields to decode.
+
+    See json_compat_obj_decode() for the other arguments.
+
+    Returns:
+        Dict[str, Column]: The column of each field, by name. A column is a
+        tuple of (values, nulls). For a nullable field, nulls is an
+        array.array('B') of 1 for the structs whose value is null, and 0 for
+        the others, and values hold 0 or None in their place. For other
+        fields, nulls is None.
+    """
+    assert (isinstance(data_type, bv.List) and
+            isinstance(data_type.item_validator, bv.Struct) and
+            not isinstance(data_type.item_validator, bv.StructTree)), (
+        'Expected a list of a struct without enumerated subtypes, got %r' %
+        data_type)
+    definition = data_type.item_validator.definition
+    field_names = list(field_names)
+    for field_name in field_names:
+        assert field_name in definition._all_field_names_, (
+            '%r has no field %r' % (definition, field_name))
+    if not isinstance(obj, list):
+        raise bv.ValidationError(
+            'expected list, got %s' % bv.generic_type_name(obj))
+    if not trusted:
+        _list_checker(data_type)(obj)
+    decode_column = _get_column_decoder(definition, strict, trusted)
+    _check_column_rows(definition, obj, strict)
+    columns = {}
+    for field_name in field_names:
+        try:
+            columns[field_name] = decode_column(
+                field_name, obj, alias_validators)
+        except bv.ValidationError as e:
+            e.add_parent(field_name)
+            raise
+    return columns
+
+
+def _check_column_rows(definition, rows, strict):
+    """
+    Checks that each of the JSON objects for a struct class has its required
+    fields and, if strict, only known keys.
+    """
+    known_keys = set(definition._all_field_names_)
+    known_keys.add('.tag')
+    required = _struct_required_fields(definition)
+    for row in rows:
+        if not isinstance(row, dict):
+            raise bv.ValidationError('expected object, got %s' %
+                                     bv.generic_type_name(row))
+        if strict and not known_keys.issuperset(row):
+            for key in row:
+                if key not in known_keys and not key.startswith('.tag'):
+                    raise bv.ValidationError("unknown field '%s'" % key)
+        for field_name in required:
+            if field_name not in row:
+                raise bv.ValidationError("missing required field '%s'" %
+                                         field_name)
+
+
+# Compiled column decoders, cached the same way as _encoder_plans.
+_column_decoder_plans = weakref.WeakKeyDictionary()
+
+
+def _get_column_decoder(definition, strict, trusted):
+    """
+    Returns a function `decode_column(field_name, rows, alias_validators)`
+    that returns the Column of a field of a list of JSON objects for a struct
+    class, which have been checked by _check_column_rows(). The function is
+    compiled once per class and set of options.
+    """
+    plans = _column_decoder_plans.get(definition)
+    if plans is None:
+        plans = _column_decoder_plans.setdefault(definition, {})
+    key = (strict, trusted)
+    try:
+        return plans[key]
+    except KeyError:
+        pass
+    decoder = plans[key] = _compile_column_decoder(definition, strict, trusted)
+    return decoder
+
+
+def _compile_column_decoder(definition, strict, trusted):
+    # Map of field name to (value_data_type, nullable, raw_default, typecode,
+    # decode). raw_default is the JSON-compatible representation of the
+    # value of the field when it's missing, so that missing values are
+    # decoded like the others. typecode is the array typecode for the values
+    # of the field, or None if they're held in a list.
+    fields = {}
+    required = set(_struct_required_fields(definition))
+    blank = definition()
+    for field_name, field_data_type in definition._all_fields_:
+        nullable = isinstance(field_data_type, bv.Nullable)
+        value_data_type = (field_data_type.validator if nullable
+                           else field_data_type)
+        if field_name in required:
+            default = None
+        elif field_data_type.has_default():
+            default = field_data_type.get_default()
+        else:
+            # Defaults from the spec are returned by the getters.
+            default = getattr(blank, field_name)
+        if default is not None:
+            raw_default = _get_encoder(field_data_type, False, False)(
+                default, None)
+        else:
+            raw_default = None
+        typecode = None
+        for validator_type, code in _column_typecodes:
+            if type(value_data_type) is validator_type:
+                typecode = code
+        fields[field_name] = (
+            value_data_type, nullable, raw_default, typecode,
+            _get_decoder(field_data_type, strict, False, False, False,
+                         trusted))
+
+    def decode_column(field_name, rows, alias_validators):
+        value_data_type, nullable, raw_default, typecode, decode = (
+            fields[field_name])
+        vals = [row.get(field_name, raw_default) for row in rows]
+        nulls = None
+        if nullable:
+            nulls = array.array('B', [val is None for val in vals])
+            if any(nulls):
+                vals = [val for val in vals if val is not None]
+        if typecode is None:
+            vals = [decode(val, alias_validators) for val in vals]
+            if nulls is not None and len(vals) < len(nulls):
+                vals = _fill_nulls(vals, nulls, None)
+            return Column(vals, nulls)
+
+        # Numbers and booleans are validated in bulk if possible.
+        validated = None
+        if alias_validators is None or value_data_type not in alias_validators:
+            if typecode == 'B':
+                if vals and _bool_types.issuperset(map(type, vals)):
+                    validated = vals
+            else:
+                validated = bv.numeric_items_validator(
+                    value_data_type, type_only=trusted)(vals)
+        if validated is None:
+            validated = [decode(val, alias_validators) for val in vals]
+        if nulls is not None and len(validated) < len(nulls):
+            validated = _fill_nulls(validated, nulls, 0)
+        return Column(array.array(typecode, validated), nulls)
+    return decode_column
+
+
+def _fill_nulls(vals, nulls, placeholder):
+    """
+    Returns a list of vals, with placeholder inserted where nulls is set.
+    """
+    vals = iter(vals)
+    return [placeholder if null else next(vals) for null in nulls]
+
+
+# --------------------------------------------------------------
+# Incremental JSON Decoder
+
+def json_decode_items(data_type, chunks, field_name=None, alias_validators=None,
+                      strict=True, old_style=False):
+    """Decodes the items of a JSON list that is read in chunks, yielding each
+    item as soon as it's complete.
+
+    Args:
+        chunks: An iterable of str or bytes. Bytes are decoded as UTF-8.
+
+    See JsonListDecoder for the other arguments. To access the other fields of
+    the struct when field_name is set, use a JsonListDecoder directly.
+    """
+    decoder = JsonListDecoder(
+        data_type, field_name, alias_validators, strict, old_style)
+    for chunk in chunks:
+        for item in decoder.feed(chunk):
+            yield item
+    decoder.close()
+
+
+_whitespace_re = re.compile(r'[ \t\n\r]*')
+# Characters that may end a JSON number or literal.
+_scalar_end_re = re.compile(r'[ \t\n\r,\]}]')
+# Characters that matter for finding the end of a JSON string, and of an
+# array or object outside of its strings.
+_string_special_re = re.compile(r'["\\]')
+_structural_re = re.compile(r'["\[\]{}]')
+_raw_decode = json.JSONDecoder().raw_decode
+
+# States of a JsonListDecoder, named after what it expects next.
+_JSON_LIST = 0
+_JSON_ITEM_OR_LIST_END = 1
+_JSON_ITEM = 2
+_JSON_ITEM_SEP = 3
+_JSON_OBJECT = 4
+_JSON_KEY_OR_OBJECT_END = 5
+_JSON_KEY = 6
+_JSON_COLON = 7
+_JSON_VALUE = 8
+_JSON_MEMBER_SEP = 9
+_JSON_END = 10
+
+
+class JsonListDecoder(object):
+    """
+    Decodes the items of a JSON list while its JSON is fed in chunks. Only an
+    item of the list is held in memory in undecoded form at any time.
+
+    The list is either the whole JSON document, or a field of a struct that is
+    the whole document. In the latter case, the other fields are decoded when
+    the decoder is closed.
+
+    Chunks can come from any source, such as an asyncio stream:
+
+    > decoder = JsonListDecoder(bv.Struct(ListFolderResult), 'entries')
+    > while True:
+    >     chunk = await reader.read(65536)
+    >     if not chunk:
+    >         break
+    >     for entry in decoder.feed(chunk):
+    >         process(entry)
+    > result = decoder.close()
+
+    A decoder can't be used anymore after it raised an error.
+    """
+
+    def __init__(self, data_type, field_name=None, alias_validators=None,
+                 strict=True, old_style=False):
+        """
+        Args:
+            data_type (Validator): Validator for the JSON document. If
+                field_name isn't set, it must be a List, or a Nullable List.
+                Otherwise, a Struct without enumerated subtypes.
+            field_name (str): The name of the struct field holding the list.
+
+        See json_decode() for the other arguments.
+        """
+        if field_name is None:
+            list_data_type = data_type
+        else:
+            assert (isinstance(data_type, bv.Struct) and
+                    not isinstance(data_type, bv.StructTree)), (
+                'Expected a struct without enumerated subtypes, got %r' %
+                data_type)
+            field_data_types = dict(data_type.definition._all_fields_)
+            assert field_name in field_data_types, (
+                '%r has no field %r' % (data_type.definition, field_name))
+            list_data_type = field_data_types[field_name]
+        self._nullable = isinstance(list_data_type, bv.Nullable)
+        if self._nullable:
+            list_data_type = list_data_type.validator
+        assert isinstance(list_data_type, bv.List), (
+            'Expected a list, got %r' % list_data_type)
+
+        self._data_type = data_type
+        self._field_name = field_name
+        self._alias_validators = alias_validators
+        self._strict = strict
+        self._old_style = old_style
+        self._list_data_type = list_data_type
+        self._decode_item = _get_decoder(
+            list_data_type.item_validator, strict, old_style, False)
+        self._utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+        # Chunks of input that haven't been parsed yet, and their total
+        # length. They start with the value being read, if any, and are only
+        # joined once its end has been fed.
+        self._pending = []
+        self._pending_length = 0
+        # How far the value being read has been scanned for its end, as a
+        # tuple of (offset, depth, in_string, scalar), where offset is
+        # relative to the start of the value.
+        self._scan = (0, 0, False, False)
+        # The offset of the end of the value being read, if it was found
+        # before its chunks were joined.
+        self._value_end = None
+        self._state = _JSON_LIST if field_name is None else _JSON_OBJECT
+        self._item_count = 0
+        # The key of the member of the struct being parsed, and the values of
+        # the members parsed so far, except for the list.
+        self._key = None
+        self._members = {}
+        self._list_seen = False
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of JSON. Returns a list of the decoded items that were
+        completed by it.
+        """
+        if isinstance(chunk, bytes):
+            try:
+                chunk = self._utf8_decoder.decode(chunk)
+            except UnicodeDecodeError:
+                raise bv.ValidationError('could not decode input as JSON')
+        return self._parse(chunk, False)
+
+    def close(self):
+        """
+        Signals the end of the JSON, and checks that it was complete. Returns
+        the struct with all fields but the list decoded if field_name was set,
+        and None otherwise.
+        """
+        try:
+            chunk = self._utf8_decoder.decode(b'', True)
+        except UnicodeDecodeError:
+            raise bv.ValidationError('could not decode input as JSON')
+        self._parse(chunk, True)
+        if self._state != _JSON_END:
+            raise bv.ValidationError('could not decode input as JSON')
+        if self._field_name is not None:
+            return self._decode_struct()
+        return None
+
+    def _parse(self, chunk, final):
+        if self._pending:
+            # The chunk continues the value being read. Scan it on its own,
+            # so that large values fed in small chunks aren't copied each
+            # time.
+            start = -self._pending_length
+            end = self._find_value_end(chunk, start)
+            self._pending.append(chunk)
+            self._pending_length += len(chunk)
+            if end is None and not final:
+                return []
+            if end is not None:
+                self._value_end = end - start
+            text = ''.join(self._pending)
+        else:
+            text = chunk
+        pos = 0
+        state = self._state
+        items = []
+        try:
+            while True:
+                pos = _whitespace_re.match(text, pos).end()
+                if pos == len(text):
+                    break
+                c = text[pos]
+                if state == _JSON_LIST:
+                    if c == '[':
+                        pos += 1
+                        state = _JSON_ITEM_OR_LIST_END
+                        continue
+                    value, end = self._read_value(text, pos, final)
+                    if end is None:
+                        break
+                    if value is not None or not self._nullable:
+                        raise self._list_error(bv.ValidationError(
+                            'expected list, got %s' %
+                            bv.generic_type_name(value)))
+                    pos = end
+                    if self._field_name is None:
+                        state = _JSON_END
+                    else:
+                        state = _JSON_MEMBER_SEP
+                elif state == _JSON_ITEM or state == _JSON_ITEM_OR_LIST_END:
+                    if c == ']' and state == _JSON_ITEM_OR_LIST_END:
+                        pos += 1
+                        state = self._end_list()
+                        continue
+                    value, end = self._read_value(text, pos, final)
+                    if end is None:
+                        break
+                    items.append(self._decode_list_item(value))
+                    pos = end
+                    state = _JSON_ITEM_SEP
+                elif state == _JSON_ITEM_SEP:
+                    if c == ',':
+                        state = _JSON_ITEM
+                    elif c == ']':
+                        state = self._end_list()
+                    else:
+                        raise bv.ValidationError(
+                            'could not decode input as JSON')
+                    pos += 1
+                elif state == _JSON_OBJECT:
+                    if c == '{':
+                        pos += 1
+                        state = _JSON_KEY_OR_OBJECT_END
+                        continue
+                    value, end = self._read_value(text, pos, final)
+                    if end is None:
+                        break
+                    raise bv.ValidationError('expected object, got %s' %
+                                             bv.generic_type_name(value))
+                elif state == _JSON_KEY or state == _JSON_KEY_OR_OBJECT_END:
+                    if c == '}' and state == _JSON_KEY_OR_OBJECT_END:
+                        pos += 1
+                        state = _JSON_END
+                        continue
+                    elif c != '"':
+                        raise bv.ValidationError(
+                            'could not decode input as JSON')
+                    key, end = self._read_value(text, pos, final)
+                    if end is None:
+                        break
+                    self._check_key(key)
+                    self._key = key
+                    pos = end
+                    state = _JSON_COLON
+                elif state == _JSON_COLON:
+                    if c != ':':
+                        raise bv.ValidationError(
+                            'could not decode input as JSON')
+                    pos += 1
+                    if self._key == self._field_name:
+                        self._list_seen = True
+                        state = _JSON_LIST
+                    else:
+                        state = _JSON_VALUE
+                elif state == _JSON_VALUE:
+                    value, end = self._read_value(text, pos, final)
+                    if end is None:
+                        break
+                    self._members[self._key] = value
+                    pos = end
+                    state = _JSON_MEMBER_SEP
+                elif state == _JSON_MEMBER_SEP:
+                    if c == ',':
+                        state = _JSON_KEY
+                    elif c == '}':
+                        state = _JSON_END
+                    else:
+                        raise bv.ValidationError(
+                            'could not decode input as JSON')
+                    pos += 1
+                else:
+                    raise bv.ValidationError('could not decode input as JSON')
+        finally:
+            self._state = state
+            text = text[pos:]
+            self._pending = [text] if text else []
+            self._pending_length = len(text)
+        return items
+
+    def _read_value(self, text, pos, final):
+        """
+        Returns a tuple of (value, end) for the JSON value that starts at pos,
+        or (None, None) if its end hasn't been fed yet.
+        """
+        end = self._find_value_end(text, pos)
+        if end is None:
+            if not final:
+                return None, None
+            end = len(text)
+        try:
+            value, value_end = _raw_decode(text, pos)
+        except ValueError:
+            value_end = None
+        if value_end != end:
+            raise bv.ValidationError('could not decode input as JSON')
+        return value, end
+
+    def _find_value_end(self, text, start):
+        """
+        Returns the index after the end of the JSON value that starts at
+        start, or None if it hasn't been fed yet. start is negative if text
+        continues a value that started in earlier chunks. This only looks at
+        the characters that may end the value, and resumes where it stopped
+        the last time, so that large values fed in small chunks are scanned
+        once.
+        """
+        if self._value_end is not None:
+            end = start + self._value_end
+            self._value_end = None
+            return end
+        offset, depth, in_string, scalar = self._scan
+        if offset == 0:
+            scalar = text[start] not in '[{"'
+        pos = start + offset
+        if pos > len(text):
+            # The character escaped at the end of the last chunk hasn't been
+            # fed yet.
+            return None
+        if scalar:
+            m = _scalar_end_re.search(text, pos)
+            if m is not None:
+                self._scan = (0, 0, False, False)
+                return m.start()
+            self._scan = (len(text) - start, 0, False, True)
+            return None
+        while True:
+            if in_string:
+                m = _string_special_re.search(text, pos)
+                if m is None:
+                    pos = len(text)
+                    break
+                elif m.group() == '\\':
+                    # Skips the escaped character, even if it hasn't been fed
+                    # yet.
+                    pos = m.end() + 1
+                    if pos > len(text):
+                        break
+                    continue
+                in_string = False
+            else:
+                m = _structural_re.search(text, pos)
+                if m is None:
+                    pos = len(text)
+                    break
+                c = m.group()
+                if c == '"':
+                    in_string = True
+                elif c == '[' or c == '{':
+                    depth += 1
+                else:
+                    depth -= 1
+            pos = m.end()
+            if depth == 0 and not in_string:
+                self._scan = (0, 0, False, False)
+                return pos
+        self._scan = (pos - start, depth, in_string, False)
+        return None
+
+    def _decode_list_item(self, value):
+        self._item_count += 1
+        max_items = self._list_data_type.max_items
+        if max_items is not None and self._item_count > max_items:
+            raise self._list_error(bv.ValidationError(
+                'list has more than %s items' % max_items))
+        try:
+            return self._decode_item(value, self._alias_validators)
+        except bv.ValidationError as e:
+            raise self._list_error(e)
+
+    def _end_list(self):
+        min_items = self._list_data_type.min_items
+        if min_items is not None and self._item_count < min_items:
+            raise self._list_error(bv.ValidationError(
+                'list has fewer than %s items' % min_items))
+        return _JSON_END if self._field_name is None else _JSON_MEMBER_SEP
+
+    def _list_error(self, e):
+        if self._field_name is not None:
+            e.add_parent(self._field_name)
+        return e
+
+    def _check_key(self, key):
+        if (self._strict and
+                key not in self._data_type.definition._all_field_names_ and
+                not key.startswith('.tag')):
+            raise bv.ValidationError("unknown field '%s'" % key)
+
+    def _decode_struct(self):
+        """
+        Decodes the struct from the values of its members, except for the
+        list, which is left unset.
+        """
+        definition = self._data_type.definition
+        ins = definition()
+        absent = []
+        for field_name, field_data_type in definition._all_fields_:
+            if field_name == self._field_name:
+                if not (self._list_seen or self._nullable):
+                    raise bv.ValidationError(
+                        "missing required field '%s'" % field_name)
+                continue
+            if field_name not in self._members:
+                absent.append(field_name)
+                continue
+            decode = _get_decoder(
+                field_data_type, self._strict, self._old_style, False)
+            try:
+                setattr(ins, field_name, decode(self._members[field_name],
+                                                self._alias_validators))
+            except bv.ValidationError as e:
+                e.add_parent(field_name)
+                raise
+        if absent:
+            _decode_absent_struct_fields(ins, definition, absent)
+        return ins
+
+
+# --------------------------------------------------------------
+# Batch JSON Encoder and Decoder
+
+try:
+    from concurrent import futures
+except ImportError:
+    # Python 2 without the futures backport. Batches are always processed in
+    # the calling process.
+    futures = None
+
+# Number of items that are sent to a worker process at a time.
+_PARALLEL_CHUNK_SIZE = 1024
+
+
+def json_encode_many(data_type, objs, alias_validators=None, old_style=False,
+                     backend=None, parallel_threshold=None, max_workers=None):
+    """Encodes each object of an iterable into JSON like json_encode(), and
+    returns an iterator of the results in order. The encoder is looked up
+    once for the whole batch.
+
+    Args:
+        objs: An iterable of objects that data_type validates.
+        parallel_threshold (Optional[int]): If set, and objs has at least this
+            many objects, they are encoded in chunks by a pool of worker
+            processes, which import the modules of the generated classes that
+            data_type refers to when they start. The objects, data_type and
+            alias_validators must then be picklable, and backend must be
+            registered in the workers as well. Since the objects are pickled
+            to and from the workers, this only pays off for objects that are
+            slow to encode. Requires concurrent.futures.
+        max_workers (Optional[int]): The number of worker processes. Defaults
+            to the number of CPUs.
+
+    See json_encode() for the other arguments. If an object fails
+    validation, the ValidationError is raised once the results for the
+    objects before it have been returned. The index of the object is the
+    first parent in its path, as in "[3].entries.name: ...".
+    """
+    backend = get_json_backend(backend)
+    return _process_many(
+        _json_encode_chunk, data_type, objs,
+        (alias_validators, old_style, backend),
+        parallel_threshold, max_workers)
+
+
+def json_decode_many(data_type, serialized_objs, alias_validators=None,
+                     strict=True, old_style=False, backend=None,
+                     parallel_threshold=None, max_workers=None):
+    """Performs the reverse operation of json_encode_many.
+
+    Args:
+        serialized_objs: An iterable of JSON strings to deserialize.
+
+    See json_decode() and json_encode_many() for the other arguments.
+    """
+    backend = get_json_backend(backend)
+    return _process_many(
+        _json_decode_chunk, data_type, serialized_objs,
+        (alias_validators, strict, old_style, backend),
+        parallel_threshold, max_workers)
+
+
+def _json_encode_chunk(data_type, objs, start, alias_validators, old_style,
+                       backend):
+    """
+    Returns a tuple of the JSON of objs up to the first one that fails
+    validation, and the ValidationError of that one or None. start is the
+    index of the first object in the batch. backend is a JsonBackend, or the
+    name of one in worker processes.
+    """
+    validate = _top_level_validator(data_type)
+    encode = _get_encoder(data_type, old_style, False)
+    dumps = get_json_backend(backend).dumps
+    results = []
+    for i, obj in enumerate(objs):
+        try:
+            validate(obj)
+            results.append(dumps(encode(obj, alias_validators)))
+        except bv.ValidationError as e:
+            e.add_parent('[%d]' % (start + i))
+            return results, e
+    return results, None
+
+
+def _json_decode_chunk(data_type, serialized_objs, start, alias_validators,
+                       strict, old_style, backend):
+    """
+    See _json_encode_chunk().
+    """
+    decode = _get_decoder(data_type, strict, old_style, False)
+    loads = get_json_backend(backend).loads
+    results = []
+    for i, serialized_obj in enumerate(serialized_objs):
+        try:
+            try:
+                obj = loads(serialized_obj)
+            except ValueError:
+                raise bv.ValidationError('could not decode input as JSON')
+            results.append(decode(obj, alias_validators))
+        except bv.ValidationError as e:
+            e.add_parent('[%d]' % (start + i))
+            return results, e
+    return results, None
+
+
+def _process_many(process_chunk, data_type, items, args, parallel_threshold,
+                  max_workers):
+    """
+    Returns an iterator of the results of calling
+    `process_chunk(data_type, chunk, start, *args)` on the items, in chunks
+    that are processed by worker processes if there are at least
+    parallel_threshold items. Only as many items are read ahead as the
+    threshold and the chunks in flight require.
+    """
+    items = iter(items)
+    if parallel_threshold is None or futures is None:
+        head = []
+    else:
+        head = list(itertools.islice(items, parallel_threshold))
+    if head and len(head) >= parallel_threshold:
+        results = _process_many_parallel(
+            process_chunk, data_type, itertools.chain(head, items), args,
+            max_workers)
+    else:
+        results = _process_many_serial(
+            process_chunk, data_type, itertools.chain(head, items), args)
+    return results
+
+
+def _process_many_serial(process_chunk, data_type, items, args):
+    start = 0
+    while True:
+        chunk = list(itertools.islice(items, _PARALLEL_CHUNK_SIZE))
+        if not chunk:
+            return
+        results, error = process_chunk(data_type, chunk, start, *args)
+        for result in results:
+            yield result
+        if error is not None:
+            raise error
+        start += len(chunk)
+
+
+def _process_many_parallel(process_chunk, data_type, items, args,
+                           max_workers):
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    # Backends are looked up by name in the workers.
+    args = tuple(arg.name if isinstance(arg, JsonBackend) else arg
+                 for arg in args)
+    kwargs = {}
+    if sys.version_info >= (3, 7):
+        kwargs.update(initializer=_import_modules,
+                      initargs=(_definition_modules(data_type),))
+    executor = futures.ProcessPoolExecutor(max_workers, **kwargs)
+    try:
+        # Chunks are submitted as earlier ones complete, so that at most two
+        # per worker are held in memory.
+        pending = collections.deque()
+        start = 0
+        while True:
+            while len(pending) < 2 * max_workers:
+                chunk = list(itertools.islice(items, _PARALLEL_CHUNK_SIZE))
+                if not chunk:
+                    break
+                pending.append(executor.submit(
+                    process_chunk, data_type, chunk, start, *args))
+                start += len(chunk)
+            if not pending:
+                return
+            results, error = pending.popleft().result()
+            for result in results:
+                yield result
+            if error is not None:
+                raise error
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def _definition_modules(data_type, seen=None):
+    """
+    Returns the names of the modules that define the generated classes that
+    data_type refers to.
+    """
+    if seen is None:
+        seen = set()
+    if isinstance(data_type, bv.Nullable):
+        return _definition_modules(data_type.validator, seen)
+    elif isinstance(data_type, bv.List):
+        return _definition_modules(data_type.item_validator, seen)
+    elif not isinstance(data_type, (bv.Struct, bv.Union)):
+        return []
+    definition = data_type.definition
+    if definition in seen:
+        return []
+    seen.add(definition)
+    modules = [definition.__module__]
+    if isinstance(data_type, bv.Union):
+        members = list(definition._tagmap.values())
+    else:
+        members = [
+            field_data_type
+            for _, field_data_type in definition._all_fields_]
+        if isinstance(data_type, bv.StructTree):
+            members.extend(
+                subtype for _, subtype in
+                definition._pytype_to_tag_and_subtype_.values())
+    for member in members:
+        for module in _definition_modules(member, seen):
+            if module not in modules:
+                modules.append(module)
+    return modules
+
+
+def _import_modules(module_names):
+    for module_name in module_names:
+        importlib.import_module(module_name)
+
+
+# --------------------------------------------------------------
+# JSON Attachments
+#
+# In attachment mode, Bytes values of at least a threshold length aren't
+# base64-encoded. Instead, they're replaced by a reference such as
+# {".attachment": 0}, which is the index of the raw value in a list of
+# attachments that's transferred alongside the JSON, for example as the parts
+# of a multipart body. The Bytes encoders and decoders find the attachments of
+# the current call in _attachment_state.
+
+# Key of the JSON object that refers to an attachment.
+_ATTACHMENT_KEY = '.attachment'
+# Minimum length of the Bytes values that json_encode_with_attachments()
+# sends as attachments by default.
+_ATTACHMENT_THRESHOLD = 4 * 1024
+
+
+class _AttachmentState(threading.local):
+    # While encoding, the list that attachments are appended to, and the
+    # minimum length of an attachment.
+    collected = None
+    threshold = None
+    # While decoding, the sequence of attachments that references resolve to.
+    supplied = None
+
+
+_attachment_state = _AttachmentState()
+
+
+def json_encode_with_attachments(
+        data_type, obj, alias_validators=None, old_style=False, backend=None,
+        threshold=_ATTACHMENT_THRESHOLD):
+    """Encodes an object into JSON like json_encode(), but sends Bytes values
+    of at least threshold bytes as attachments instead of base64-encoding
+    them.
+
+    Args:
+        threshold (int): The minimum length of the Bytes values that are sent
+            as attachments. Shorter ones stay inline.
+
+    Returns:
+        Tuple[str, List[memoryview]]: The JSON-encoded object, and the
+        attachments that it refers to, in order. The attachments are views of
+        the values in obj, so they aren't copied, and must be sent before the
+        values are modified.
+
+    See json_encode() for the other arguments.
+    """
+    state = _attachment_state
+    saved = state.collected, state.threshold
+    collected = state.collected = []
+    state.threshold = threshold
+    try:
+        serialized = json_encode(
+            data_type, obj, alias_validators, old_style, backend)
+    finally:
+        state.collected, state.threshold = saved
+    return serialized, collected
+
+
+def json_decode_with_attachments(
+        data_type, serialized_obj, attachments, alias_validators=None,
+        strict=True, old_style=False, backend=None, trusted=False):
+    """Performs the reverse operation of json_encode_with_attachments().
+
+    Args:
+        attachments: A sequence of bytes-like objects that the attachment
+            references in serialized_obj refer to by index.
+
+    Returns:
+        See json_decode(). Bytes values that were sent as attachments are
+        decoded into memoryviews of the attachments, rather than copies. Inline
+        values are decoded into bytes as usual.
+
+    See json_decode() for the other arguments. Fields are always decoded up
+    front, since the attachments aren't kept for lazy decoding.
+    """
+    state = _attachment_state
+    saved = state.supplied
+    state.supplied = attachments
+    try:
+        return json_decode(data_type, serialized_obj, alias_validators,
+                           strict, old_style, backend, trusted=trusted)
+    finally:
+        state.supplied = saved
 
 
-def json_compat_obj_decode(
-        data_type, obj, alias_validators=None, strict=True, old_style=False,
-        for_msgpack=False):
+def _resolve_attachment(ref):
     """
-    Decodes a JSON-compatible object based on its data type into a
-    representative Python object.
+    Returns a memoryview of the attachment that a decoded reference refers
+    to.
+    """
+    supplied = _attachment_state.supplied
+    if supplied is None:
+        raise bv.ValidationError(
+            'unexpected attachment reference outside of '
+            'json_decode_with_attachments()')
+    index = ref.get(_ATTACHMENT_KEY)
+    if (len(ref) != 1 or not isinstance(index, six.integer_types) or
+            isinstance(index, bool)):
+        raise bv.ValidationError('invalid attachment reference')
+    if not 0 <= index < len(supplied):
+        raise bv.ValidationError(
+            'attachment %d does not exist, there are %d'
+            % (index, len(supplied)))
+    return memoryview(supplied[index])
+
+
+# --------------------------------------------------------------
+# Binary Serializer
+#
+# A compact format for peers that share the same specs. Values are written
+# without names or type information, as determined by their validators:
+#
+# - Void: nothing.
+# - Boolean: a byte of 0 or 1.
+# - Integer: a varint, which stores 7 bits per byte starting with the least
+#   significant ones, and sets the high bit of all bytes but the last. Values
+#   of signed types are zigzag-encoded first, so that small negative numbers
+#   stay short.
+# - Float: 8 bytes, little-endian IEEE 754.
+# - String, Bytes: the length in bytes as a varint, then the UTF-8 encoded
+#   string or the bytes.
+# - Timestamp: the zigzag-encoded number of microseconds since the Unix epoch
+#   in UTC, as a varint.
+# - List: the number of items as a varint, then the items.
+# - Nullable: a byte of 0 for null, or of 1 followed by the value.
+# - Struct: for each field that is set, the varint of its position in
+#   _all_fields_ plus one and then its value, terminated by a 0 byte.
+# - Struct with enumerated subtypes: the varint of the position of the
+#   subtype among the subtypes sorted by tag, then the struct.
+# - Union: the varint of the position of the tag among the sorted tags, then
+#   the value of the member, if any.
+#
+# Messages start with the 8-byte fingerprint of the schema of the data type,
+# unless disabled, so that a peer with a different schema rejects them.
+
+_float_struct = struct.Struct('<d')
+_epoch = datetime.datetime(1970, 1, 1)
+# Length of a schema fingerprint in bytes.
+_FINGERPRINT_SIZE = 8
+
+
+def binary_encode(data_type, obj, alias_validators=None, fingerprint=True):
+    """Encodes an object into the compact binary format based on its type.
 
     Args:
-        data_type (Validator): Validator for serialized_obj.
-        obj: The JSON-compatible object to decode based on data_type.
-        strict (bool): If strict, then unknown struct fields will raise an
-            error, and unknown union variants will raise an error even if a
-            catch all field is specified. See json_decode() for more.
+        data_type (Validator): Validator for obj.
+        obj (object): Object to be serialized.
+        alias_validators (Optional[Mapping[bv.Validator, Callable[[], None]]]):
+            Custom validation functions. These must raise bv.ValidationError on
+            failure.
+        fingerprint (bool): Whether to start the message with the fingerprint
+            of the schema of data_type. Disable it only if the peers have
+            agreed on the schema by other means.
 
     Returns:
-        See json_decode().
+        bytes: The encoded object.
+
+    Any object that json_encode() can encode can be encoded, and is
+    validated the same way. Unlike in JSON, timestamps keep their
+    microseconds regardless of their format.
     """
-    if isinstance(data_type, bv.Primitive):
-        return _make_stone_friendly(
-            data_type, obj, alias_validators, strict, True, for_msgpack)
-    else:
-        return _json_compat_obj_decode_helper(
-            data_type, obj, alias_validators, strict, old_style, for_msgpack)
+    _top_level_validator(data_type)(obj)
+    out = bytearray()
+    if fingerprint:
+        out += binary_schema_fingerprint(data_type)
+    _get_binary_encoder(data_type)(obj, alias_validators, out)
+    return bytes(out)
+
 
+def binary_decode(data_type, serialized_obj, alias_validators=None,
+                  fingerprint=True):
+    """Performs the reverse operation of binary_encode.
 
-def _json_compat_obj_decode_helper(
-        data_type, obj, alias_validators, strict, old_style, for_msgpack):
+    Args:
+        serialized_obj (Union[bytes, bytearray, memoryview]): The encoded
+            object.
+
+    See binary_encode() for the other arguments, and json_decode() for the
+    returned object. Decoding is always strict, since unknown fields and tags
+    can't be skipped, and a ValidationError is raised if the fingerprint
+    doesn't match.
     """
-    See json_compat_obj_decode() for argument descriptions.
+    if six.PY2 or not isinstance(serialized_obj, (bytes, bytearray)):
+        # Indexing must return ints.
+        serialized_obj = bytearray(serialized_obj)
+    pos = 0
+    if fingerprint:
+        pos = _FINGERPRINT_SIZE
+        if (serialized_obj[:pos] !=
+                bytearray(binary_schema_fingerprint(data_type))):
+            raise bv.ValidationError('schema fingerprint mismatch')
+    try:
+        obj, pos = _get_binary_decoder(data_type)(
+            serialized_obj, pos, alias_validators)
+    except IndexError:
+        raise bv.ValidationError('unexpected end of input')
+    if pos != len(serialized_obj):
+        raise bv.ValidationError('unexpected data after value')
+    return obj
+
+
+def binary_schema_fingerprint(data_type):
     """
-    if isinstance(data_type, bv.StructTree):
-        return _decode_struct_tree(
-            data_type, obj, alias_validators, strict, for_msgpack)
-    elif isinstance(data_type, bv.Struct):
-        return _decode_struct(
-            data_type, obj, alias_validators, strict, old_style, for_msgpack)
-    elif isinstance(data_type, bv.Union):
-        if old_style:
-            return _decode_union_old(
-                data_type, obj, alias_validators, strict, for_msgpack)
-        else:
-            return _decode_union(
-                data_type, obj, alias_validators, strict, for_msgpack)
+    Returns the 8-byte fingerprint of the schema of data_type, as far as it
+    affects the binary format. It changes if a field, tag or subtype is
+    added, removed, renamed or reordered, or if the type of one changes.
+    """
+    owner = _plan_owner(data_type)
+    key = (type(data_type), 'fingerprint')
+    plans = _binary_plans.get(owner)
+    if plans is None:
+        plans = _binary_plans.setdefault(owner, {})
+    try:
+        return plans[key]
+    except KeyError:
+        pass
+    schema = _binary_schema(data_type, set())
+    fingerprint = plans[key] = hashlib.sha256(
+        schema.encode('utf-8')).digest()[:_FINGERPRINT_SIZE]
+    return fingerprint
+
+
+def _binary_schema(data_type, seen):
+    """
+    Returns a canonical description of data_type. User-defined types are
+    described once and referred to by name afterwards.
+    """
+    if data_type is None:
+        return 'Void'
     elif isinstance(data_type, bv.List):
-        return _decode_list(
-            data_type, obj, alias_validators, strict, old_style, for_msgpack)
+        return 'List(%s)' % _binary_schema(data_type.item_validator, seen)
     elif isinstance(data_type, bv.Nullable):
-        return _decode_nullable(
-            data_type, obj, alias_validators, strict, old_style, for_msgpack)
-    elif isinstance(data_type, bv.Primitive):
-        # Set validate to false because validation will be done by the
-        # containing struct or union when the field is assigned.
-        return _make_stone_friendly(
-            data_type, obj, alias_validators, strict, False, for_msgpack)
-    else:
-        raise AssertionError('Cannot handle type %r.' % data_type)
+        return 'Nullable(%s)' % _binary_schema(data_type.validator, seen)
+    elif isinstance(data_type, bv.Integer):
+        return 'Int' if data_type.minimum < 0 else 'UInt'
+    elif isinstance(data_type, bv.Real):
+        return 'Real'
+    elif not isinstance(data_type, (bv.Struct, bv.Union)):
+        return type(data_type).__name__
+    definition = data_type.definition
+    name = definition.__name__
+    if definition in seen:
+        return name
+    seen.add(definition)
+    if isinstance(data_type, bv.Union):
+        return 'union %s{%s}' % (name, ','.join(
+            '%s:%s' % (tag, _binary_schema(field_data_type, seen))
+            for tag, field_data_type in sorted(definition._tagmap.items())))
+    schema = 'struct %s{%s}' % (name, ','.join(
+        '%s:%s' % (field_name, _binary_schema(field_data_type, seen))
+        for field_name, field_data_type in definition._all_fields_))
+    if isinstance(data_type, bv.StructTree):
+        schema += '[%s]' % ','.join(
+            '%s:%s' % (tag, _binary_schema(subtype, seen))
+            for tag, subtype in _binary_subtypes(data_type))
+    return schema
 
 
-def _decode_struct(
-        data_type, obj, alias_validators, strict, old_style, for_msgpack):
+def _binary_subtypes(data_type):
     """
-    The data_type argument must be a Struct.
-    See json_compat_obj_decode() for argument descriptions.
+    Returns a list of (tag, subtype) for the serializable subtypes of a
+    StructTree, sorted by tag.
     """
-    if obj is None and data_type.has_default():
-        return data_type.get_default()
-    elif not isinstance(obj, dict):
-        raise bv.ValidationError('expected object, got %s' %
-                                 bv.generic_type_name(obj))
-    if strict:
-        for key in obj:
-            if (key not in data_type.definition._all_field_names_ and
-                    not key.startswith('.tag')):
-                raise bv.ValidationError("unknown field '%s'" % key)
-    ins = data_type.definition()
-    _decode_struct_fields(
-        ins, data_type.definition._all_fields_, obj, alias_validators, strict,
-        old_style, for_msgpack)
-    # Check that all required fields have been set.
-    data_type.validate_fields_only(ins)
-    return ins
+    return sorted(
+        (tags[0], subtype) for tags, subtype in
+        data_type.definition._pytype_to_tag_and_subtype_.values()
+        if not isinstance(subtype, bv.StructTree))
 
 
-def _decode_struct_fields(
-        ins, fields, obj, alias_validators, strict, old_style, for_msgpack):
-    """
-    Args:
-        ins: An instance of the class representing the data type being decoded.
-            The object will have its fields set.
-        fields: A tuple of (field_name: str, field_validator: Validator)
-        obj (dict): JSON-compatible dict that is being decoded.
-        strict (bool): See :func:`json_compat_obj_decode`.
+def _write_varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
 
-    Returns:
-        None: `ins` has its fields set based on the contents of `obj`.
+
+def _read_varint(buf, pos):
+    b = buf[pos]
+    if b < 0x80:
+        return b, pos + 1
+    n = b & 0x7f
+    shift = 7
+    while True:
+        pos += 1
+        b = buf[pos]
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos + 1
+        shift += 7
+
+
+def _read_bytes(buf, pos):
     """
-    for name, field_data_type in fields:
-        if name in obj:
-            try:
-                v = _json_compat_obj_decode_helper(
-                    field_data_type, obj[name], alias_validators, strict,
-                    old_style, for_msgpack)
-                setattr(ins, name, v)
-            except bv.ValidationError as e:
-                e.add_parent(name)
-                raise
-        elif field_data_type.has_default():
-            setattr(ins, name, field_data_type.get_default())
+    Returns a tuple of the slice of buf that holds a length-prefixed value,
+    and the position after it.
+    """
+    size, pos = _read_varint(buf, pos)
+    end = pos + size
+    if end > len(buf):
+        raise bv.ValidationError('unexpected end of input')
+    return buf[pos:end], end
+
+
+# Compiled binary encoders and decoders, cached the same way as
+# _encoder_plans, along with the fingerprints of schemas.
+_binary_plans = weakref.WeakKeyDictionary()
 
 
-def _decode_union(data_type, obj, alias_validators, strict, for_msgpack):
+def _get_binary_encoder(data_type):
     """
-    The data_type argument must be a Union.
-    See json_compat_obj_decode() for argument descriptions.
+    Returns a function `encode(obj, alias_validators, out)` that appends the
+    binary representation of an already type-checked obj to the bytearray
+    out. The function is compiled once per data type.
     """
-    val = None
-    if isinstance(obj, six.string_types):
-        # Handles the shorthand format where the union is serialized as only
-        # the string of the tag.
-        tag = obj
-        if tag in data_type.definition._tagmap:
-            val_data_type = data_type.definition._tagmap[tag]
-            if not isinstance(val_data_type, (bv.Void, bv.Nullable)):
-                raise bv.ValidationError(
-                    "expected object for '%s', got symbol" % tag)
-            if tag == data_type.definition._catch_all:
-                raise bv.ValidationError(
-                    "unexpected use of the catch-all tag '%s'" % tag)
+    owner = _plan_owner(data_type)
+    key = (type(data_type), 'encode')
+    try:
+        return _binary_plans[owner][key]
+    except KeyError:
+        pass
+
+    def compile_plan():
+        # See _get_encoder() for why registration precedes compilation.
+        if isinstance(data_type, bv.StructTree):
+            return _compile_binary_struct_tree_encoder(data_type)
+        elif isinstance(data_type, bv.Struct):
+            return _compile_binary_struct_encoder(data_type)
+        elif isinstance(data_type, bv.Union):
+            return _compile_binary_union_encoder(data_type)
+        elif isinstance(data_type, bv.List):
+            return _compile_binary_list_encoder(data_type), None
+        elif isinstance(data_type, bv.Nullable):
+            return _compile_binary_nullable_encoder(data_type), None
+        elif isinstance(data_type, bv.Primitive):
+            return _compile_binary_primitive_encoder(data_type), None
         else:
-            if not strict and data_type.definition._catch_all:
-                tag = data_type.definition._catch_all
-            else:
-                raise bv.ValidationError("unknown tag '%s'" % tag)
-    elif isinstance(obj, dict):
-        tag, val = _decode_union_dict(
-            data_type, obj, alias_validators, strict, for_msgpack)
-    else:
-        raise bv.ValidationError("expected string or object, got %s" %
-                                 bv.generic_type_name(obj))
-    return data_type.definition(tag, val)
+            raise AssertionError('Unsupported data type %r' %
+                                 type(data_type).__name__)
+    return _compile_plan(
+        _owner_plans(_binary_plans, owner), key, compile_plan)
 
 
-def _decode_union_dict(data_type, obj, alias_validators, strict, for_msgpack):
-    if '.tag' not in obj:
-        raise bv.ValidationError("missing '.tag' key")
-    tag = obj['.tag']
-    if not isinstance(tag, six.string_types):
-        raise bv.ValidationError(
-            'tag must be string, got %s' % bv.generic_type_name(tag))
+def _compile_binary_list_encoder(data_type):
+    validate = _list_validator(data_type)
+    encode_item = _get_binary_encoder(data_type.item_validator)
 
-    if tag not in data_type.definition._tagmap:
-        if not strict and data_type.definition._catch_all:
-            return data_type.definition._catch_all, None
+    def encode_list(obj, alias_validators, out):
+        # See _compile_list_encoder().
+        obj = validate(obj)
+        _write_varint(out, len(obj))
+        for item in obj:
+            encode_item(item, alias_validators, out)
+    return encode_list
+
+
+def _compile_binary_nullable_encoder(data_type):
+    encode_value = _get_binary_encoder(data_type.validator)
+
+    def encode_nullable(obj, alias_validators, out):
+        if obj is None:
+            out.append(0)
         else:
-            raise bv.ValidationError("unknown tag '%s'" % tag)
-    if tag == data_type.definition._catch_all:
-        raise bv.ValidationError(
-            "unexpected use of the catch-all tag '%s'" % tag)
+            out.append(1)
+            encode_value(obj, alias_validators, out)
+    return encode_nullable
 
-    val_data_type = data_type.definition._tagmap[tag]
-    if isinstance(val_data_type, bv.Nullable):
-        val_data_type = val_data_type.validator
-        nullable = True
+
+def _compile_binary_primitive_encoder(data_type):
+    if isinstance(data_type, bv.Void):
+        def write(val, out):
+            pass
+    elif isinstance(data_type, bv.Boolean):
+        def write(val, out):
+            out.append(1 if val else 0)
+    elif isinstance(data_type, bv.Integer) and data_type.minimum < 0:
+        def write(val, out):
+            val = int(val)
+            _write_varint(out, val << 1 if val >= 0 else (-val << 1) - 1)
+    elif isinstance(data_type, bv.Integer):
+        def write(val, out):
+            _write_varint(out, int(val))
+    elif isinstance(data_type, bv.Real):
+        def write(val, out):
+            out += _float_struct.pack(val)
+    elif isinstance(data_type, bv.String):
+        def write(val, out):
+            val = val.encode('utf-8')
+            _write_varint(out, len(val))
+            out += val
+    elif isinstance(data_type, bv.Bytes):
+        def write(val, out):
+            _write_varint(out, len(val))
+            out += val
+    elif isinstance(data_type, bv.Timestamp):
+        def write(val, out):
+            if val.tzinfo is not None:
+                val = val.replace(tzinfo=None)
+            delta = val - _epoch
+            val = ((delta.days * 86400 + delta.seconds) * 1000000 +
+                   delta.microseconds)
+            _write_varint(out, val << 1 if val >= 0 else (-val << 1) - 1)
     else:
-        nullable = False
+        raise AssertionError('Unsupported data type %r' %
+                             type(data_type).__name__)
 
-    if isinstance(val_data_type, bv.Void):
-        if tag in obj:
-            if obj[tag] is not None:
-                raise bv.ValidationError('expected null, got %s' %
-                                         bv.generic_type_name(obj[tag]))
-        for key in obj:
-            if key != tag and key != '.tag':
-                raise bv.ValidationError("unexpected key '%s'" % key)
-        val = None
-    elif isinstance(val_data_type,
-                    (bv.Primitive, bv.List, bv.StructTree, bv.Union)):
-        if tag in obj:
-            raw_val = obj[tag]
+    def encode_primitive(val, alias_validators, out):
+        if alias_validators is not None and data_type in alias_validators:
+            alias_validators[data_type](val)
+        write(val, out)
+    return encode_primitive
+
+
+def _compile_binary_struct_encoder(data_type):
+    """
+    The data_type argument must be a Struct or StructTree.
+    """
+    # Each entry is (field_name, presence_key, key, encode), where key is the
+    # encoded field ordinal. Since null fields are left out, nullable fields
+    # are encoded as their wrapped type.
+    fields = []
+
+    def encode_struct(obj, alias_validators, out):
+        for field_name, presence_key, key, encode in fields:
+            try:
+                val = getattr(obj, field_name)
+            except AttributeError as e:
+                raise bv.ValidationError(e.args[0])
+            if val is not None and getattr(obj, presence_key):
+                out += key
+                try:
+                    encode(val, alias_validators, out)
+                except bv.ValidationError as e:
+                    e.add_parent(field_name)
+                    raise
+        out.append(0)
+
+    def compile_members():
+        for i, (field_name, field_data_type) in enumerate(
+                data_type.definition._all_fields_):
+            key = bytearray()
+            _write_varint(key, i + 1)
+            if isinstance(field_data_type, bv.Nullable):
+                field_data_type = field_data_type.validator
+            fields.append(
+                (field_name, '_%s_present' % field_name, bytes(key),
+                 _get_binary_encoder(field_data_type)))
+    return encode_struct, compile_members
+
+
+def _compile_binary_struct_tree_encoder(data_type):
+    """
+    The data_type argument must be a StructTree.
+    """
+    # Map of Python class to (key, encode), where key is the encoded subtype
+    # ordinal.
+    subtypes = {}
+
+    def encode_struct_tree(obj, alias_validators, out):
+        try:
+            key, encode = subtypes[type(obj)]
+        except KeyError:
+            raise AssertionError('%r is not a serializable subtype of %r.' %
+                                 (type(obj), data_type.definition))
+        out += key
+        encode(obj, alias_validators, out)
+
+    def compile_members():
+        for i, (_, subtype) in enumerate(_binary_subtypes(data_type)):
+            key = bytearray()
+            _write_varint(key, i)
+            subtypes[subtype.definition] = (
+                bytes(key), _get_binary_encoder(subtype))
+    return encode_struct_tree, compile_members
+
+
+def _compile_binary_union_encoder(data_type):
+    """
+    The data_type argument must be a Union.
+    """
+    # Map of tag to (key, encode), where key is the encoded tag ordinal and
+    # encode is None for void members.
+    variants = {}
+
+    def encode_union(obj, alias_validators, out):
+        tag = obj._tag
+        if tag is None:
+            raise bv.ValidationError('no tag set')
+        key, encode = variants[tag]
+        out += key
+        if encode is not None:
             try:
-                val = _json_compat_obj_decode_helper(
-                    val_data_type, raw_val, alias_validators, strict, False, for_msgpack)
+                encode(obj._value, alias_validators, out)
             except bv.ValidationError as e:
                 e.add_parent(tag)
                 raise
-        else:
-            # Check no other keys
-            if nullable:
-                val = None
+
+    def compile_members():
+        for i, (tag, field_data_type) in enumerate(
+                sorted(data_type.definition._tagmap.items())):
+            key = bytearray()
+            _write_varint(key, i)
+            if field_data_type is None or isinstance(field_data_type, bv.Void):
+                encode = None
             else:
-                raise bv.ValidationError("missing '%s' key" % tag)
-        for key in obj:
-            if key != tag and key != '.tag':
-                raise bv.ValidationError("unexpected key '%s'" % key)
-    elif isinstance(val_data_type, bv.Struct):
-        if nullable and len(obj) == 1:  # only has a .tag key
-            val = None
+                encode = _get_binary_encoder(field_data_type)
+            variants[tag] = (bytes(key), encode)
+    return encode_union, compile_members
+
+
+def _get_binary_decoder(data_type):
+    """
+    Returns a function `decode(buf, pos, alias_validators)` that decodes the
+    value that starts at position pos of the bytearray or bytes buf, and
+    returns a tuple of the value and the position after it. The function is
+    compiled once per data type.
+    """
+    owner = _plan_owner(data_type)
+    key = (type(data_type), 'decode')
+    try:
+        return _binary_plans[owner][key]
+    except KeyError:
+        pass
+
+    def compile_plan():
+        # See _get_encoder() for why registration precedes compilation.
+        if isinstance(data_type, bv.StructTree):
+            return _compile_binary_struct_tree_decoder(data_type)
+        elif isinstance(data_type, bv.Struct):
+            return _compile_binary_struct_decoder(data_type)
+        elif isinstance(data_type, bv.Union):
+            return _compile_binary_union_decoder(data_type)
+        elif isinstance(data_type, bv.List):
+            return _compile_binary_list_decoder(data_type), None
+        elif isinstance(data_type, bv.Nullable):
+            return _compile_binary_nullable_decoder(data_type), None
+        elif isinstance(data_type, bv.Primitive):
+            return _compile_binary_primitive_decoder(data_type), None
         else:
-            # assume it's not null
-            raw_val = obj
+            raise AssertionError('Unsupported data type %r' %
+                                 type(data_type).__name__)
+    return _compile_plan(
+        _owner_plans(_binary_plans, owner), key, compile_plan)
+
+
+def _compile_binary_list_decoder(data_type):
+    min_items = data_type.min_items
+    max_items = data_type.max_items
+    decode_item = _get_binary_decoder(data_type.item_validator)
+
+    def decode_list(buf, pos, alias_validators):
+        size, pos = _read_varint(buf, pos)
+        if max_items is not None and size > max_items:
+            raise bv.ValidationError('list has more than %s items'
+                                     % max_items)
+        elif min_items is not None and size < min_items:
+            raise bv.ValidationError('list has fewer than %s items'
+                                     % min_items)
+        items = []
+        for _ in six.moves.range(size):
+            item, pos = decode_item(buf, pos, alias_validators)
+            items.append(item)
+        return items, pos
+    return decode_list
+
+
+def _compile_binary_nullable_decoder(data_type):
+    decode_value = _get_binary_decoder(data_type.validator)
+
+    def decode_nullable(buf, pos, alias_validators):
+        flag = buf[pos]
+        if flag == 0:
+            return None, pos + 1
+        elif flag == 1:
+            return decode_value(buf, pos + 1, alias_validators)
+        raise bv.ValidationError('invalid null flag %d' % flag)
+    return decode_nullable
+
+
+def _compile_binary_primitive_decoder(data_type):
+    validate = data_type.validate
+    if isinstance(data_type, bv.Void):
+        def read(buf, pos):
+            return None, pos
+    elif isinstance(data_type, bv.Boolean):
+        def read(buf, pos):
+            val = buf[pos]
+            if val > 1:
+                raise bv.ValidationError('invalid boolean %d' % val)
+            return val == 1, pos + 1
+    elif isinstance(data_type, bv.Integer) and data_type.minimum < 0:
+        def read(buf, pos):
+            val, pos = _read_varint(buf, pos)
+            return validate(-(val >> 1) - 1 if val & 1 else val >> 1), pos
+    elif isinstance(data_type, bv.Integer):
+        def read(buf, pos):
+            val, pos = _read_varint(buf, pos)
+            return validate(val), pos
+    elif isinstance(data_type, bv.Real):
+        def read(buf, pos):
+            end = pos + 8
+            if end > len(buf):
+                raise bv.ValidationError('unexpected end of input')
+            return validate(_float_struct.unpack_from(buf, pos)[0]), end
+    elif isinstance(data_type, bv.String):
+        def read(buf, pos):
+            val, pos = _read_bytes(buf, pos)
             try:
-                val = _json_compat_obj_decode_helper(
-                    val_data_type, raw_val, alias_validators, strict, False,
-                    for_msgpack)
-            except bv.ValidationError as e:
-                e.add_parent(tag)
-                raise
+                val = val.decode('utf-8')
+            except UnicodeDecodeError:
+                raise bv.ValidationError('invalid UTF-8 in string')
+            return validate(val), pos
+    elif isinstance(data_type, bv.Bytes):
+        def read(buf, pos):
+            val, pos = _read_bytes(buf, pos)
+            return validate(bytes(val)), pos
+    elif isinstance(data_type, bv.Timestamp):
+        def read(buf, pos):
+            val, pos = _read_varint(buf, pos)
+            val = -(val >> 1) - 1 if val & 1 else val >> 1
+            try:
+                return (_epoch + datetime.timedelta(microseconds=val),
+                        pos)
+            except OverflowError:
+                raise bv.ValidationError('timestamp out of range')
     else:
-        assert False, type(val_data_type)
-    return tag, val
+        raise AssertionError('Unsupported data type %r' %
+                             type(data_type).__name__)
+
+    def decode_primitive(buf, pos, alias_validators):
+        val, pos = read(buf, pos)
+        if alias_validators is not None and data_type in alias_validators:
+            alias_validators[data_type](val)
+        return val, pos
+    return decode_primitive
 
 
-def _decode_union_old(data_type, obj, alias_validators, strict, for_msgpack):
+def _compile_binary_struct_decoder(data_type):
     """
-    The data_type argument must be a Union.
-    See json_compat_obj_decode() for argument descriptions.
+    The data_type argument must be a Struct or StructTree.
     """
-    val = None
-    if isinstance(obj, six.string_types):
-        # Union member has no associated value
-        tag = obj
-        if tag in data_type.definition._tagmap:
-            val_data_type = data_type.definition._tagmap[tag]
-            if not isinstance(val_data_type, (bv.Void, bv.Nullable)):
-                raise bv.ValidationError(
-                    "expected object for '%s', got symbol" % tag)
-        else:
-            if not strict and data_type.definition._catch_all:
-                tag = data_type.definition._catch_all
-            else:
-                raise bv.ValidationError("unknown tag '%s'" % tag)
-    elif isinstance(obj, dict):
-        # Union member has value
-        if len(obj) != 1:
-            raise bv.ValidationError('expected 1 key, got %s' % len(obj))
-        tag = list(obj)[0]
-        raw_val = obj[tag]
-        if tag in data_type.definition._tagmap:
-            val_data_type = data_type.definition._tagmap[tag]
-            if isinstance(val_data_type, bv.Nullable) and raw_val is None:
-                val = None
-            elif isinstance(val_data_type, bv.Void):
-                if raw_val is None or not strict:
-                    # If raw_val is None, then this is the more verbose
-                    # representation of a void union member. If raw_val isn't
-                    # None, then maybe the spec has changed, so check if we're
-                    # in strict mode.
-                    val = None
-                else:
-                    raise bv.ValidationError('expected null, got %s' %
-                                             bv.generic_type_name(raw_val))
-            else:
+    definition = data_type.definition
+    # Each entry is (field_name, decode, value_attr, presence_attr), by
+    # field ordinal. See _compile_struct_decoder(). Nullable fields are
+    # decoded as their wrapped type, as they're left out when null.
+    fields = []
+
+    def decode_struct(buf, pos, alias_validators):
+        ins = definition()
+        decoded = set()
+        while True:
+            key, pos = _read_varint(buf, pos)
+            if key == 0:
+                break
+            elif key > len(fields):
+                raise bv.ValidationError('unknown field ordinal %d' % key)
+            field_name, decode, value_attr, presence_attr = fields[key - 1]
+            try:
+                val, pos = decode(buf, pos, alias_validators)
+            except bv.ValidationError as e:
+                e.add_parent(field_name)
+                raise
+            if value_attr is None:
                 try:
-                    val = _json_compat_obj_decode_helper(
-                        val_data_type, raw_val, alias_validators, strict, True,
-                        for_msgpack)
+                    setattr(ins, field_name, val)
                 except bv.ValidationError as e:
-                    e.add_parent(tag)
+                    e.add_parent(field_name)
                     raise
-        else:
-            if not strict and data_type.definition._catch_all:
-                tag = data_type.definition._catch_all
-            else:
-                raise bv.ValidationError("unknown tag '%s'" % tag)
-    else:
-        raise bv.ValidationError("expected string or object, got %s" %
-                                 bv.generic_type_name(obj))
-    return data_type.definition(tag, val)
+            elif val is not None:
+                setattr(ins, value_attr, val)
+                if presence_attr is not None:
+                    setattr(ins, presence_attr, True)
+            decoded.add(key)
+        if len(decoded) < len(fields):
+            _decode_absent_struct_fields(
+                ins, definition,
+                [field[0] for i, field in enumerate(fields)
+                 if i + 1 not in decoded])
+        return ins, pos
+
+    def compile_members():
+        for field_name, field_data_type in definition._all_fields_:
+            if isinstance(field_data_type, bv.Nullable):
+                field_data_type = field_data_type.validator
+            value_attr, presence_attr = _struct_field_attrs(
+                definition, field_name)
+            fields.append((field_name, _get_binary_decoder(field_data_type),
+                           value_attr, presence_attr))
+    return decode_struct, compile_members
 
 
-def _decode_struct_tree(data_type, obj, alias_validators, strict, for_msgpack):
+def _compile_binary_struct_tree_decoder(data_type):
     """
     The data_type argument must be a StructTree.
-    See json_compat_obj_decode() for argument descriptions.
     """
-    subtype = _determine_struct_tree_subtype(data_type, obj, strict)
-    return _decode_struct(
-        subtype, obj, alias_validators, strict, False, for_msgpack)
+    # The decoders of the subtypes, by ordinal.
+    subtypes = []
 
+    def decode_struct_tree(buf, pos, alias_validators):
+        ordinal, pos = _read_varint(buf, pos)
+        if ordinal >= len(subtypes):
+            raise bv.ValidationError('unknown subtype ordinal %d' % ordinal)
+        return subtypes[ordinal](buf, pos, alias_validators)
 
-def _determine_struct_tree_subtype(data_type, obj, strict):
+    def compile_members():
+        subtypes.extend(_get_binary_decoder(subtype)
+                        for _, subtype in _binary_subtypes(data_type))
+    return decode_struct_tree, compile_members
+
+
+def _compile_binary_union_decoder(data_type):
     """
-    Searches through the JSON-object-compatible dict using the data type
-    definition to determine which of the enumerated subtypes `obj` is.
+    The data_type argument must be a Union.
     """
-    if '.tag' not in obj:
-        raise bv.ValidationError("missing '.tag' key")
-    if not isinstance(obj['.tag'], six.string_types):
-        raise bv.ValidationError('expected string, got %s' %
-                                 bv.generic_type_name(obj['.tag']),
-                                 parent='.tag')
+    # Each entry is (tag, decode), by tag ordinal, where decode is None for
+    # void members.
+    variants = []
+    make_union = [None]
 
-    # Find the subtype the tags refer to
-    full_tags_tuple = (obj['.tag'],)
-    if full_tags_tuple in data_type.definition._tag_to_subtype_:
-        subtype = data_type.definition._tag_to_subtype_[full_tags_tuple]
-        if isinstance(subtype, bv.StructTree):
-            raise bv.ValidationError("tag '%s' refers to non-leaf subtype" %
-                                     ('.'.join(full_tags_tuple)))
-        return subtype
-    else:
-        if strict:
-            # In strict mode, the entirety of the tag hierarchy should
-            # point to a known subtype.
-            raise bv.ValidationError("unknown subtype '%s'" %
-                                     '.'.join(full_tags_tuple))
+    def decode_union(buf, pos, alias_validators):
+        ordinal, pos = _read_varint(buf, pos)
+        if ordinal >= len(variants):
+            raise bv.ValidationError('unknown tag ordinal %d' % ordinal)
+        tag, decode = variants[ordinal]
+        if decode is None:
+            val = None
         else:
-            # If subtype was not found, use the base.
-            if data_type.definition._is_catch_all_:
-                return data_type
+            try:
+                val, pos = decode(buf, pos, alias_validators)
+            except bv.ValidationError as e:
+                e.add_parent(tag)
+                raise
+        return make_union[0](tag, val), pos
+
+    def compile_members():
+        make_union[0] = _union_constructor(data_type.definition)
+        for tag, field_data_type in sorted(
+                data_type.definition._tagmap.items()):
+            if field_data_type is None or isinstance(field_data_type, bv.Void):
+                decode = None
             else:
-                raise bv.ValidationError(
-                    "unknown subtype '%s' and '%s' is not a catch-all" %
-                    ('.'.join(full_tags_tuple), data_type.definition.__name__))
+                decode = _get_binary_decoder(field_data_type)
+            variants.append((tag, decode))
+    return decode_union, compile_members
+
 
+# --------------------------------------------------------------
+# MessagePack Serializer
+#
+# Values are converted to the same tree as for JSON, except that bytes are
+# left as they are. Strings are written as the msgpack str type and bytes as
+# the bin type.
+
+# Map of a msgpack type byte to (kind, struct of the value or length that
+# follows it), for the types that aren't fixed-size.
+_msgpack_formats = {
+    0xc4: ('bin', struct.Struct('>B')),
+    0xc5: ('bin', struct.Struct('>H')),
+    0xc6: ('bin', struct.Struct('>I')),
+    0xca: ('value', struct.Struct('>f')),
+    0xcb: ('value', struct.Struct('>d')),
+    0xcc: ('value', struct.Struct('>B')),
+    0xcd: ('value', struct.Struct('>H')),
+    0xce: ('value', struct.Struct('>I')),
+    0xcf: ('value', struct.Struct('>Q')),
+    0xd0: ('value', struct.Struct('>b')),
+    0xd1: ('value', struct.Struct('>h')),
+    0xd2: ('value', struct.Struct('>i')),
+    0xd3: ('value', struct.Struct('>q')),
+    0xd9: ('str', struct.Struct('>B')),
+    0xda: ('str', struct.Struct('>H')),
+    0xdb: ('str', struct.Struct('>I')),
+    0xdc: ('array', struct.Struct('>H')),
+    0xdd: ('array', struct.Struct('>I')),
+    0xde: ('map', struct.Struct('>H')),
+    0xdf: ('map', struct.Struct('>I')),
+}
+_msgpack_constants = {0xc0: None, 0xc2: False, 0xc3: True}
 
-def _decode_list(
-        data_type, obj, alias_validators, strict, old_style, for_msgpack):
+
+def _unpack_msgpack_view(view):
     """
-    The data_type argument must be a List.
-    See json_compat_obj_decode() for argument descriptions.
+    Deserializes the msgpack in a memoryview without copying its bin values,
+    which are returned as memoryview slices of it. Only used on Python 3.
     """
-    if not isinstance(obj, list):
-        raise bv.ValidationError(
-            'expected list, got %s' % bv.generic_type_name(obj))
-    return [
-        _json_compat_obj_decode_helper(
-            data_type.item_validator, item, alias_validators, strict,
-            old_style, for_msgpack)
-        for item in obj]
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    try:
+        obj, pos = _read_msgpack(view, 0)
+    except (IndexError, struct.error):
+        raise bv.ValidationError('could not decode input as msgpack')
+    if pos != len(view):
+        raise bv.ValidationError('could not decode input as msgpack')
+    return obj
 
 
-def _decode_nullable(
-        data_type, obj, alias_validators, strict, old_style, for_msgpack):
+def _read_msgpack(view, pos):
     """
-    The data_type argument must be a Nullable.
-    See json_compat_obj_decode() for argument descriptions.
+    Returns a tuple of the msgpack value that starts at position pos of the
+    memoryview, and the position after it.
     """
-    if obj is not None:
-        return _json_compat_obj_decode_helper(
-            data_type.validator, obj, alias_validators, strict, old_style,
-            for_msgpack)
+    b = view[pos]
+    pos += 1
+    if b < 0x80:
+        return b, pos
+    elif b >= 0xe0:
+        return b - 0x100, pos
+    elif b < 0x90:
+        kind = 'map'
+        size = b & 0x0f
+    elif b < 0xa0:
+        kind = 'array'
+        size = b & 0x0f
+    elif b < 0xc0:
+        kind = 'str'
+        size = b & 0x1f
+    elif b in _msgpack_constants:
+        return _msgpack_constants[b], pos
     else:
-        return None
+        try:
+            kind, fmt = _msgpack_formats[b]
+        except KeyError:
+            raise bv.ValidationError('unsupported msgpack type 0x%02x' % b)
+        size = fmt.unpack_from(view, pos)[0]
+        pos += fmt.size
+        if kind == 'value':
+            return size, pos
+    if kind == 'array':
+        items = []
+        for _ in range(size):
+            item, pos = _read_msgpack(view, pos)
+            items.append(item)
+        return items, pos
+    elif kind == 'map':
+        d = {}
+        for _ in range(size):
+            key, pos = _read_msgpack(view, pos)
+            if type(key) is not str:
+                raise bv.ValidationError('could not decode input as msgpack')
+            d[key], pos = _read_msgpack(view, pos)
+        return d, pos
+    end = pos + size
+    if end > len(view):
+        raise IndexError(end)
+    if kind == 'bin':
+        return view[pos:end], end
+    try:
+        return str(view[pos:end], 'utf-8'), end
+    except UnicodeDecodeError:
+        raise bv.ValidationError('could not decode input as msgpack')
 
 
-def _make_stone_friendly(
-        data_type, val, alias_validators, strict, validate, for_msgpack):
+def _check_msgpack_map(d):
     """
-    Convert a Python object to a type that will pass validation by its
-    validator.
-
-    Validation by ``alias_validators`` is performed even if ``validate`` is
-    false.
+    The object_hook that msgpack is unpacked with, which rejects maps with
+    keys other than strings, such as bin keys, that msgpack lets through.
     """
-    if isinstance(data_type, bv.Timestamp):
-        try:
-            ret = datetime.datetime.strptime(val, data_type.format)
-        except (TypeError, ValueError) as e:
-            raise bv.ValidationError(e.args[0])
-    elif isinstance(data_type, bv.Bytes):
-        if for_msgpack:
-            if isinstance(val, six.text_type):
-                ret = val.encode('utf-8')
-            else:
-                ret = val
-        else:
-            try:
-                ret = base64.b64decode(val)
-            except TypeError:
-                raise bv.ValidationError('invalid base64-encoded bytes')
-    elif isinstance(data_type, bv.Void):
-        if strict and val is not None:
-            raise bv.ValidationError("expected null, got value")
-        return None
-    else:
-        if validate:
-            data_type.validate(val)
-        ret = val
-    if alias_validators is not None and data_type in alias_validators:
-        alias_validators[data_type](ret)
-    return ret
+    for key in d:
+        if type(key) is not six.text_type:
+            raise bv.ValidationError('could not decode input as msgpack')
+    return d
+
 
 try:
     import msgpack
@@ -753,20 +5359,44 @@ else:
     msgpack_compat_obj_encode = functools.partial(json_compat_obj_encode,
                                                   for_msgpack=True)
 
-    def msgpack_encode(data_type, obj):
-        return msgpack.dumps(
-            msgpack_compat_obj_encode(data_type, obj), encoding='utf-8')
+    def msgpack_encode(data_type, obj, alias_validators=None):
+        """Encodes an object into msgpack based on its type.
+
+        See json_encode() for argument descriptions.
+
+        Returns:
+            bytes: msgpack-encoded object.
+        """
+        return msgpack.packb(
+            msgpack_compat_obj_encode(data_type, obj, alias_validators),
+            use_bin_type=True)
 
     msgpack_compat_obj_decode = functools.partial(json_compat_obj_decode,
                                                   for_msgpack=True)
 
     def msgpack_decode(
             data_type, serialized_obj, alias_validators=None, strict=True):
-        # We decode everything as utf-8 because we want all object keys to be
-        # unicode. Otherwise, we need to do a lot more refactoring to make
-        # json/msgpack share the same code. We expect byte arrays to fail
-        # decoding, but when they don't, we have to convert them to bytes.
-        deserialized_obj = msgpack.loads(
-            serialized_obj, encoding='utf-8', unicode_errors='ignore')
+        """Performs the reverse operation of msgpack_encode.
+
+        Args:
+            serialized_obj (Union[bytes, bytearray, memoryview]): The msgpack
+                to deserialize. On Python 3, bytes values that are decoded
+                from a bytearray or memoryview are memoryview slices of it
+                rather than copies, so it must not be modified while they're
+                in use. Since such input is parsed in Python rather than by
+                msgpack, this is only faster for messages that mostly consist
+                of large bytes values.
+
+        See json_decode() for the other arguments and the returned object.
+        """
+        if six.PY3 and isinstance(serialized_obj, (bytearray, memoryview)):
+            deserialized_obj = _unpack_msgpack_view(
+                memoryview(serialized_obj))
+        else:
+            try:
+                deserialized_obj = msgpack.unpackb(
+                    serialized_obj, raw=False, object_hook=_check_msgpack_map)
+            except (ValueError, msgpack.exceptions.UnpackException):
+                raise bv.ValidationError('could not decode input as msgpack')
         return msgpack_compat_obj_decode(
             data_type, deserialized_obj, alias_validators, strict)
@@ -16,13 +16,15 @@ from abc import ABCMeta, abstractmethod
 import datetime
 import math
 import numbers
+import operator
 import re
 import six
+import weakref
 
 if six.PY3:
     _binary_types = (bytes, memoryview)
 else:
-    _binary_types = (bytes, buffer)
+    _binary_types = (bytes, buffer, memoryview)
 
 
 class ValidationError(Exception):
@@ -105,7 +107,16 @@ class Validator(object):
 
 class Primitive(Validator):
     """A basic type that is defined by Stone."""
-    pass
+
+    def validate_type_only(self, val):
+        """Validates that val is of this data type, but unlike validate(),
+        skips constraints such as ranges, lengths and patterns. Use this only
+        for values that have been validated by whoever produced them.
+
+        Returns: A normalized value if validation succeeds.
+        Raises: ValidationError
+        """
+        return self.validate(val)
 
 
 class Boolean(Primitive):
@@ -153,6 +164,12 @@ class Integer(Primitive):
                                   % (val, self.minimum, self.maximum))
         return val
 
+    def validate_type_only(self, val):
+        if not isinstance(val, numbers.Integral):
+            raise ValidationError('expected integer, got %s'
+                                  % generic_type_name(val))
+        return val
+
     def __repr__(self):
         return '%s()' % self.__class__.__name__
 
@@ -239,6 +256,17 @@ class Real(Primitive):
                                   (val, self.maximum))
         return val
 
+    def validate_type_only(self, val):
+        if not isinstance(val, numbers.Real):
+            raise ValidationError('expected real number, got %s' %
+                                  generic_type_name(val))
+        if not isinstance(val, float):
+            try:
+                val = float(val)
+            except OverflowError:
+                raise ValidationError('too large for float')
+        return val
+
     def __repr__(self):
         return '%s()' % self.__class__.__name__
 
@@ -310,6 +338,17 @@ class String(Primitive):
                                   % (val, self.pattern))
         return val
 
+    def validate_type_only(self, val):
+        if not isinstance(val, six.string_types):
+            raise ValidationError("'%s' expected to be a string, got %s"
+                                  % (val, generic_type_name(val)))
+        if not six.PY3 and isinstance(val, str):
+            try:
+                val = val.decode('utf-8')
+            except UnicodeDecodeError:
+                raise ValidationError("'%s' was not valid utf-8")
+        return val
+
 
 class Bytes(Primitive):
 
@@ -340,6 +379,12 @@ class Bytes(Primitive):
                                   % (val, self.min_length, len(val)))
         return val
 
+    def validate_type_only(self, val):
+        if not isinstance(val, _binary_types):
+            raise ValidationError("expected bytes type, got %s"
+                                  % generic_type_name(val))
+        return val
+
 
 class Timestamp(Primitive):
     """Note that while a format is specified, it isn't used in validation
@@ -388,6 +433,7 @@ class List(Composite):
 
         self.min_items = min_items
         self.max_items = max_items
+        self._validate_numeric_items = numeric_items_validator(item_validator)
 
     def validate(self, val):
         if not isinstance(val, (tuple, list)):
@@ -398,7 +444,139 @@ class List(Composite):
         elif self.min_items is not None and len(val) < self.min_items:
             raise ValidationError('%r has fewer than %s items'
                                   % (val, self.min_items))
-        return [self.item_validator.validate(item) for item in val]
+        if self._validate_numeric_items is not None:
+            items = self._validate_numeric_items(val)
+            if items is not None:
+                return ValidatedList(items, self)
+        return ValidatedList(
+            [self.item_validator.validate(item) for item in val], self)
+
+
+_integer_types = frozenset(six.integer_types)
+_real_types = _integer_types | frozenset([float])
+
+
+def numeric_items_validator(item_validator, type_only=False):
+    """
+    Returns a function that validates the items of a list of integers or
+    real numbers with builtins that run in C, rather than one by one, or None
+    if item_validator isn't an Integer or Real.
+
+    The function returns a list of the validated items, or None if they must
+    be validated one by one: if they aren't all ints or floats, or if one of
+    them fails validation, so that the error is reported for that item. If
+    type_only is set, the items are validated as by validate_type_only().
+    """
+    if isinstance(item_validator, Integer):
+        def validate_integers(val):
+            if not val or not _integer_types.issuperset(map(type, val)):
+                return None
+            elif not type_only and (min(val) < item_validator.minimum or
+                                    max(val) > item_validator.maximum):
+                return None
+            return list(val)
+        return validate_integers
+    elif isinstance(item_validator, Real):
+        def validate_reals(val):
+            if not val or not _real_types.issuperset(map(type, val)):
+                return None
+            try:
+                items = list(map(float, val))
+            except OverflowError:
+                return None
+            if type_only:
+                return items
+            # The sum is infinite or NaN if an item is. It may also overflow,
+            # in which case the items are validated one by one for nothing.
+            total = sum(items)
+            if math.isnan(total) or math.isinf(total):
+                return None
+            elif ((item_validator.minimum is not None and
+                   min(items) < item_validator.minimum) or
+                  (item_validator.maximum is not None and
+                   max(items) > item_validator.maximum)):
+                return None
+            return items
+        return validate_reals
+    else:
+        return None
+
+
+_text_types = frozenset([six.text_type])
+
+
+def string_items_validator(item_validator):
+    """
+    Returns a function that validates a list of strings like
+    numeric_items_validator(), or None if item_validator isn't a String.
+
+    The function returns None if the items aren't all unicode strings, or if
+    one of them fails validation.
+    """
+    if not isinstance(item_validator, String):
+        return None
+
+    def validate_strings(val):
+        if not val or not _text_types.issuperset(map(type, val)):
+            return None
+        elif item_validator.max_length is not None or \
+                item_validator.min_length is not None:
+            lengths = list(map(len, val))
+            if ((item_validator.max_length is not None and
+                 max(lengths) > item_validator.max_length) or
+                    (item_validator.min_length is not None and
+                     min(lengths) < item_validator.min_length)):
+                return None
+        if item_validator.pattern and \
+                not all(map(item_validator.pattern_re.match, val)):
+            return None
+        return list(val)
+    return validate_strings
+
+
+def _invalidating(method):
+    """
+    Wraps a method of list so that it clears the validator of a
+    ValidatedList before modifying it.
+    """
+    def invalidate_and_call(self, *args):
+        self._validator = None
+        return method(self, *args)
+    invalidate_and_call.__name__ = method.__name__
+    invalidate_and_call.__doc__ = method.__doc__
+    return invalidate_and_call
+
+
+class ValidatedList(list):
+    """
+    A list returned by List.validate(). It remembers the validator that
+    validated it until it's modified in place, so that serializers can skip
+    validating it again. Copies, and pickled lists, are plain lists.
+    """
+
+    __slots__ = ['_validator']
+
+    def __init__(self, iterable=(), validator=None):
+        super(ValidatedList, self).__init__(iterable)
+        self._validator = validator
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    append = _invalidating(list.append)
+    extend = _invalidating(list.extend)
+    insert = _invalidating(list.insert)
+    pop = _invalidating(list.pop)
+    remove = _invalidating(list.remove)
+    __setitem__ = _invalidating(list.__setitem__)
+    __delitem__ = _invalidating(list.__delitem__)
+    __iadd__ = _invalidating(list.__iadd__)
+    __imul__ = _invalidating(list.__imul__)
+    if six.PY3:
+        clear = _invalidating(list.clear)
+    else:
+        __setslice__ = _invalidating(list.__setslice__)
+        __delslice__ = _invalidating(list.__delslice__)
 
 
 class Struct(Composite):
@@ -433,14 +611,14 @@ class Struct(Composite):
 
         This method assumes that the contents of each field have already been
         validated on assignment, so it's merely a presence check.
-
-        FIXME(kelkabany): Since the definition object does not maintain a list
-        of which fields are required, all fields are scanned.
         """
-        for field_name, _ in self.definition._all_fields_:
-            if not hasattr(val, field_name):
-                raise ValidationError("missing required field '%s'" %
-                                      field_name)
+        definition = self.definition
+        try:
+            check = _required_field_checks[definition]
+        except KeyError:
+            check = _required_field_checks[definition] = \
+                _compile_required_field_check(definition)
+        check(val)
 
     def validate_type_only(self, val):
         """
@@ -463,6 +641,65 @@ class Struct(Composite):
         return self.definition()
 
 
+# Functions that check that an instance of a struct class has all of its
+# required fields, keyed by the class.
+_required_field_checks = weakref.WeakKeyDictionary()
+
+
+def _compile_required_field_check(definition):
+    """
+    Returns a function that raises a ValidationError if an instance of
+    definition is missing a required field.
+
+    Generated classes list their required fields in _required_fields_, and
+    flag the fields that are set in _<field>_present slots, so the flags of
+    all required fields are read and compared at once. Other classes don't
+    distinguish fields with a default from required fields, so their getters
+    decide.
+    """
+    required = getattr(definition, '_required_fields_', None)
+    if required is None:
+        required = tuple(field_name for field_name, _
+                         in definition._all_fields_)
+        presence_attrs = None
+    else:
+        presence_attrs = ['_%s_present' % field_name
+                          for field_name in required]
+        if not all(hasattr(definition, attr) for attr in presence_attrs):
+            presence_attrs = None
+
+    if not required:
+        def check_nothing(val):
+            pass
+        return check_nothing
+    elif presence_attrs is None:
+        def check_getters(val):
+            for field_name in required:
+                if not hasattr(val, field_name):
+                    raise ValidationError("missing required field '%s'" %
+                                          field_name)
+        return check_getters
+
+    get_presence = operator.attrgetter(*presence_attrs)
+    if len(presence_attrs) == 1:
+        field_name = required[0]
+
+        def check_field(val):
+            # A pending field of a lazily decoded struct is flagged by a
+            # falsy marker rather than False, so flags are compared to False.
+            if get_presence(val) is False:
+                raise ValidationError("missing required field '%s'" %
+                                      field_name)
+        return check_field
+
+    def check_fields(val):
+        presence = get_presence(val)
+        if False in presence:
+            raise ValidationError("missing required field '%s'" %
+                                  required[presence.index(False)])
+    return check_fields
+
+
 class StructTree(Struct):
     """Validator for structs with enumerated subtypes.
 
@@ -8,6 +8,7 @@ import argparse
 import os
 import re
 import shutil
+from contextlib import contextmanager
 from stone.data_type import (
     is_alias,
     is_boolean_type,
@@ -24,6 +25,7 @@ from stone.data_type import (
     is_union_type,
     is_user_defined_type,
     is_void_type,
+    unwrap,
     unwrap_aliases,
     unwrap_nullable,
 )
@@ -60,6 +62,21 @@ _cmdline_parser.add_argument(
           '{route} for the route name. This is used to translate Stone doc '
           'references to routes to references in Python docstrings.'),
 )
+_cmdline_parser.add_argument(
+    '--json-codecs',
+    action='store_true',
+    help=('Generate an encode and a decode function for each struct and union '
+          'with field names and tags inlined. stone_serializers uses them in '
+          'place of its generic JSON serialization.'),
+)
+_cmdline_parser.add_argument(
+    '--compact-slots',
+    action='store_true',
+    help=('Give struct classes one slot per field, which holds '
+          'stone_base.ABSENT while the field is unset, rather than a value '
+          'slot and a presence flag slot. This reduces the memory used by '
+          'instances, but they can\'t be decoded lazily.'),
+)
 
 class PythonTypesGenerator(CodeGenerator):
     """Generates Python modules to represent the input Stone spec."""
@@ -149,6 +166,13 @@ class PythonTypesGenerator(CodeGenerator):
                     namespace, data_type)
                 self._generate_union_class_symbol_creators(data_type)
 
+        if self.args.json_codecs:
+            for data_type in namespace.linearize_data_types():
+                if is_struct_type(data_type):
+                    self._generate_struct_json_codec(namespace, data_type)
+                else:
+                    self._generate_union_json_codec(namespace, data_type)
+
         self._generate_routes(api.route_schema, namespace)
 
     def _generate_alias_definition(self, namespace, alias):
@@ -271,6 +295,7 @@ class PythonTypesGenerator(CodeGenerator):
             self._generate_struct_class_slots(data_type)
             self._generate_struct_class_has_required_fields(data_type)
             self._generate_struct_class_init(data_type)
+            self._generate_struct_class_from_rows(data_type)
             self._generate_struct_class_properties(ns, data_type)
             self._generate_struct_class_repr(data_type)
         if data_type.has_enumerated_subtypes():
@@ -295,13 +320,20 @@ class PythonTypesGenerator(CodeGenerator):
 
         Slots are an optimization in Python. They reduce the memory footprint
         of instances since attributes cannot be added after declaration.
+
+        With --compact-slots, each field has only a value slot, and the class
+        is marked with a _compact_slots_ attribute.
         """
         with self.block('__slots__ =', delim=('[', ']')):
             for field in data_type.fields:
                 field_name = fmt_var(field.name)
                 self.emit("'_%s_value'," % field_name)
-                self.emit("'_%s_present'," % field_name)
+                if not self.args.compact_slots:
+                    self.emit("'_%s_present'," % field_name)
         self.emit()
+        if self.args.compact_slots:
+            self.emit('_compact_slots_ = True')
+            self.emit()
 
     def _generate_struct_class_has_required_fields(self, data_type):
         has_required_fields = len(data_type.all_required_fields) > 0
@@ -310,9 +342,11 @@ class PythonTypesGenerator(CodeGenerator):
 
     def _generate_struct_class_reflection_attributes(self, ns, data_type):
         """
-        Generates two class attributes:
+        Generates three class attributes:
           * _all_field_names_: Set of all field names including inherited fields.
           * _all_fields_: List of tuples, where each tuple is (name, validator).
+          * _required_fields_: Tuple of the names of the fields, including
+            inherited ones, that have no default and aren't nullable.
 
         If a struct has enumerated subtypes, then two additional attributes are
         generated:
@@ -404,6 +438,16 @@ class PythonTypesGenerator(CodeGenerator):
             self.generate_multiline_list(
                 items, before=before, delim=('[', ']'), compact=False)
 
+        required_fields = ["'%s'" % fmt_var(field.name)
+                           for field in data_type.all_required_fields]
+        if len(required_fields) == 1:
+            # A tuple of one item needs a trailing comma.
+            required_fields[0] += ','
+        self.generate_multiline_list(
+            required_fields,
+            before='{}._required_fields_ = '.format(class_name),
+            compact=False)
+
         self.emit()
 
     def _generate_struct_class_init(self, data_type):
@@ -433,8 +477,13 @@ class PythonTypesGenerator(CodeGenerator):
             # initialize each field
             for field in data_type.fields:
                 field_var_name = fmt_var(field.name)
-                self.emit('self._{}_value = None'.format(field_var_name))
-                self.emit('self._{}_present = False'.format(field_var_name))
+                if self.args.compact_slots:
+                    self.emit('self._{}_value = bb.ABSENT'.format(
+                        field_var_name))
+                else:
+                    self.emit('self._{}_value = None'.format(field_var_name))
+                    self.emit('self._{}_present = False'.format(
+                        field_var_name))
 
             # handle arguments that were set
             for field in data_type.fields:
@@ -447,6 +496,29 @@ class PythonTypesGenerator(CodeGenerator):
                 self.emit('pass')
             self.emit()
 
+    def _generate_struct_class_from_rows(self, data_type):
+        """
+        Generates a class method that creates instances in bulk from rows of
+        field values. Subtypes inherit it from the root of their hierarchy.
+        """
+        if data_type.parent_type:
+            return
+        self.emit('@classmethod')
+        self.emit('def from_rows(cls, field_names, rows, validate=True):')
+        with self.indent():
+            self.emit('"""')
+            self.emit_wrapped_text(
+                'Creates an instance per row, where each row is a sequence '
+                'of the values of the fields named by field_names. The '
+                'values of each field are validated together if validate '
+                'is set. See stone_base.structs_from_rows().')
+            self.emit()
+            self.emit(':rtype: list')
+            self.emit('"""')
+            self.emit('return bb.structs_from_rows(cls, field_names, rows, '
+                      'validate)')
+        self.emit()
+
     def _generate_python_value(self, ns, value):
         if is_tag_ref(value):
             ref = '{}.{}'.format(
@@ -487,10 +559,23 @@ class PythonTypesGenerator(CodeGenerator):
                 self.emit(':rtype: {}'.format(
                     self._python_type_mapping(ns, field_dt)))
                 self.emit('"""')
-                self.emit('if self._{}_present:'.format(field_name))
-                with self.indent():
-                    self.emit('return self._{}_value'.format(field_name))
-
+                if self.args.compact_slots:
+                    self.emit('val = self._{}_value'.format(field_name))
+                    self.emit('if val is not bb.ABSENT:')
+                    with self.indent():
+                        self.emit('return val')
+                else:
+                    self.emit('if self._{}_present:'.format(field_name))
+                    with self.indent():
+                        self.emit('return self._{}_value'.format(field_name))
+                    # Fields of lazily decoded structs are pending until
+                    # they're read. See json_decode() in stone_serializers.
+                    self.emit('elif self._{}_present is not False:'.format(
+                        field_name))
+                    with self.indent():
+                        self.emit(
+                            "return self._{0}_present.load(self, '{0}')"
+                            .format(field_name))
                 self.emit('else:')
                 with self.indent():
                     if dt_nullable:
@@ -520,17 +605,31 @@ class PythonTypesGenerator(CodeGenerator):
                 else:
                     self.emit('val = self._{}_validator.validate(val)'.format(field_name))
                 self.emit('self._{}_value = val'.format(field_name))
-                self.emit('self._{}_present = True'.format(field_name))
+                if not self.args.compact_slots:
+                    self.emit('self._{}_present = True'.format(field_name))
             self.emit()
 
             # generate deleter for field
             self.emit('@{}.deleter'.format(field_name_reserved_check))
             self.emit('def {}(self):'.format(field_name_reserved_check))
             with self.indent():
-                self.emit('self._{}_value = None'.format(field_name))
-                self.emit('self._{}_present = False'.format(field_name))
+                if self.args.compact_slots:
+                    self.emit('self._{}_value = bb.ABSENT'.format(field_name))
+                else:
+                    self.emit('self._{}_value = None'.format(field_name))
+                    self.emit('self._{}_present = False'.format(field_name))
             self.emit()
 
+            if self.args.compact_slots:
+                # Code that reads the presence flags of the default layout,
+                # such as stone_serializers, keeps working.
+                self.emit('@property')
+                self.emit('def _{}_present(self):'.format(field_name))
+                with self.indent():
+                    self.emit('return self._{}_value is not bb.ABSENT'.format(
+                        field_name))
+                self.emit()
+
     def _generate_struct_class_repr(self, data_type):
         """
         Generates something like:
@@ -548,14 +647,32 @@ class PythonTypesGenerator(CodeGenerator):
                 constructor_kwargs_fmt = ', '.join(
                     '{}={{!r}}'.format(fmt_var(f.name, True))
                     for f in data_type.all_fields)
-                self.emit("return '{}({})'.format(".format(
-                    class_name_for_data_type(data_type),
-                    constructor_kwargs_fmt,
-                ))
-                with self.indent():
-                    for f in data_type.all_fields:
-                        self.emit("self._{}_value,".format(fmt_var(f.name)))
-                self.emit(")")
+                if self.args.compact_slots:
+                    # Unset fields are shown as None, like in the default
+                    # layout.
+                    self.emit('values = (')
+                    with self.indent():
+                        for f in data_type.all_fields:
+                            self.emit("self._{}_value,".format(
+                                fmt_var(f.name)))
+                    self.emit(')')
+                    self.emit("return '{}({})'.format(".format(
+                        class_name_for_data_type(data_type),
+                        constructor_kwargs_fmt,
+                    ))
+                    with self.indent():
+                        self.emit('*[None if val is bb.ABSENT else val '
+                                  'for val in values])')
+                else:
+                    self.emit("return '{}({})'.format(".format(
+                        class_name_for_data_type(data_type),
+                        constructor_kwargs_fmt,
+                    ))
+                    with self.indent():
+                        for f in data_type.all_fields:
+                            self.emit("self._{}_value,".format(
+                                fmt_var(f.name)))
+                    self.emit(")")
             else:
                 self.emit("return '%s()'" %
                           class_name_for_data_type(data_type))
@@ -664,6 +781,7 @@ class PythonTypesGenerator(CodeGenerator):
         attribute for the construction of union members of void type.
         """
         lineno = self.lineno
+        self._generate_union_class_slots(data_type)
         if data_type.catch_all_field:
             self.emit("_catch_all = '%s'" % data_type.catch_all_field.name)
         elif not data_type.parent_type:
@@ -680,6 +798,23 @@ class PythonTypesGenerator(CodeGenerator):
         if lineno != self.lineno:
             self.emit()
 
+    def _generate_union_class_slots(self, data_type):
+        """
+        Creates a slots declaration for union classes. The tag slot is
+        declared by bb.Union. Unions with only void tags (symbols) don't have
+        a value slot, which is added by the first union in the hierarchy with
+        a tag that has a value.
+        """
+        parent_type = data_type.parent_type
+        if (_union_has_values(data_type) and
+                not (parent_type and _union_has_values(parent_type))):
+            self.emit("__slots__ = ['_value']")
+            self.emit()
+            self.emit('_has_value_slot_ = True')
+        else:
+            self.emit('__slots__ = []')
+        self.emit()
+
     def _generate_union_class_reflection_attributes(self, ns, data_type):
         """
         Adds a class attribute for each union member assigned to a validator.
@@ -814,6 +949,299 @@ class PythonTypesGenerator(CodeGenerator):
         if lineno != self.lineno:
             self.emit()
 
+    #
+    # JSON Codecs
+    #
+
+    def _generate_struct_json_codec(self, ns, data_type):
+        """
+        Generates functions that convert a struct to and from its
+        JSON-compatible representation, and registers them as the _json_codec_
+        attribute of the class: a tuple of (encoder, decoder, field names).
+
+        stone_serializers passes each function the serializers for the fields
+        in the listed order. A function returns None if it can't handle its
+        input, in which case the generic serializer takes over and reports the
+        error.
+        """
+        class_name = class_name_for_data_type(data_type)
+        # Same order as _all_fields_, which all_fields doesn't preserve.
+        fields = []
+        struct = data_type
+        while struct:
+            fields[:0] = struct.fields
+            struct = struct.parent_type
+
+        self.emit('def _json_encode_{}(obj, d, encoders):'.format(class_name))
+        with self.indent():
+            with self._json_codec_try_block(fields):
+                for i, field in enumerate(fields):
+                    field_name = fmt_var(field.name)
+                    if self.args.compact_slots:
+                        self.emit('if obj._{}_value is not bb.ABSENT:'.format(
+                            field_name))
+                    else:
+                        self.emit('if obj._{}_present:'.format(field_name))
+                    with self.indent():
+                        self._generate_json_encode_value(
+                            field.data_type, i, 'obj._%s_value' % field_name,
+                            "d['%s']" % field_name)
+                    if _is_required_json_field(field):
+                        self.emit('else:')
+                    elif self.args.compact_slots:
+                        continue
+                    else:
+                        # The field of a lazily decoded struct is pending.
+                        self.emit('elif obj._{}_present is not False:'.format(
+                            field_name))
+                    with self.indent():
+                        self.emit('return None')
+            self.emit('return d')
+        self.emit()
+
+        self.emit('def _json_decode_{}(obj, decoders):'.format(class_name))
+        with self.indent():
+            self.emit('ins = {0}.__new__({0})'.format(class_name))
+            with self._json_codec_try_block(fields):
+                for i, field in enumerate(fields):
+                    self._generate_struct_json_decode_field(ns, field, i)
+            self.emit('return ins')
+        self.emit()
+
+        self._generate_json_codec_attribute(
+            class_name, [fmt_var(field.name) for field in fields])
+
+    def _generate_struct_json_decode_field(self, ns, field, index):
+        field_name = fmt_var(field.name)
+        value_attr = 'ins._{}_value'.format(field_name)
+        presence_attr = 'ins._{}_present'.format(field_name)
+        field_dt, nullable, _ = unwrap(field.data_type)
+
+        def emit_presence(present):
+            if not self.args.compact_slots:
+                self.emit('{} = {}'.format(presence_attr, present))
+
+        def emit_absent():
+            if self.args.compact_slots:
+                self.emit('{} = bb.ABSENT'.format(value_attr))
+            else:
+                self.emit('{} = None'.format(value_attr))
+                self.emit('{} = False'.format(presence_attr))
+
+        if nullable:
+            self.emit("val = obj.get('{}')".format(field_name))
+            self.emit('if val is None:')
+            with self.indent():
+                emit_absent()
+            self.emit('else:')
+            with self.indent():
+                self.emit('{} = decoders[{}](val, None)'.format(
+                    value_attr, index))
+                emit_presence(True)
+            return
+
+        self.emit("if '{}' in obj:".format(field_name))
+        with self.indent():
+            if _is_plain_json_type(field_dt):
+                self.emit("{} = decoders[{}](obj['{}'])".format(
+                    value_attr, index, field_name))
+            else:
+                self.emit("{} = decoders[{}](obj['{}'], None)".format(
+                    value_attr, index, field_name))
+            emit_presence(True)
+        self.emit('else:')
+        with self.indent():
+            if field.has_default:
+                # The getter returns the default.
+                emit_absent()
+            elif _is_required_json_field(field):
+                self.emit('return None')
+            else:
+                # A struct without required fields defaults to an empty one.
+                self.emit('{} = {}()'.format(
+                    value_attr, class_name_for_data_type(field_dt, ns)))
+                emit_presence(True)
+
+    def _generate_union_json_codec(self, ns, data_type):
+        """
+        Generates functions that convert a union to and from its
+        JSON-compatible representation. See _generate_struct_json_codec() for
+        how they are registered. The serializers passed to the functions are
+        those of the tags' data types with any Nullable removed. The decoder is
+        also passed a function that makes an instance from a tag and value,
+        after the serializers.
+        """
+        class_name = class_name_for_data_type(data_type)
+        catch_all = data_type.catch_all_field
+        fields = data_type.all_fields
+
+        self.emit('def _json_encode_{}(obj, encoders, dict_type):'.format(
+            class_name))
+        with self.indent():
+            self.emit('tag = obj._tag')
+            self.emit('val = obj._value')
+            with self._json_codec_try_block(fields):
+                for i, field in enumerate(fields):
+                    self._generate_union_json_encode_tag(field, i)
+            self.emit('return None')
+        self.emit()
+
+        # Tags that may be serialized as a plain string.
+        symbols = []
+        self.emit('def _json_decode_{}(obj, decoders):'.format(class_name))
+        with self.indent():
+            with self._json_codec_try_block(fields):
+                self.emit('if isinstance(obj, dict):')
+                with self.indent():
+                    self.emit("tag = obj.get('.tag')")
+                    keyword = 'if'
+                    for i, field in enumerate(fields):
+                        if field is catch_all:
+                            continue
+                        tag = fmt_var(field.name)
+                        field_dt, nullable, _ = unwrap(field.data_type)
+                        if nullable or is_void_type(field_dt):
+                            symbols.append(tag)
+                        self.emit("{} tag == '{}':".format(keyword, tag))
+                        with self.indent():
+                            self._generate_union_json_decode_tag(field, i)
+                        keyword = 'elif'
+                    if keyword == 'if':
+                        self.emit('return None')
+                    else:
+                        self.emit('else:')
+                        with self.indent():
+                            self.emit('return None')
+                if len(symbols) == 1:
+                    self.emit("elif obj == '{}':".format(symbols[0]))
+                elif symbols:
+                    self.generate_multiline_list(
+                        ["'%s'" % tag for tag in symbols],
+                        before='elif obj in ', after=':')
+                if symbols:
+                    with self.indent():
+                        self.emit('tag = obj')
+                        self.emit('val = None')
+                self.emit('else:')
+                with self.indent():
+                    self.emit('return None')
+            self.emit('return decoders[{}](tag, val)'.format(len(fields)))
+        self.emit()
+
+        self._generate_json_codec_attribute(
+            class_name, [fmt_var(field.name) for field in fields])
+
+    def _generate_union_json_encode_tag(self, field, index):
+        tag = fmt_var(field.name)
+        keyword = 'if' if index == 0 else 'elif'
+        self.emit("{} tag == '{}':".format(keyword, tag))
+        with self.indent():
+            field_dt, nullable, _ = unwrap(field.data_type)
+            if is_void_type(field_dt):
+                self.emit("return {{'.tag': '{}'}}".format(tag))
+                return
+            if nullable:
+                self.emit('if val is None:')
+                with self.indent():
+                    self.emit("return {{'.tag': '{}'}}".format(tag))
+            self.emit('d = dict_type()')
+            self.emit("d['.tag'] = '{}'".format(tag))
+            if is_struct_type(field_dt) and not field_dt.has_enumerated_subtypes():
+                # The fields of the struct are placed next to the tag.
+                self.emit('return encoders[{}](val, None, d)'.format(index))
+            else:
+                self._generate_json_encode_value(
+                    field_dt, index, 'val', "d['%s']" % tag)
+                self.emit('return d')
+
+    def _generate_union_json_decode_tag(self, field, index):
+        tag = fmt_var(field.name)
+        field_dt, nullable, _ = unwrap(field.data_type)
+        if is_void_type(field_dt):
+            self.emit('if len(obj) != 1:')
+            with self.indent():
+                self.emit('return None')
+            self.emit('val = None')
+            return
+        if is_struct_type(field_dt) and not field_dt.has_enumerated_subtypes():
+            if nullable:
+                self.emit('if len(obj) == 1:')
+                with self.indent():
+                    self.emit('val = None')
+                self.emit('else:')
+                with self.indent():
+                    self.emit('val = decoders[{}](obj, None)'.format(index))
+            else:
+                self.emit('val = decoders[{}](obj, None)'.format(index))
+            return
+
+        if _is_plain_json_type(field_dt):
+            decode = 'decoders[{}](val)'.format(index)
+        else:
+            decode = 'decoders[{}](val, None)'.format(index)
+        if nullable:
+            self.emit('if len(obj) == 1:')
+            with self.indent():
+                self.emit('val = None')
+            self.emit("elif len(obj) == 2 and '{}' in obj:".format(tag))
+            with self.indent():
+                self.emit("val = obj['{}']".format(tag))
+                self.emit('if val is not None:')
+                with self.indent():
+                    self.emit('val = {}'.format(decode))
+        else:
+            self.emit("if len(obj) == 2 and '{}' in obj:".format(tag))
+            with self.indent():
+                self.emit("val = obj['{}']".format(tag))
+                self.emit('val = {}'.format(decode))
+        self.emit('else:')
+        with self.indent():
+            self.emit('return None')
+
+    def _generate_json_encode_value(self, data_type, index, val, target):
+        """
+        Emits code that assigns the JSON-compatible representation of `val`,
+        which is an already validated value of data_type, to `target`.
+        """
+        data_type, _, _ = unwrap(data_type)
+        if is_integer_type(data_type):
+            if val != 'val':
+                self.emit('val = {}'.format(val))
+            # Booleans are a subclass of int.
+            self.emit('{} = int(val) if isinstance(val, bool) else val'.format(
+                target))
+        elif _is_plain_json_type(data_type):
+            self.emit('{} = {}'.format(target, val))
+        else:
+            self.emit('{} = encoders[{}]({}, None)'.format(
+                target, index, val))
+
+    @contextmanager
+    def _json_codec_try_block(self, fields):
+        """
+        Emits a try block that makes the generated function return None if any
+        value fails validation.
+        """
+        if not fields:
+            yield
+            return
+        self.emit('try:')
+        with self.indent():
+            yield
+        self.emit('except bv.ValidationError:')
+        with self.indent():
+            self.emit('return None')
+
+    def _generate_json_codec_attribute(self, class_name, names):
+        self.generate_multiline_list(
+            ["'%s'" % name for name in names],
+            before='{0}._json_codec_ = (_json_encode_{0}, _json_decode_{0}, '
+                   .format(class_name),
+            after=')',
+            delim=('[', ']'),
+            compact=False)
+        self.emit()
+
     def _generate_routes(self, route_schema, namespace):
 
         for route in namespace.routes:
@@ -843,6 +1271,38 @@ class PythonTypesGenerator(CodeGenerator):
         self.emit()
 
 
+def _is_plain_json_type(data_type):
+    """
+    Returns whether values of data_type are represented as is in JSON, and
+    are decoded by only validating them.
+    """
+    data_type, _ = unwrap_aliases(data_type)
+    return (is_string_type(data_type) or is_boolean_type(data_type) or
+            is_integer_type(data_type) or is_float_type(data_type))
+
+
+def _union_has_values(data_type):
+    """
+    Returns whether a union, including the tags it inherits, has a tag that
+    isn't void.
+    """
+    return any(not is_void_type(field.data_type)
+               for field in data_type.all_fields)
+
+
+def _is_required_json_field(field):
+    """
+    Returns whether a struct field must be present in a JSON object. A field
+    without a default of a struct type without required fields is optional,
+    since it defaults to an empty struct.
+    """
+    data_type, nullable, _ = unwrap(field.data_type)
+    if nullable or field.has_default:
+        return False
+    return not (is_struct_type(data_type) and
+                not data_type.all_required_fields)
+
+
 def generate_validator_constructor(ns, data_type):
     """
     Given a Stone data type, returns a string that can be used to construct
@@ -1,13 +1,17 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import array
 import base64
 import datetime
 import imp
 import json
+import pickle
 import shutil
 import six
 import subprocess
 import sys
+import threading
+import time
 import unittest
 
 import stone.target.python_rsrc.stone_validators as bv
@@ -18,6 +22,10 @@ from stone.target.python_rsrc.stone_serializers import (
 )
 
 
+def compact_json_dumps(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
 class TestDropInModules(unittest.TestCase):
     """
     Tests the stone_serializers and stone_validators modules.
@@ -112,6 +120,27 @@ class TestDropInModules(unittest.TestCase):
         # Passes
         b.validate(b'\x00')
 
+    def test_validate_type_only(self):
+        # Constraints are skipped, but types are still checked.
+        s = bv.String(min_length=1, max_length=5, pattern='[A-z]+')
+        self.assertEqual(s.validate_type_only('#' * 6), '#' * 6)
+        self.assertEqual(type(s.validate_type_only('a')), six.text_type)
+        self.assertRaises(bv.ValidationError, lambda: s.validate_type_only(1))
+        i = bv.UInt32(min_value=10, max_value=100)
+        self.assertEqual(i.validate_type_only(-1), -1)
+        self.assertRaises(bv.ValidationError,
+                          lambda: i.validate_type_only(1.4))
+        f = bv.Float64(min_value=0, max_value=100)
+        self.assertEqual(f.validate_type_only(1000), 1000.0)
+        self.assertRaises(bv.ValidationError,
+                          lambda: f.validate_type_only('1'))
+        b = bv.Bytes(min_length=1, max_length=10)
+        self.assertEqual(b.validate_type_only(b''), b'')
+        self.assertRaises(bv.ValidationError,
+                          lambda: b.validate_type_only(u'asdf'))
+        self.assertRaises(bv.ValidationError,
+                          lambda: bv.Boolean().validate_type_only(1))
+
     def test_timestamp_validator(self):
         class UTC(datetime.tzinfo):
             def utcoffset(self, dt):
@@ -150,6 +179,52 @@ class TestDropInModules(unittest.TestCase):
         # Passes
         l.validate(['a'])
 
+    def test_numeric_list_validator(self):
+        from stone.target.python_rsrc.stone_serializers import (
+            json_compat_obj_decode,
+            json_compat_obj_encode,
+        )
+        ints = bv.List(bv.UInt32())
+        reals = bv.List(bv.Float32())
+        # Items that fail validation are reported as if they were validated
+        # one by one.
+        for data_type, val, error in [
+                (ints, [1, 2**32], '4294967296 is not within range [0, 4294967295]'),
+                (ints, [1, -1], '-1 is not within range [0, 4294967295]'),
+                (ints, [1, 1.0], 'expected integer, got float'),
+                (reals, [1.0, float('nan')], 'nan values are not supported'),
+                (reals, [float('-inf')], '-inf values are not supported'),
+                (reals, [1, 4e38], '%f is not less than %f' % (4e38, 3.40282e38)),
+                (reals, [1, 10**400], 'too large for float'),
+                (reals, ['1'], 'expected real number, got string')]:
+            with self.assertRaises(bv.ValidationError) as cm:
+                data_type.validate(val)
+            self.assertEqual(str(cm.exception), error)
+            for decode in (json_compat_obj_decode, json_compat_obj_encode):
+                self.assertRaises(bv.ValidationError, decode, data_type, val)
+        # Booleans are integers, and integers are converted to floats.
+        self.assertEqual(ints.validate((True, 2)), [True, 2])
+        self.assertEqual(json_compat_obj_encode(ints, [True, 2]), [1, 2])
+        val = reals.validate([1, 2.5])
+        self.assertEqual([type(item) for item in val], [float, float])
+        self.assertEqual(json_compat_obj_encode(reals, [1, 2.5]), [1.0, 2.5])
+        self.assertEqual(json_compat_obj_decode(reals, [1, 2.5]), [1.0, 2.5])
+        # Trusted decoding only checks the types.
+        self.assertEqual(
+            json_compat_obj_decode(ints, [2**40], trusted=True), [2**40])
+        self.assertRaises(bv.ValidationError, json_compat_obj_decode,
+                          ints, [1, 'a'], trusted=True)
+
+    def test_string_items_validator(self):
+        self.assertIsNone(bv.string_items_validator(bv.Int32()))
+        validate = bv.string_items_validator(
+            bv.String(min_length=2, max_length=3, pattern='[a-z]+'))
+        self.assertEqual(validate(('ab', 'abc')), ['ab', 'abc'])
+        # Lists that must be validated one by one, so that the error is
+        # reported for the item.
+        for val in [[], ['ab', 1], ['ab', 'a'], ['ab', 'abcd'], ['ab', 'AB']]:
+            self.assertIsNone(validate(val))
+
     def test_nullable_validator(self):
         n = bv.Nullable(bv.String())
         # Absent case
@@ -180,23 +255,24 @@ class TestDropInModules(unittest.TestCase):
         self.assertRaises(bv.ValidationError, lambda: s.validate(object()))
 
     def test_json_encoder(self):
-        self.assertEqual(json_encode(bv.Void(), None), json.dumps(None))
-        self.assertEqual(json_encode(bv.String(), 'abc'), json.dumps('abc'))
-        self.assertEqual(json_encode(bv.String(), u'\u2650'), json.dumps(u'\u2650'))
-        self.assertEqual(json_encode(bv.UInt32(), 123), json.dumps(123))
+        self.assertEqual(json_encode(bv.Void(), None), compact_json_dumps(None))
+        self.assertEqual(json_encode(bv.String(), 'abc'), compact_json_dumps('abc'))
+        self.assertEqual(json_encode(bv.String(), u'\u2650', backend='json'),
+                         compact_json_dumps(u'\u2650'))
+        self.assertEqual(json_encode(bv.UInt32(), 123), compact_json_dumps(123))
         # Because a bool is a subclass of an int, ensure they aren't mistakenly
         # encoded as a true/false in JSON when an integer is the data type.
-        self.assertEqual(json_encode(bv.UInt32(), True), json.dumps(1))
-        self.assertEqual(json_encode(bv.Boolean(), True), json.dumps(True))
+        self.assertEqual(json_encode(bv.UInt32(), True), compact_json_dumps(1))
+        self.assertEqual(json_encode(bv.Boolean(), True), compact_json_dumps(True))
         f = '%a, %d %b %Y %H:%M:%S +0000'
         now = datetime.datetime.utcnow()
         self.assertEqual(json_encode(bv.Timestamp('%a, %d %b %Y %H:%M:%S +0000'), now),
-                         json.dumps(now.strftime(f)))
+                         compact_json_dumps(now.strftime(f)))
         b = b'\xff' * 5
         self.assertEqual(json_encode(bv.Bytes(), b),
-                         json.dumps(base64.b64encode(b).decode('ascii')))
-        self.assertEqual(json_encode(bv.Nullable(bv.String()), None), json.dumps(None))
-        self.assertEqual(json_encode(bv.Nullable(bv.String()), u'abc'), json.dumps('abc'))
+                         compact_json_dumps(base64.b64encode(b).decode('ascii')))
+        self.assertEqual(json_encode(bv.Nullable(bv.String()), None), compact_json_dumps(None))
+        self.assertEqual(json_encode(bv.Nullable(bv.String()), u'abc'), compact_json_dumps('abc'))
 
     def test_json_encoder_union(self):
         class S(object):
@@ -225,12 +301,12 @@ class TestDropInModules(unittest.TestCase):
         # Test primitive variant
         u = U('a', 64)
         self.assertEqual(json_encode(bv.Union(U), u, old_style=True),
-                         json.dumps({'a': 64}))
+                         compact_json_dumps({'a': 64}))
 
         # Test symbol variant
         u = U('b')
         self.assertEqual(json_encode(bv.Union(U), u, old_style=True),
-                         json.dumps('b'))
+                         compact_json_dumps('b'))
 
         # Test struct variant
         c = S()
@@ -238,7 +314,7 @@ class TestDropInModules(unittest.TestCase):
         c._f_present = True
         u = U('c', c)
         self.assertEqual(json_encode(bv.Union(U), u, old_style=True),
-                         json.dumps({'c': {'f': 'hello'}}))
+                         compact_json_dumps({'c': {'f': 'hello'}}))
 
         # Test list variant
         u = U('d', [1, 2, 3, 'a'])
@@ -247,29 +323,84 @@ class TestDropInModules(unittest.TestCase):
         l = [1, 2, 3, 4]
         u = U('d', [1, 2, 3, 4])
         self.assertEqual(json_encode(bv.Union(U), u, old_style=True),
-                         json.dumps({'d': l}))
+                         compact_json_dumps({'d': l}))
 
         # Test a nullable union
         self.assertEqual(json_encode(bv.Nullable(bv.Union(U)), None),
-                         json.dumps(None))
+                         compact_json_dumps(None))
         self.assertEqual(json_encode(bv.Nullable(bv.Union(U)), u, old_style=True),
-                         json.dumps({'d': l}))
+                         compact_json_dumps({'d': l}))
 
         # Test nullable primitive variant
         u = U('e', None)
         self.assertEqual(json_encode(bv.Nullable(bv.Union(U)), u, old_style=True),
-                         json.dumps('e'))
+                         compact_json_dumps('e'))
         u = U('e', 64)
         self.assertEqual(json_encode(bv.Nullable(bv.Union(U)), u, old_style=True),
-                         json.dumps({'e': 64}))
+                         compact_json_dumps({'e': 64}))
 
         # Test nullable composite variant
         u = U('f', None)
         self.assertEqual(json_encode(bv.Nullable(bv.Union(U)), u, old_style=True),
-                         json.dumps('f'))
+                         compact_json_dumps('f'))
         u = U('f', c)
         self.assertEqual(json_encode(bv.Nullable(bv.Union(U)), u, old_style=True),
-                         json.dumps({'f': {'f': 'hello'}}))
+                         compact_json_dumps({'f': {'f': 'hello'}}))
+
+    def test_json_backends(self):
+        from stone.target.python_rsrc import stone_serializers
+        from stone.target.python_rsrc.stone_serializers import (
+            JsonBackend,
+            get_json_backend,
+            register_json_backend,
+            set_default_json_backend,
+        )
+        # The standard library is always available, and is the default.
+        self.assertEqual(get_json_backend('json').name, 'json')
+        self.assertIs(get_json_backend(), get_json_backend('json'))
+        with self.assertRaises(ValueError):
+            get_json_backend('missing')
+
+        calls = []
+
+        def dumps(obj):
+            calls.append('dumps')
+            return json.dumps(obj, separators=(',', ':'))
+
+        def loads(s):
+            calls.append('loads')
+            return json.loads(s)
+        backend = JsonBackend('test', dumps, loads)
+        register_json_backend(backend)
+        try:
+            self.assertIs(get_json_backend('test'), backend)
+            self.assertIs(get_json_backend(backend), backend)
+
+            self.assertEqual(
+                json_encode(bv.List(bv.UInt32()), [1, 2], backend='test'),
+                '[1,2]')
+            self.assertEqual(
+                json_decode(bv.List(bv.UInt32()), '[1, 2]', backend=backend),
+                [1, 2])
+            self.assertEqual(calls, ['dumps', 'loads'])
+
+            set_default_json_backend('test')
+            self.assertIs(get_json_backend(), backend)
+            json_encode(bv.String(), 'a')
+            self.assertEqual(calls[-1], 'dumps')
+        finally:
+            set_default_json_backend(None)
+            del stone_serializers._json_backends['test']
+        self.assertIs(get_json_backend(), get_json_backend('json'))
+
+        # Values that the faster backends can't serialize are reported as
+        # validation errors.
+        if 'orjson' in stone_serializers._json_backends:
+            with self.assertRaises(bv.ValidationError) as cm:
+                json_encode(bv.String(), '\ud800', backend='orjson')
+            self.assertIn('could not encode as JSON', str(cm.exception))
+        self.assertEqual(json_encode(bv.String(), 'caf\u00e9\ud800'),
+                         '"caf\\u00e9\\ud800"')
 
     def test_json_encoder_error_messages(self):
         class S3(object):
@@ -348,6 +479,13 @@ class TestDropInModules(unittest.TestCase):
         self.assertEqual(json_decode(bv.Nullable(bv.String()), json.dumps(None)), None)
         self.assertEqual(json_decode(bv.Nullable(bv.String()), json.dumps('abc')), 'abc')
 
+        # List items are validated even without an enclosing struct.
+        self.assertRaises(bv.ValidationError,
+                          lambda: json_decode(bv.List(bv.String()), json.dumps([1])))
+        self.assertRaises(bv.ValidationError,
+                          lambda: json_decode(bv.List(bv.String(), max_items=1),
+                                              json.dumps(['a', 'b'])))
+
         self.assertEqual(json_decode(bv.Void(), json.dumps(None)), None)
         # Check that void can take any input if strict is False.
         self.assertEqual(json_decode(bv.Void(), json.dumps(12345), strict=False), None)
@@ -355,6 +493,79 @@ class TestDropInModules(unittest.TestCase):
         self.assertRaises(bv.ValidationError,
                           lambda: json_decode(bv.Void(), json.dumps(12345), strict=True))
 
+    def test_json_decoder_trusted(self):
+        from stone.target.python_rsrc.stone_serializers import (
+            set_trusted_sample_rate,
+        )
+        data_type = bv.List(bv.String(max_length=1, pattern='[a-z]'),
+                            max_items=1)
+        serialized = json.dumps(['A', 'bc'])
+        self.assertRaises(bv.ValidationError,
+                          lambda: json_decode(data_type, serialized))
+        self.assertEqual(json_decode(data_type, serialized, trusted=True),
+                         ['A', 'bc'])
+        # Types are still checked.
+        self.assertRaises(bv.ValidationError,
+                          lambda: json_decode(data_type, '[1]', trusted=True))
+        self.assertRaises(bv.ValidationError,
+                          lambda: json_decode(bv.UInt32(), '"1"', trusted=True))
+
+        # Sampled input is fully validated, and discrepancies are reported
+        # without failing the decode.
+        discrepancies = []
+
+        def report(data_type, error):
+            discrepancies.append((data_type, str(error)))
+        set_trusted_sample_rate(1, report)
+        try:
+            self.assertEqual(json_decode(data_type, serialized, trusted=True),
+                             ['A', 'bc'])
+            self.assertEqual(json_decode(data_type, '["a"]', trusted=True),
+                             ['a'])
+            self.assertRaises(bv.ValidationError,
+                              lambda: json_decode(data_type, '[1]', trusted=True))
+        finally:
+            set_trusted_sample_rate(0)
+        self.assertEqual(discrepancies, [
+            (data_type, "%r has more than 1 items" % (['A', 'bc'],))])
+        self.assertRaises(ValueError, lambda: set_trusted_sample_rate(2))
+
+    def test_timestamp_codecs(self):
+        formats = [
+            '%Y-%m-%dT%H:%M:%SZ',
+            '%d/%m/%Y %H:%M:%S.%f',
+            '%H:%M %%',
+            # Unsupported directives fall back to strptime() and strftime().
+            '%a, %d %b %Y %H:%M:%S +0000',
+        ]
+        values = [
+            datetime.datetime(2016, 1, 2, 3, 4, 5, 678),
+            datetime.datetime(9999, 12, 31, 23, 59, 59, 999999),
+        ]
+        for f in formats:
+            t = bv.Timestamp(f)
+            for value in values:
+                serialized = json_encode(t, value)
+                self.assertEqual(serialized, json.dumps(value.strftime(f)))
+                self.assertEqual(json_decode(t, serialized),
+                                 datetime.datetime.strptime(value.strftime(f), f))
+
+        # Input that isn't zero-padded is still accepted, like by strptime(),
+        # and errors are the same.
+        t = bv.Timestamp('%Y-%m-%dT%H:%M:%SZ')
+        self.assertEqual(json_decode(t, json.dumps('2016-1-2T3:04:05Z')),
+                         datetime.datetime(2016, 1, 2, 3, 4, 5))
+        for s in ['2016-13-02T03:04:05Z', '2016-02-30T03:04:05Z',
+                  '+016-01-02T03:04:05Z', '2016-01-02 03:04:05']:
+            with self.assertRaises(bv.ValidationError) as cm:
+                json_decode(t, json.dumps(s))
+            try:
+                datetime.datetime.strptime(s, t.format)
+            except ValueError as e:
+                self.assertEqual(str(cm.exception), e.args[0])
+            else:
+                self.fail('%r was parsed' % s)
+
     def test_json_decoder_struct(self):
         class S(object):
             _all_field_names_ = {'f', 'g'}
@@ -619,6 +830,25 @@ struct ContainsAlias
 
 struct S3
     u ns2.BaseU = z
+
+union_closed Color
+    red
+    green
+
+union_closed ColorOrHex extends Color
+    hex String
+
+struct Node
+    name String
+    children List(Node)?
+    next Node?
+    op Op?
+
+union_closed Op
+    leaf
+    neg Node
+    pair List(Node)?
+    nested Op
 """
 
 test_ns2_spec = """\
@@ -638,6 +868,9 @@ alias AliasedBaseU = BaseU
 
 class TestGeneratedPython(unittest.TestCase):
 
+    # Arguments for the Python types generator.
+    generator_args = []
+
     def setUp(self):
 
         # Sanity check: stone must be importable for the compiler to work
@@ -650,7 +883,8 @@ class TestGeneratedPython(unittest.TestCase):
              'stone.cli',
              'python_types',
              'output',
-             '-'],
+             '-',
+             '--'] + self.generator_args,
             stdin=subprocess.PIPE,
             stderr=subprocess.PIPE)
         _, stderr = p.communicate(
@@ -660,10 +894,16 @@ class TestGeneratedPython(unittest.TestCase):
                                  stderr.decode('utf-8'))
 
         sys.path.append('output')
+        # Modules generated for another set of arguments may have been
+        # imported already.
+        for name in ('ns', 'ns2', 'stone_base', 'stone_serializers',
+                     'stone_validators'):
+            sys.modules.pop(name, None)
         self.ns2 = __import__('ns2')
         self.ns = __import__('ns')
         self.sv = __import__('stone_validators')
         self.ss = __import__('stone_serializers')
+        self.bb = __import__('stone_base')
         self.encode = self.ss.json_encode
         self.compat_obj_encode = self.ss.json_compat_obj_encode
         self.decode = self.ss.json_decode
@@ -1029,7 +1269,7 @@ class TestGeneratedPython(unittest.TestCase):
         v = self.encode(
             self.sv.List(self.sv.Struct(self.ns.S)),
             [self.ns.S('Test')])
-        self.assertEqual(v, json.dumps([{'f': 'Test'}]))
+        self.assertEqual(v, compact_json_dumps([{'f': 'Test'}]))
 
     def test_objs(self):
 
@@ -1046,6 +1286,58 @@ class TestGeneratedPython(unittest.TestCase):
         # Test that non-void union member is callable (should be a method)
         self.assertTrue(callable(self.ns.U.t1))
 
+    def test_union_decoding_shared_instances(self):
+        data_type = self.sv.Union(self.ns.V)
+        for s in ('"t0"', '{".tag":"t0"}'):
+            self.assertIs(self.decode(data_type, s), self.ns.V.t0)
+        self.assertIs(self.decode(data_type, '"t0"', old_style=True),
+                      self.ns.V.t0)
+        self.assertIs(
+            self.ss.binary_decode(
+                data_type, self.ss.binary_encode(data_type, self.ns.V.t0)),
+            self.ns.V.t0)
+        # Tags with a value of None share an instance too.
+        v = self.decode(data_type, '{".tag":"t2"}')
+        self.assertIsNone(v.get_t2())
+        self.assertIs(self.decode(data_type, '"t2"'), v)
+        # Instances hold the tag strings of the class.
+        v = self.decode(data_type, json.dumps({'.tag': 't1', 't1': 'a'}))
+        self.assertIs(v._tag, [tag for tag in self.ns.V._tagmap
+                               if tag == 't1'][0])
+        # The class attributes for the tags of the parent are instances of the
+        # parent.
+        data_type = self.sv.Union(self.ns.ColorOrHex)
+        red = self.decode(data_type, '"red"')
+        self.assertIsInstance(red, self.ns.ColorOrHex)
+        self.assertIs(self.decode(data_type, '{".tag":"red"}'), red)
+
+    def test_union_slots(self):
+        # Unions with only void tags don't have a value slot.
+        self.assertEqual(self.ns.Color.__slots__, [])
+        self.assertEqual(self.ns.ColorOrHex.__slots__, ['_value'])
+        self.assertEqual(self.ns.U2.__slots__, ['_value'])
+        red = self.ns.Color.red
+        self.assertFalse(hasattr(red, '__dict__'))
+        self.assertIsNone(red._value)
+        with self.assertRaises(AttributeError):
+            red._value = 'x'
+        self.assertEqual(repr(red), "Color('red', None)")
+        self.assertEqual(self.ns.U.t0._value, None)
+        self.assertFalse(hasattr(self.ns.U.t1('a'), '__dict__'))
+        self.assertEqual(self.ns.ColorOrHex.red._value, None)
+        self.assertEqual(self.ns.ColorOrHex.hex('#fff').get_hex(), '#fff')
+
+        data_type = self.sv.Union(self.ns.ColorOrHex)
+        for s in ('{".tag":"green"}', '{".tag":"hex","hex":"#000"}'):
+            u = self.decode(data_type, s)
+            self.assertEqual(self.encode(data_type, u), s)
+        u = self.decode(self.sv.Union(self.ns.Color), '{".tag":"red"}')
+        self.assertTrue(u.is_red())
+        for u in (u, self.ns.ColorOrHex.hex('#fff')):
+            for protocol in range(3):
+                unpickled = pickle.loads(pickle.dumps(u, protocol))
+                self.assertEqual(repr(unpickled), repr(u))
+
     def test_struct_enumerated_subtypes_encoding(self):
         # Test serializing a leaf struct from  the root struct
         fi = self.ns.File(name='test.doc', size=100)
@@ -1166,6 +1458,86 @@ class TestGeneratedPython(unittest.TestCase):
         u2 = msgpack_decode(self.sv.String(), s)
         self.assertEqual(u, u2)
 
+        # Bytes use the bin type, and strings the str type.
+        self.assertEqual(s, b'\xa3\xe2\x99\x90')
+        self.assertEqual(msgpack_encode(self.sv.Bytes(), bs), b'\xc4\x02\x00\x01')
+        with self.assertRaises(self.sv.ValidationError):
+            msgpack_decode(self.sv.Bytes(), msgpack_encode(self.sv.String(), 'a'))
+        with self.assertRaises(self.sv.ValidationError):
+            msgpack_decode(self.sv.String(), b'\xa1\xff')
+
+        # Bytes are decoded from buffers without being copied.
+        s = bytearray(msgpack_encode(self.sv.Struct(self.ns.B), b))
+        for buf in (s, memoryview(s)):
+            b2 = msgpack_decode(self.sv.Struct(self.ns.B), buf)
+            self.assertEqual(b2.a, 'hi')
+            self.assertEqual(bytes(b2.c), b'\x00\x01')
+            if six.PY3:
+                self.assertIsInstance(b2.c, memoryview)
+                self.assertIs(b2.c.obj, s)
+        for buf in (s[:-1], s + b'\x00'):
+            with self.assertRaises(self.sv.ValidationError):
+                msgpack_decode(self.sv.Struct(self.ns.B), buf)
+
+        # Maps with keys other than strings are rejected, whatever the input.
+        for s in (b'\x81\x91\x00\x00', b'\x81\xc4\x01a\x00', b'\x81\x01\x00',
+                  b'\x91\x81\xc0\x00'):
+            for buf in (s, bytearray(s), memoryview(s)):
+                with self.assertRaises(self.sv.ValidationError) as cm:
+                    msgpack_decode(self.sv.Struct(self.ns.B), buf)
+                self.assertEqual(str(cm.exception),
+                                 'could not decode input as msgpack')
+
+    def test_json_attachments(self):
+        data_type = self.sv.List(self.sv.Struct(self.ns.B))
+        big = b'\x00\x01' * 8
+        objs = [self.ns.B(a='hi', b=1, c=big),
+                self.ns.B(a='hi', b=2, c=b'\x02'),
+                self.ns.B(a='hi', b=3, c=big[1:])]
+        s, attachments = self.ss.json_encode_with_attachments(
+            data_type, objs, threshold=8)
+        # Values below the threshold stay inline.
+        self.assertEqual(
+            [o['c'] for o in json.loads(s)],
+            [{'.attachment': 0}, 'Ag==', {'.attachment': 1}])
+        self.assertEqual([a.tobytes() for a in attachments], [big, big[1:]])
+        self.assertIsInstance(attachments[0], memoryview)
+        self.assertIs(attachments[0].obj, big)
+
+        # Attachments are resolved without being copied.
+        received = [bytearray(a) for a in attachments]
+        decoded = self.ss.json_decode_with_attachments(data_type, s, received)
+        self.assertEqual(
+            [decoded[0].c.tobytes(), decoded[1].c, decoded[2].c.tobytes()],
+            [big, b'\x02', big[1:]])
+        self.assertIsInstance(decoded[0].c, memoryview)
+        self.assertIs(decoded[0].c.obj, received[0])
+        self.assertIsInstance(decoded[1].c, bytes)
+
+        # Without attachments, everything is inline.
+        self.assertEqual(self.ss.json_encode(data_type, objs),
+                         self.ss.json_encode_with_attachments(
+                             data_type, objs, threshold=1000)[0])
+        bad_refs = ['{".attachment": 2}', '{".attachment": "0"}',
+                    '{".attachment": 0, "x": 1}']
+        for ref in bad_refs:
+            with self.assertRaises(self.sv.ValidationError):
+                self.ss.json_decode_with_attachments(
+                    self.sv.Bytes(), ref, received)
+        with self.assertRaises(self.sv.ValidationError):
+            self.ss.json_decode(self.sv.Bytes(), '{".attachment": 0}')
+
+        # Attachments are collected once for structs whose generated encoder,
+        # if any, gives up on a pending field.
+        data_type = self.sv.Struct(self.ns.C)
+        c = self.decode(data_type, self.encode(
+            data_type, self.ns.C(a='x', b=1, c=big, d=1.5)), lazy=True)
+        self.assertEqual((c.a, c.b, c.c), ('x', 1, big))
+        s, attachments = self.ss.json_encode_with_attachments(
+            data_type, c, threshold=8)
+        self.assertEqual(json.loads(s)['c'], {'.attachment': 0})
+        self.assertEqual([a.tobytes() for a in attachments], [big])
+
     def test_alias_validators(self):
 
         def aliased_string_validator(val):
@@ -1214,3 +1586,1093 @@ class TestGeneratedPython(unittest.TestCase):
     def test_struct_union_default(self):
         s = self.ns.S3()
         assert s.u == self.ns2.BaseU.z
+
+    def test_encoder_plans(self):
+        # Plans for structs and unions are shared by all validators of the
+        # same generated class.
+        self.assertIs(
+            self.ss._get_encoder(self.sv.Struct(self.ns.D), False, False),
+            self.ss._get_encoder(self.sv.Struct(self.ns.D), False, False))
+        self.assertIsNot(
+            self.ss._get_encoder(self.sv.Struct(self.ns.D), False, False),
+            self.ss._get_encoder(self.sv.Struct(self.ns.D), True, False))
+
+        # A failing plan must not leave a partial entry behind.
+        class Unsupported(object):
+            pass
+        class Bad(object):
+            _all_fields_ = [('x', Unsupported())]
+        with self.assertRaises(AssertionError):
+            self.compat_obj_encode(self.sv.Struct(Bad), Bad())
+        with self.assertRaises(AssertionError):
+            self.compat_obj_encode(self.sv.Struct(Bad), Bad())
+
+        d = self.ns.D(a='A', b=1, d=[1, None])
+        self.assertEqual(
+            self.encode(self.sv.Struct(self.ns.D), d),
+            compact_json_dumps({'a': 'A', 'b': 1, 'd': [1, None]}))
+        v = self.ns.V.t10([self.ns.U.t0, self.ns.U.t1('a')])
+        self.assertEqual(
+            self.compat_obj_encode(self.sv.Union(self.ns.V), v, old_style=True),
+            {'t10': ['t0', {'t1': 'a'}]})
+
+    def test_decoder_plans(self):
+        self.assertIs(
+            self.ss._get_decoder(self.sv.Struct(self.ns.D), True, False, False),
+            self.ss._get_decoder(self.sv.Struct(self.ns.D), True, False, False))
+        self.assertIsNot(
+            self.ss._get_decoder(self.sv.Struct(self.ns.D), True, False, False),
+            self.ss._get_decoder(self.sv.Struct(self.ns.D), False, False, False))
+
+        # Decoded values are normalized like the property setters would.
+        c = self.compat_obj_decode(
+            self.sv.Struct(self.ns.C), {'a': 'a', 'b': 1, 'c': '', 'd': 1})
+        self.assertIsInstance(c.d, float)
+        self.assertTrue(c._d_present)
+
+        # Nested list items are validated by the decoder.
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.compat_obj_decode(
+                self.sv.Struct(self.ns.D), {'a': 'A', 'd': ['x']})
+        self.assertEqual("d: expected integer, got string", str(cm.exception))
+
+        # Unions are constructed without revalidating their values.
+        v = self.compat_obj_decode(
+            self.sv.Union(self.ns.V), {'.tag': 't9', 't9': ['a', 'b']})
+        self.assertIsInstance(v, self.ns.V)
+        self.assertEqual(v.get_t9(), ['a', 'b'])
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.compat_obj_decode(
+                self.sv.Union(self.ns.V), {'.tag': 't9', 't9': [1]})
+        self.assertEqual("t9: '1' expected to be a string, got integer",
+                         str(cm.exception))
+
+    def run_during_compilation(self, compile_name, func):
+        """
+        Calls func in two threads: one that compiles the plans it needs, and
+        one that starts while the members of the first user-defined type that
+        the other compiles with the ss function named compile_name are being
+        compiled. Returns their results.
+        """
+        compile_user_defined = getattr(self.ss, compile_name)
+        compiling = threading.Event()
+
+        def compile_slowly(*args):
+            plan, compile_members = compile_user_defined(*args)
+
+            def compile_members_slowly():
+                if not compiling.is_set():
+                    compiling.set()
+                    time.sleep(0.1)
+                compile_members()
+            return plan, compile_members_slowly
+        setattr(self.ss, compile_name, compile_slowly)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(func()))
+        try:
+            thread.start()
+            compiling.wait()
+            results.append(func())
+        finally:
+            thread.join()
+            setattr(self.ss, compile_name, compile_user_defined)
+        return results
+
+    def test_concurrent_compilation(self):
+        # Threads that need a plan that another is compiling wait for it to
+        # be complete.
+        v = self.ns.V.t3(self.ns.S(f='s'))
+        self.assertEqual(
+            self.run_during_compilation(
+                '_compile_user_defined_encoder',
+                lambda: self.encode(self.sv.Union(self.ns.V), v)),
+            [compact_json_dumps({'.tag': 't3', 'f': 's'})] * 2)
+        node_type = self.sv.Struct(self.ns.Node)
+        node = self.make_node(3)
+        results = self.run_during_compilation(
+            '_compile_user_defined_encoder',
+            lambda: self.compat_obj_encode(node_type, node))
+        self.assertEqual(results, [self.compat_obj_encode(node_type, node)] * 2)
+
+        s2_list = self.run_during_compilation(
+            '_compile_user_defined_decoder',
+            lambda: self.compat_obj_decode(self.sv.Struct(self.ns.S2), {}))
+        self.assertEqual([s2.f1.f2 for s2 in s2_list], [3, 3])
+
+        def decode_node():
+            try:
+                self.compat_obj_decode(node_type, {'name': 'a', 'next': {}})
+            except self.sv.ValidationError as e:
+                return str(e)
+        self.assertEqual(
+            self.run_during_compilation(
+                '_compile_user_defined_decoder', decode_node),
+            ["next: missing required field 'name'"] * 2)
+
+    def test_json_encode_to(self):
+        d = self.ns.D(a='A', c='C', d=[1, None, 3])
+        v = self.ns.V.t10([self.ns.U.t0, self.ns.U.t1('a')])
+        r = self.ns.V.t7(self.ns.File(name='f', size=1))
+        c = self.ns.C(a='a', b=1, c=b'\x00' * 100, d=1.5)
+        for data_type, obj in ((self.sv.Struct(self.ns.D), d),
+                               (self.sv.Union(self.ns.V), v),
+                               (self.sv.Union(self.ns.V), r),
+                               (self.sv.Struct(self.ns.C), c),
+                               (self.sv.List(self.sv.Struct(self.ns.D)), [d] * 3),
+                               (self.sv.Bytes(), b'')):
+            for old_style in (False, True):
+                expected = self.encode(data_type, obj, old_style=old_style)
+                chunks = list(self.ss.json_encode_chunks(
+                    data_type, obj, old_style=old_style, chunk_size=1))
+                self.assertTrue(all(isinstance(chunk, bytes)
+                                    for chunk in chunks))
+                self.assertEqual(b''.join(chunks).decode('utf-8'), expected)
+
+                stream = six.StringIO()
+                self.ss.json_encode_to(stream, data_type, obj,
+                                       old_style=old_style)
+                self.assertEqual(stream.getvalue(), expected)
+                stream = six.BytesIO()
+                self.ss.json_encode_to(stream, data_type, obj,
+                                       old_style=old_style)
+                self.assertEqual(stream.getvalue().decode('utf-8'), expected)
+
+        # Bytes are base64-encoded piece by piece.
+        chunks = list(self.ss.json_encode_chunks(
+            self.sv.Struct(self.ns.C), c, chunk_size=1))
+        self.assertGreater(len(chunks), 3)
+
+        # The object is validated before any chunks are produced, its values
+        # as they are reached.
+        with self.assertRaises(self.sv.ValidationError):
+            self.ss.json_encode_chunks(self.sv.Struct(self.ns.D), v)
+        d.d.append('x')
+        chunks = self.ss.json_encode_chunks(self.sv.Struct(self.ns.D), d)
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            list(chunks)
+        self.assertEqual(str(cm.exception),
+                         "d: expected integer, got string")
+
+    def test_json_list_decoder(self):
+        ds = [self.ns.D(a='a%d' % i, d=[i, None]) for i in range(3)]
+        data_type = self.sv.List(self.sv.Struct(self.ns.D))
+        serialized = self.encode(data_type, ds)
+        for chunk_size in (1, 5, len(serialized)):
+            chunks = [serialized[i:i + chunk_size].encode('utf-8')
+                      for i in range(0, len(serialized), chunk_size)]
+            decoded = list(self.ss.json_decode_items(data_type, chunks))
+            self.assertEqual([repr(d) for d in decoded],
+                             [repr(d) for d in ds])
+
+        # Items are returned as soon as they are complete.
+        decoder = self.ss.JsonListDecoder(
+            self.sv.Struct(self.ns.D), 'd', strict=False)
+        self.assertEqual(decoder.feed('{"a": "x", "d": [1, 2'), [1])
+        self.assertEqual(decoder.feed('3, null]'), [23, None])
+        self.assertEqual(decoder.feed(', "b": 5, "z": 1}'), [])
+        d = decoder.close()
+        self.assertEqual((d.a, d.b), ('x', 5))
+        self.assertFalse(d._d_present)
+
+        # Large items fed in small chunks are joined once complete, and
+        # escapes and numbers may be split across chunks.
+        ds = [self.ns.D(a='x\\"\u00e9' * 50, b=12345, d=[67890, None])] * 2
+        serialized = self.encode(data_type, ds)
+        decoder = self.ss.JsonListDecoder(data_type)
+        decoded = []
+        for i, c in enumerate(serialized):
+            decoded.extend(decoder.feed(c))
+            if i == len(serialized) // 4:
+                self.assertGreater(len(decoder._pending), 100)
+        decoder.close()
+        self.assertEqual([repr(d) for d in decoded], [repr(d) for d in ds])
+
+        for serialized, error in (
+                ('[{"a": "x", "d": []}, {"a": 1, "d": []}]',
+                 "a: '1' expected to be a string, got integer"),
+                ('{"a": "x"}', 'expected list, got dict'),
+                ('[{"a": "x", "d": []}', 'could not decode input as JSON'),
+                ('[] []', 'could not decode input as JSON')):
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                list(self.ss.json_decode_items(data_type, [serialized]))
+            self.assertEqual(str(cm.exception), error)
+        for serialized, error in (
+                ('{"a": "x", "d": ["y"]}', 'd: expected integer, got string'),
+                ('{"a": "x", "d": [], "z": 1}', "unknown field 'z'"),
+                ('{"a": "x"}', "missing required field 'd'"),
+                ('{"d": []}', "missing required field 'a'")):
+            decoder = self.ss.JsonListDecoder(self.sv.Struct(self.ns.D), 'd')
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                decoder.feed(serialized)
+                decoder.close()
+            self.assertEqual(str(cm.exception), error)
+
+    def test_json_encode_many(self):
+        data_type = self.sv.Struct(self.ns.D)
+        ds = [self.ns.D(a='a%d' % i, d=[i, None]) for i in range(5)]
+        serialized = [self.encode(data_type, d) for d in ds]
+        for kwargs in ({}, {'parallel_threshold': 2, 'max_workers': 2}):
+            self.assertEqual(
+                list(self.ss.json_encode_many(data_type, iter(ds), **kwargs)),
+                serialized)
+            self.assertEqual(
+                [repr(d) for d in self.ss.json_decode_many(
+                    data_type, serialized, **kwargs)],
+                [repr(d) for d in ds])
+
+            # Results before the failing item are returned, and its index is
+            # reported.
+            bad_d = self.ns.D(a='x', d=[])
+            bad_d.d.append('y')
+            bad = ds[:2] + [bad_d] + ds[2:]
+            results = []
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                for result in self.ss.json_encode_many(
+                        data_type, bad, **kwargs):
+                    results.append(result)
+            self.assertEqual(results, serialized[:2])
+            self.assertEqual(str(cm.exception),
+                             "[2].d: expected integer, got string")
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                list(self.ss.json_decode_many(
+                    data_type, serialized[:3] + ['{'], **kwargs))
+            self.assertEqual(str(cm.exception),
+                             '[3]: could not decode input as JSON')
+
+        # Unregistered backends can be used in the calling process.
+        backend = self.ss.JsonBackend(
+            'unregistered', compact_json_dumps, json.loads)
+        self.assertEqual(
+            list(self.ss.json_encode_many(data_type, ds, backend=backend)),
+            serialized)
+        self.assertEqual(
+            [repr(d) for d in self.ss.json_decode_many(
+                data_type, serialized, backend=backend)],
+            [repr(d) for d in ds])
+
+    def test_required_fields(self):
+        self.assertEqual(self.ns.C._required_fields_, ('a', 'b', 'c', 'd'))
+        self.assertEqual(self.ns.D._required_fields_, ('a', 'd'))
+        self.assertEqual(self.ns.E._required_fields_, ())
+        self.assertEqual(self.ns.S2._required_fields_, ('f1',))
+
+        data_type = self.sv.Struct(self.ns.D)
+        data_type.validate(self.ns.D(a='x', d=[]))
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            data_type.validate(self.ns.D(d=[]))
+        self.assertEqual(str(cm.exception), "missing required field 'a'")
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            data_type.validate(self.ns.D(a='x'))
+        self.assertEqual(str(cm.exception), "missing required field 'd'")
+        self.sv.Struct(self.ns.E).validate(self.ns.E())
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.sv.Struct(self.ns.S2).validate(self.ns.S2())
+        self.assertEqual(str(cm.exception), "missing required field 'f1'")
+
+        # Pending fields of lazily decoded structs count as present, and
+        # aren't decoded by the check.
+        d = self.decode(data_type, '{"a":"x","d":[1]}', lazy=True)
+        data_type.validate(d)
+        if not getattr(self.ns.D, '_compact_slots_', False):
+            self.assertFalse(d._d_present)
+
+    def test_validated_lists(self):
+        import copy
+        data_type = self.sv.Struct(self.ns.D)
+        d = self.ns.D(a='x', d=[1, 2])
+        self.assertIs(type(d.d), self.sv.ValidatedList)
+        self.assertEqual(d.d, [1, 2])
+        # Lists that haven't changed since they were validated aren't
+        # validated again.
+        list.append(d.d, 's')
+        self.assertEqual(self.compat_obj_encode(data_type, d)['d'],
+                         [1, 2, 's'])
+        list.pop(d.d)
+
+        # Lists that changed are.
+        for mutate in [lambda lst: lst.append('s'),
+                       lambda lst: lst.extend(['s']),
+                       lambda lst: lst.insert(0, 's'),
+                       lambda lst: lst.__setitem__(0, 's'),
+                       lambda lst: lst.__setitem__(slice(0, 1), ['s']),
+                       lambda lst: lst.__iadd__(['s'])]:
+            d.d = [1, 2]
+            mutate(d.d)
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                self.compat_obj_encode(data_type, d)
+            self.assertEqual(str(cm.exception),
+                             'd: expected integer, got string')
+        d.d = [1, 2]
+        d.d.pop()
+        d.d.append(3)
+        self.assertIsNone(d.d._validator)
+        self.assertEqual(self.encode(data_type, d), '{"a":"x","d":[1,3]}')
+        self.assertIsNot(d.d._validator, None)
+
+        for lst in (copy.copy(d.d), pickle.loads(pickle.dumps(d.d)),
+                    d.d[:], d.d + []):
+            self.assertIs(type(lst), list)
+            self.assertEqual(lst, [1, 3])
+
+    def test_decode_into(self):
+        data_type = self.sv.Struct(self.ns.D)
+        d = self.ns.D(a='x', b=1, c='c', d=[1])
+        self.assertIs(self.ss.json_compat_obj_decode_into(
+            data_type, {'a': 'y', 'd': []}, d), d)
+        self.assertEqual(repr(d), repr(self.ns.D(a='y', d=[])))
+        self.assertEqual(d.b, 10)
+        self.assertIsNone(d.c)
+        self.assertIs(self.ss.json_decode_into(
+            data_type, '{"a":"z","c":"c","d":[null]}', d), d)
+        self.assertEqual(self.compat_obj_encode(data_type, d),
+                         {'a': 'z', 'c': 'c', 'd': [None]})
+        for obj, error in [
+                ({'a': 'x', 'd': [], 'z': 1}, "unknown field 'z'"),
+                ({'d': []}, "missing required field 'a'"),
+                ({'a': 'x', 'd': ['s']}, 'd: expected integer, got string')]:
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                self.ss.json_compat_obj_decode_into(data_type, obj, d)
+            self.assertEqual(str(cm.exception), error)
+        with self.assertRaises(AssertionError):
+            self.ss.json_compat_obj_decode_into(
+                data_type, {}, self.ns.E())
+
+        # Nested structs are decoded into as well.
+        data_type = self.sv.Struct(self.ns.S2)
+        s2 = self.compat_obj_decode(data_type, {'f1': {'f1': 'a'}})
+        optional_s = s2.f1
+        self.ss.json_compat_obj_decode_into(
+            data_type, {'f1': {'f2': 5}}, s2)
+        self.assertIs(s2.f1, optional_s)
+        self.assertEqual(optional_s.f1, 'hello')
+        self.assertEqual(optional_s.f2, 5)
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.ss.json_compat_obj_decode_into(
+                data_type, {'f1': {'f2': 'x'}}, s2)
+        self.assertEqual(str(cm.exception), 'f1.f2: expected integer, got string')
+
+        # Instances are reused through a pool.
+        pool = self.ss.StructPool(self.sv.Struct(self.ns.D), max_size=1)
+        d = pool.decode({'a': 'x', 'd': []})
+        pool.release(d)
+        pool.release(self.ns.D())
+        self.assertIs(pool.decode({'a': 'y', 'd': [1]}), d)
+        self.assertEqual(d.a, 'y')
+        with self.assertRaises(self.sv.ValidationError):
+            pool.decode({'d': []})
+        self.assertIsNot(pool.decode({'a': 'z', 'd': []}), d)
+
+    def test_columnar_decoding(self):
+        data_type = self.sv.List(self.sv.Struct(self.ns.E))
+        columns = self.ss.json_decode_columns(
+            data_type, '[{"b":1,"c":-2},{"a":"x","c":null},{}]', ['a', 'b', 'c'])
+        self.assertEqual(sorted(columns), ['a', 'b', 'c'])
+        self.assertEqual(columns['a'], (['test', 'x', 'test'], None))
+        b = columns['b']
+        self.assertIsInstance(b.values, array.array)
+        self.assertEqual(list(b.values), [1, 10, 10])
+        self.assertIsNone(b.nulls)
+        c = columns['c']
+        self.assertEqual(list(c.values), [-2, 0, 0])
+        self.assertEqual(list(c.nulls), [0, 1, 1])
+        self.assertEqual(
+            self.ss.json_compat_obj_decode_columns(data_type, [], ['c']),
+            {'c': (array.array(c.values.typecode), array.array('B'))})
+
+        # Reals have the values that json_decode() returns.
+        class R(object):
+            _all_field_names_ = {'r'}
+            _all_fields_ = [('r', self.sv.Float32())]
+        columns = self.ss.json_compat_obj_decode_columns(
+            self.sv.List(self.sv.Struct(R)), [{'r': 0.1}], ['r'])
+        self.assertEqual(list(columns['r'].values), [0.1])
+
+        # Only the fields that are decoded are validated.
+        data_type = self.sv.List(self.sv.Struct(self.ns.D))
+        obj = [{'a': 'x', 'd': ['s']}, {'a': 'y', 'b': 2, 'c': 'c', 'd': []}]
+        columns = self.ss.json_compat_obj_decode_columns(
+            data_type, obj, ['b', 'c'])
+        self.assertEqual(list(columns['b'].values), [10, 2])
+        self.assertEqual(columns['c'], ([None, 'c'], array.array('B', [1, 0])))
+        for obj, error in [
+                ({}, 'expected list, got dict'),
+                ([{'a': 'x', 'd': [], 'z': 1}], "unknown field 'z'"),
+                ([{'d': []}], "missing required field 'a'"),
+                ([{'a': 'x', 'b': -1, 'd': []}],
+                 'b: -1 is not within range [0, 18446744073709551615]'),
+                ([{'a': 'x', 'b': 's', 'd': []}],
+                 'b: expected integer, got string')]:
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                self.ss.json_compat_obj_decode_columns(data_type, obj, ['b'])
+            self.assertEqual(str(cm.exception), error)
+        with self.assertRaises(AssertionError):
+            self.ss.json_compat_obj_decode_columns(
+                self.sv.Struct(self.ns.D), [], ['b'])
+        with self.assertRaises(AssertionError):
+            self.ss.json_compat_obj_decode_columns(data_type, [], ['z'])
+
+    def test_from_rows(self):
+        rows = [('x', 1, None, [1, None]), ('y', None, 'c', [])]
+        field_names = ['a', 'b', 'c', 'd']
+        ds = self.ns.D.from_rows(field_names, rows)
+        self.assertEqual([repr(d) for d in ds],
+                         [repr(self.ns.D(**dict(zip(field_names, row))))
+                          for row in rows])
+        self.assertEqual(ds[1].b, 10)
+        self.assertIsNone(ds[0].c)
+        self.assertEqual(self.ns.D.from_rows(['a'], []), [])
+
+        # Fields that aren't named are unset, and subtypes inherit the
+        # method.
+        cs = self.ns.C.from_rows(['d', 'a'], [(1.5, 'x')])
+        self.assertEqual(repr(cs[0]), repr(self.ns.C(a='x', d=1.5)))
+        with self.assertRaises(AttributeError):
+            cs[0].b
+        self.assertEqual(self.ns.E.from_rows(['c'], [(2,)])[0].a, 'test')
+
+        # Values are validated a field at a time, unless validate is false.
+        for rows, error in [
+                ([('x', 1), ('y', -1)],
+                 'b: -1 is not within range [0, 18446744073709551615]'),
+                ([('x', 1), (2, 1)], "a: '2' expected to be a string, got integer"),
+                ([('x', 1, 2)], None)]:
+            with self.assertRaises(
+                    ValueError if error is None else self.sv.ValidationError) as cm:
+                self.ns.D.from_rows(['a', 'b'], rows)
+            if error is not None:
+                self.assertEqual(str(cm.exception), error)
+        self.assertEqual(
+            self.ns.D.from_rows(['b'], [(-1,)], validate=False)[0].b, -1)
+        with self.assertRaises(self.sv.ValidationError):
+            self.ns.S2.from_rows(['f1'], [(self.ns.D(),)])
+        with self.assertRaises(AssertionError):
+            self.ns.D.from_rows(['z'], [])
+
+    def make_node(self, depth):
+        """
+        Returns a Node that nests depth others, through each of the ways that
+        a Node can refer to another in turn.
+        """
+        node = self.ns.Node(name='leaf')
+        for i in range(depth):
+            name = 'n%d' % i
+            if i % 4 == 0:
+                node = self.ns.Node(name=name, next=node)
+            elif i % 4 == 1:
+                node = self.ns.Node(
+                    name=name, children=[self.ns.Node(name='c'), node])
+            elif i % 4 == 2:
+                node = self.ns.Node(name=name, op=self.ns.Op.neg(node))
+            else:
+                node = self.ns.Node(name=name, op=self.ns.Op.nested(
+                    self.ns.Op.pair([node])))
+        return node
+
+    def test_iterative_codecs(self):
+        node_type = self.sv.Struct(self.ns.Node)
+
+        def outcome(func, *args, **kwargs):
+            try:
+                return repr(func(*args, **kwargs))
+            except self.sv.ValidationError as e:
+                return 'error: %s' % e
+
+        # Results and errors are the same as for recursive encoding and
+        # decoding, including the order of keys.
+        cases = self.round_trip_cases() + [
+            (node_type, self.make_node(21)),
+            (self.sv.Union(self.ns.Op), self.ns.Op.pair(None)),
+            (node_type, self.ns.Node(name='a', next=self.ns.Node())),
+            (self.sv.List(node_type), [self.ns.Node(name='a'), None]),
+        ]
+        for data_type, obj in cases:
+            for old_style in (False, True):
+                encoded = outcome(self.ss.json_encode, data_type, obj,
+                                  old_style=old_style)
+                self.assertEqual(
+                    outcome(self.ss.json_encode, data_type, obj,
+                            old_style=old_style, iterative=True),
+                    encoded)
+                if encoded.startswith('error'):
+                    continue
+                serialized = self.encode(data_type, obj, old_style=old_style)
+                self.assertEqual(
+                    outcome(self.decode, data_type, serialized,
+                            old_style=old_style, iterative=True),
+                    outcome(self.decode, data_type, serialized,
+                            old_style=old_style))
+        self.assertEqual(
+            outcome(self.compat_obj_encode, node_type,
+                    self.ns.Node(name='a', next=self.ns.Node()),
+                    iterative=True),
+            "error: next: missing required field 'name'")
+
+        for obj in [
+                {'name': 'a', 'next': {'name': 1}},
+                {'name': 'a', 'children': [
+                    {'name': 'b'}, {'name': 'c', 'op': {'.tag': 'neg'}}]},
+                {'name': 'a', 'op': {'.tag': 'nested', 'nested': {
+                    '.tag': 'pair', 'pair': [{'name': 'b', 'z': 1}]}}},
+                {'name': 'a', 'op': {'.tag': 'pair', 'pair': [], 'x': 1}},
+                {'name': 'a', 'op': {'.tag': 'pair', 'pair': None}},
+                {'name': 'a', 'op': 'neg'},
+                {'name': 'a', 'op': {'neg': {'name': 'b', 'next': 1}}}]:
+            for strict in (False, True):
+                for old_style in (False, True):
+                    self.assertEqual(
+                        outcome(self.compat_obj_decode, node_type, obj,
+                                strict=strict, old_style=old_style,
+                                iterative=True),
+                        outcome(self.compat_obj_decode, node_type, obj,
+                                strict=strict, old_style=old_style))
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.compat_obj_decode(node_type, {'name': 'a', 'op': {
+                '.tag': 'nested', 'nested': {'.tag': 'neg', 'name': 'b',
+                                             'children': [{'name': 2}]}}},
+                                   iterative=True)
+        self.assertEqual(
+            str(cm.exception),
+            "op.nested.neg.children.name: '2' expected to be a string, "
+            "got integer")
+
+        # Alias validators are applied at any depth.
+        def validate_name(name):
+            if name == 'bad':
+                raise self.sv.ValidationError('bad name')
+        alias_validators = {self.ns.Node._name_validator: validate_name}
+        obj = self.ns.Node(name='a', next=self.ns.Node(
+            name='b', op=self.ns.Op.neg(self.ns.Node(name='bad'))))
+        for func, arg in [
+                (self.compat_obj_encode, obj),
+                (self.compat_obj_decode, self.compat_obj_encode(node_type, obj))]:
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                func(node_type, arg, alias_validators, iterative=True)
+            self.assertEqual(str(cm.exception), 'next.op.neg.name: bad name')
+
+        # Values nested beyond the recursion limit.
+        depth = sys.getrecursionlimit() * 2
+        node = self.make_node(depth)
+        with self.assertRaises(RuntimeError):
+            self.compat_obj_encode(node_type, node)
+        for old_style in (False, True):
+            encoded = self.compat_obj_encode(
+                node_type, node, old_style=old_style, iterative=True)
+            with self.assertRaises(RuntimeError):
+                self.compat_obj_decode(node_type, encoded, old_style=old_style)
+            decoded = self.compat_obj_decode(
+                node_type, encoded, old_style=old_style, iterative=True)
+            names = []
+            while decoded.name != 'leaf':
+                names.append(decoded.name)
+                if decoded.next is not None:
+                    decoded = decoded.next
+                elif decoded.children is not None:
+                    decoded = decoded.children[1]
+                elif decoded.op.is_neg():
+                    decoded = decoded.op.get_neg()
+                else:
+                    decoded = decoded.op.get_nested().get_pair()[0]
+            self.assertEqual(names, ['n%d' % i for i in reversed(range(depth))])
+
+        with self.assertRaises(AssertionError):
+            self.compat_obj_decode(node_type, {'name': 'a'}, lazy=True,
+                                   iterative=True)
+
+    def test_field_masks(self):
+        data_type = self.sv.Struct(self.ns.D)
+        d = self.ns.D(a='x', b=1, d=[2])
+        self.assertEqual(self.compat_obj_encode(data_type, d, field_mask=['b']),
+                         {'b': 1})
+        self.assertEqual(self.encode(data_type, d, field_mask=[]), '{}')
+        # Only the required fields in the mask are checked.
+        self.assertEqual(self.compat_obj_encode(
+            data_type, self.ns.D(c='c'), field_mask=['c']), {'c': 'c'})
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.compat_obj_encode(data_type, self.ns.D(c='c'),
+                                   field_mask=['a', 'c'])
+        self.assertEqual(str(cm.exception), "missing required field 'a'")
+
+        # Fields outside the mask are left unset without being decoded.
+        d = self.compat_obj_decode(
+            data_type, {'a': 'x', 'c': 'c', 'd': ['s']}, field_mask=['c'])
+        self.assertEqual(d.c, 'c')
+        self.assertEqual(d.b, 10)
+        with self.assertRaises(AttributeError):
+            d.a
+        d = self.decode(data_type, '{"d":[1]}', field_mask=['b', 'd'])
+        self.assertEqual((d.b, d.d), (10, [1]))
+        for obj, error in [
+                ({'b': 1, 'd': []}, "missing required field 'a'"),
+                ({'a': 'x', 'd': [], 'z': 1}, "unknown field 'z'"),
+                ({'a': 1, 'd': []}, "a: '1' expected to be a string, got integer")]:
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                self.compat_obj_decode(data_type, obj, field_mask=['a'])
+            self.assertEqual(str(cm.exception), error)
+
+        # Paths go through lists, nullables and the subtypes of structs with
+        # enumerated subtypes.
+        node_type = self.sv.Struct(self.ns.Node)
+        node = self.ns.Node(
+            name='a', op=self.ns.Op.leaf, next=self.ns.Node(name='b'),
+            children=[self.ns.Node(name='c', next=self.ns.Node(name='d'))])
+        field_mask = ['children.name', 'next', 'children.next.name']
+        encoded = {'children': [{'name': 'c', 'next': {'name': 'd'}}],
+                   'next': {'name': 'b'}}
+        self.assertEqual(self.compat_obj_encode(
+            node_type, node, field_mask=field_mask), encoded)
+        self.assertEqual(self.compat_obj_encode(
+            node_type, node, field_mask=['next.name', 'next']), {
+                'next': {'name': 'b'}})
+        decoded = self.compat_obj_decode(
+            node_type, self.compat_obj_encode(node_type, node),
+            field_mask=field_mask)
+        self.assertEqual(self.compat_obj_encode(node_type, decoded, field_mask=[
+            'children', 'next']), encoded)
+        self.assertIsNone(decoded.op)
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.compat_obj_decode(
+                node_type, {'name': 1, 'children': [{'name': 2}]},
+                field_mask=field_mask)
+        self.assertEqual(str(cm.exception),
+                         "children.name: '2' expected to be a string, got integer")
+        resources = self.sv.List(self.sv.StructTree(self.ns.Resource))
+        self.assertEqual(
+            self.compat_obj_encode(
+                resources, [self.ns.File(name='f', size=1),
+                            self.ns.Folder(name='g')],
+                field_mask=['size']),
+            [{'.tag': 'file', 'size': 1}, {'.tag': 'folder'}])
+        files = self.compat_obj_decode(
+            resources, [{'.tag': 'file', 'name': 'f', 'size': 1}],
+            field_mask=['size'])
+        self.assertEqual(files[0].size, 1)
+
+        # Masks are compiled once per data type.
+        self.assertIs(self.ss._get_field_mask(node_type, ['next', 'name']),
+                      self.ss._get_field_mask(node_type, ('name', 'next')))
+        # Masks usually come from clients, so the masks and the plans compiled
+        # for them are kept in caches of bounded size, apart from other plans.
+        plan_count = len(self.ss._encoder_plans[self.ns.Node])
+        for i in range(40):
+            for j in range(40):
+                self.compat_obj_encode(node_type, node, field_mask=[
+                    'next.' * i + 'name', 'children.' * j + 'name'])
+        self.assertEqual(len(self.ss._encoder_plans[self.ns.Node]), plan_count)
+        self.assertEqual(len(self.ss._field_masks), 256)
+        self.assertEqual(len(self.ss._masked_encoder_plans), 1024)
+        self.assertEqual(self.compat_obj_encode(
+            node_type, node, field_mask=field_mask), encoded)
+        for field_mask in ['next.name', ['z'], ['name.z'], ['op.neg']]:
+            with self.assertRaises(AssertionError):
+                self.compat_obj_encode(node_type, node, field_mask=field_mask)
+        with self.assertRaises(AssertionError):
+            self.compat_obj_decode(node_type, {}, field_mask=['name'],
+                                   iterative=True)
+
+    def test_validate(self):
+        def outcome(func, *args, **kwargs):
+            try:
+                func(*args, **kwargs)
+            except self.sv.ValidationError as e:
+                return 'error: %s' % e
+            return 'valid'
+
+        node_type = self.sv.Struct(self.ns.Node)
+        cases = [(data_type, self.compat_obj_encode(data_type, obj))
+                 for data_type, obj in self.round_trip_cases() + [
+                     (node_type, self.make_node(5)),
+                     (self.sv.Union(self.ns.Op), self.ns.Op.pair(None))]]
+        cases += [
+            (self.sv.Struct(self.ns.D), {'a': 'x', 'd': [1, None], 'z': 1}),
+            (self.sv.Struct(self.ns.D), {'a': 1, 'd': []}),
+            (self.sv.Struct(self.ns.D), {'d': ['x']}),
+            (self.sv.Struct(self.ns.D), {'a': 'x'}),
+            (self.sv.Struct(self.ns.D), []),
+            (self.sv.Struct(self.ns.C), {'a': 'x', 'b': 1, 'c': '!', 'd': 1.5}),
+            (self.sv.StructTree(self.ns.Resource),
+             {'.tag': 'file', 'name': 'f'}),
+            (self.sv.StructTree(self.ns.Resource),
+             {'.tag': 'disk', 'name': 'f'}),
+            (self.sv.StructTree(self.ns.ResourceLax),
+             {'.tag': 'disk', 'name': 'f'}),
+            (self.sv.Union(self.ns.V), {'.tag': 't3'}),
+            (self.sv.Union(self.ns.V), {'.tag': 't3', 'f': 1}),
+            (self.sv.Union(self.ns.V), {'.tag': 't4', 'f': 's', 'x': 1}),
+            (self.sv.Union(self.ns.V), {'.tag': 't7', 't7': {'.tag': 'file'}}),
+            (self.sv.Union(self.ns.V), {'t10': ['t0', 'x']}),
+            (self.sv.Union(self.ns.V), {'.tag': 'z'}),
+            (self.sv.Union(self.ns.V), 't3'),
+            (self.sv.List(self.sv.Union(self.ns.U), max_items=1), ['t0', 't0']),
+            (self.sv.List(self.sv.Nullable(self.sv.Struct(self.ns.S))),
+             [None, {'f': 1}]),
+            (node_type, {'name': 'a', 'children': [{'name': 'b'}, {}]}),
+            (node_type, {'name': 'a', 'op': {'.tag': 'nested', 'nested': {
+                '.tag': 'neg', 'name': 'b', 'next': {'name': None}}}}),
+            (node_type, {'name': 'a', 'op': {'neg': {'name': 'b', 'x': 1}}}),
+            (node_type, {'name': 'a', 'op': {'.tag': 'pair', 'pair': [1]}}),
+        ]
+        options = [(strict, old_style) for strict in (False, True)
+                   for old_style in (False, True)]
+
+        # Results are those of decoding, without creating instances of
+        # generated structs and unions.
+        def fail(cls, *args, **kwargs):
+            raise AssertionError('%s was instantiated' % cls.__name__)
+        classes = [self.ns.C, self.ns.D, self.ns.File, self.ns.Folder,
+                   self.ns.File2, self.ns.Folder2, self.ns.ResourceLax,
+                   self.ns.S, self.ns.U, self.ns.V, self.ns.Node, self.ns.Op]
+        for cls in classes:
+            cls.__new__ = fail
+        try:
+            results = [
+                outcome(self.ss.json_compat_obj_validate, data_type, obj,
+                        strict=strict, old_style=old_style)
+                for data_type, obj in cases for strict, old_style in options]
+        finally:
+            for cls in classes:
+                del cls.__new__
+        self.assertEqual(results, [
+            outcome(self.compat_obj_decode, data_type, obj, strict=strict,
+                    old_style=old_style)
+            for data_type, obj in cases for strict, old_style in options])
+        self.assertIn("error: op.nested.neg.next.name: 'None' expected to be "
+                      "a string, got null", results)
+
+        self.assertIsNone(self.ss.json_validate(node_type, '{"name":"a"}'))
+        for serialized, error in [
+                ('{"name":', 'could not decode input as JSON'),
+                ('{"children":[{"name":"a","x":1}]}',
+                 "children: unknown field 'x'")]:
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                self.ss.json_validate(node_type, serialized)
+            self.assertEqual(str(cm.exception), error)
+
+        # Alias validators are applied at any depth.
+        def validate_name(name):
+            if name == 'bad':
+                raise self.sv.ValidationError('bad name')
+        alias_validators = {self.ns.Node._name_validator: validate_name}
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.ss.json_compat_obj_validate(
+                node_type, {'name': 'a', 'op': {'neg': {'name': 'bad'}}},
+                alias_validators, old_style=True)
+        self.assertEqual(str(cm.exception), 'op.neg.name: bad name')
+
+    def test_lazy_decoding(self):
+        data_type = self.sv.Struct(self.ns.D)
+        d = self.decode(data_type, '{"a":"x","d":[1,null]}', lazy=True)
+        self.assertFalse(d._a_present)
+        self.assertEqual(d._a_value, 'x')
+        self.assertEqual(d.a, 'x')
+        self.assertIs(d._a_present, True)
+        self.assertEqual(d.b, 10)
+        self.assertIsNone(d.c)
+        self.assertEqual(d.d, [1, None])
+
+        # Unknown and missing fields are reported up front.
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.decode(data_type, '{"a":"x","d":[],"z":1}', lazy=True)
+        self.assertEqual(str(cm.exception), "unknown field 'z'")
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.decode(data_type, '{"d":[]}', lazy=True)
+        self.assertEqual(str(cm.exception), "missing required field 'a'")
+        d = self.decode(
+            data_type, '{"a":"x","d":[],"z":1}', strict=False, lazy=True)
+        self.assertEqual(d.d, [])
+
+        # Invalid values are reported when they're read, until they're fixed.
+        d = self.decode(data_type, '{"a":"x","d":["s"]}', lazy=True)
+        for _ in range(2):
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                d.d  # pylint: disable=pointless-statement
+            self.assertEqual(str(cm.exception),
+                             'd: expected integer, got string')
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.ss.materialize(d)
+        self.assertEqual(str(cm.exception), 'd: expected integer, got string')
+        d.d = [2]
+        self.assertIs(self.ss.materialize(d), d)
+        self.assertEqual(self.compat_obj_encode(data_type, d),
+                         {'a': 'x', 'd': [2]})
+
+        # Nested structs are decoded lazily as well.
+        v = self.decode(self.sv.Union(self.ns.V), '{".tag":"t4","f":1}',
+                        lazy=True)
+        self.assertFalse(v.get_t4()._f_present)
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.ss.materialize(v)
+        self.assertEqual(str(cm.exception),
+                         "t4.f: '1' expected to be a string, got integer")
+
+        # Alias validators run when the field is read.
+        def aliased_string_validator(val):
+            if ' ' in val:
+                raise self.sv.ValidationError('No spaces allowed')
+        aliased_validators = {
+            self.ns.AliasedString_validator: aliased_string_validator}
+        contains_alias = self.decode(
+            self.sv.Struct(self.ns.ContainsAlias), '{"s":"a b"}',
+            alias_validators=aliased_validators, lazy=True)
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            contains_alias.s  # pylint: disable=pointless-statement
+        self.assertEqual(str(cm.exception), 's: No spaces allowed')
+
+        # Lazily decoded objects are encoded without reading their fields
+        # first.
+        for data_type, obj in self.round_trip_cases():
+            serialized = self.encode(data_type, obj)
+            decoded = self.decode(data_type, serialized, lazy=True)
+            self.assertEqual(
+                self.compat_obj_encode(data_type, decoded),
+                self.compat_obj_encode(data_type, obj))
+            self.assertEqual(repr(self.ss.materialize(decoded)),
+                             repr(self.decode(data_type, serialized)))
+
+        # Pending fields are decoded when objects are pickled.
+        data_type = self.sv.Struct(self.ns.D)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            d = pickle.loads(pickle.dumps(self.decode(
+                data_type, '{"a":"x","d":[1,null]}', lazy=True), protocol))
+            self.assertIs(d._a_present, True)
+            self.assertEqual(repr(d), repr(self.ns.D(a='x', d=[1, None])))
+        v = pickle.loads(pickle.dumps(self.decode(
+            self.sv.Union(self.ns.V), '{".tag":"t4","f":"s"}', lazy=True), 2))
+        self.assertEqual(v.get_t4().f, 's')
+        with self.assertRaises(self.sv.ValidationError):
+            pickle.dumps(self.decode(data_type, '{"a":"x","d":["s"]}',
+                                     lazy=True), 2)
+
+    def test_trusted_decoding(self):
+        data_type = self.sv.Struct(self.ns.ContainsAlias)
+        with self.assertRaises(self.sv.ValidationError):
+            self.decode(data_type, '{"s":"01234567890"}')
+        for lazy in (False, True):
+            obj = self.decode(data_type, '{"s":"01234567890"}', trusted=True,
+                              lazy=lazy)
+            self.assertEqual(obj.s, '01234567890')
+        e = self.decode(self.sv.Struct(self.ns.E), '{"b":-1}', trusted=True)
+        self.assertEqual(e.b, -1)
+
+        # Types, tags and required fields are still checked.
+        for data_type, serialized, error in [
+                (self.sv.Struct(self.ns.ContainsAlias), '{"s":1}',
+                 "s: '1' expected to be a string, got integer"),
+                (self.sv.Struct(self.ns.D), '{"d":[]}',
+                 "missing required field 'a'"),
+                (self.sv.Union(self.ns.U), '"t2"', "unknown tag 't2'"),
+                (self.sv.StructTree(self.ns.Resource),
+                 '{".tag":"link","name":"a"}', "unknown subtype 'link'")]:
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                self.decode(data_type, serialized, trusted=True)
+            self.assertEqual(str(cm.exception), error)
+
+    def round_trip_cases(self):
+        """
+        Returns a list of (data_type, obj) that every serializer must be able
+        to round-trip.
+        """
+        return [
+            (self.sv.Struct(self.ns.C),
+             self.ns.C(a='\u2650', b=-3, c=b'\x00\xff', d=2.5)),
+            (self.sv.Struct(self.ns.D), self.ns.D(a='a', d=[1, None])),
+            (self.sv.Struct(self.ns.E), self.ns.E(b=2**64 - 1)),
+            (self.sv.StructTree(self.ns.Resource),
+             self.ns.File(name='f', size=1)),
+            (self.sv.StructTree(self.ns.Resource), self.ns.Folder(name='g')),
+            (self.sv.Union(self.ns.V), self.ns.V.t0),
+            (self.sv.Union(self.ns.V), self.ns.V.t2(None)),
+            (self.sv.Union(self.ns.V), self.ns.V.t4(self.ns.S(f='s'))),
+            (self.sv.Union(self.ns.V),
+             self.ns.V.t10([self.ns.U.t0, self.ns.U.t1('a')])),
+            (self.sv.List(self.sv.Nullable(
+                self.sv.Timestamp('%Y-%m-%dT%H:%M:%SZ'))),
+             [datetime.datetime(2016, 1, 2, 3, 4, 5), None,
+              datetime.datetime(1900, 1, 1)]),
+            (self.sv.Bytes(), b''),
+        ]
+
+    def test_round_trip(self):
+        serializers = [(self.encode, self.decode),
+                       (self.ss.binary_encode, self.ss.binary_decode)]
+        if hasattr(self.ss, 'msgpack_encode'):
+            serializers.append(
+                (self.ss.msgpack_encode, self.ss.msgpack_decode))
+        for encode, decode in serializers:
+            for data_type, obj in self.round_trip_cases():
+                decoded = decode(data_type, encode(data_type, obj))
+                self.assertIs(type(decoded), type(obj))
+                self.assertEqual(
+                    self.compat_obj_encode(data_type, decoded),
+                    self.compat_obj_encode(data_type, obj))
+
+    def test_binary_encoding(self):
+        # Unlike in JSON, timestamps keep their microseconds.
+        timestamp = self.sv.Timestamp('%Y')
+        now = datetime.datetime(2016, 1, 2, 3, 4, 5, 678)
+        for data_type, obj in self.round_trip_cases() + [(timestamp, now)]:
+            serialized = self.ss.binary_encode(data_type, obj)
+            self.assertIsInstance(serialized, bytes)
+            self.assertEqual(
+                serialized[:8], self.ss.binary_schema_fingerprint(data_type))
+            for buf in (serialized, bytearray(serialized),
+                        memoryview(serialized)):
+                self.assertEqual(
+                    repr(self.ss.binary_decode(data_type, buf)), repr(obj))
+            self.assertEqual(
+                repr(self.ss.binary_decode(
+                    data_type,
+                    self.ss.binary_encode(data_type, obj, fingerprint=False),
+                    fingerprint=False)),
+                repr(obj))
+        # Field names are left out, and nullable fields are omitted when null.
+        self.assertEqual(
+            self.ss.binary_encode(self.sv.Struct(self.ns.D),
+                                  self.ns.D(a='a', d=[1, None]),
+                                  fingerprint=False),
+            b'\x01\x01a\x04\x02\x01\x02\x00\x00')
+
+        d = self.ns.D(a='a', d=[])
+        serialized = self.ss.binary_encode(self.sv.Struct(self.ns.D), d)
+        self.assertNotEqual(
+            self.ss.binary_schema_fingerprint(self.sv.Struct(self.ns.D)),
+            self.ss.binary_schema_fingerprint(self.sv.Struct(self.ns.E)))
+        for data_type, serialized, error in (
+                (self.sv.Struct(self.ns.E), serialized,
+                 'schema fingerprint mismatch'),
+                (self.sv.Struct(self.ns.D), serialized[:-1],
+                 'unexpected end of input'),
+                (self.sv.Struct(self.ns.D), serialized + b'\x00',
+                 'unexpected data after value'),
+                (self.sv.Struct(self.ns.D), serialized[:8] + b'\x09',
+                 'unknown field ordinal 9'),
+                (self.sv.Struct(self.ns.D), serialized[:8] + b'\x00',
+                 "missing required field 'a'"),
+                (self.sv.Struct(self.ns.D), serialized[:8] + b'\x01\x01\xff',
+                 'a: invalid UTF-8 in string')):
+            with self.assertRaises(self.sv.ValidationError) as cm:
+                self.ss.binary_decode(data_type, serialized)
+            self.assertEqual(str(cm.exception), error)
+        d.d.append('x')
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.ss.binary_encode(self.sv.Struct(self.ns.D), d)
+        self.assertEqual(str(cm.exception), 'd: expected integer, got string')
+
+
+class TestGeneratedPythonJsonCodecs(TestGeneratedPython):
+    """
+    Runs the tests for generated Python against modules that were generated
+    with an encoder and a decoder function for each struct and union.
+    """
+
+    generator_args = ['--json-codecs']
+
+    def test_json_codecs(self):
+        self.assertIn('_json_codec_', self.ns.D.__dict__)
+        self.assertIn('_json_codec_', self.ns.V.__dict__)
+        # Codecs aren't inherited, since they construct the class they were
+        # generated for.
+        self.assertIsNot(self.ns.File._json_codec_,
+                         self.ns.Resource._json_codec_)
+
+        d = self.ns.D(a='A', c='C', d=[1, None])
+        self.assertEqual(
+            self.encode(self.sv.Struct(self.ns.D), d),
+            '{"a":"A","c":"C","d":[1,null]}')
+        d = self.decode(self.sv.Struct(self.ns.D),
+                        json.dumps({'a': 'A', 'd': [1, None]}))
+        self.assertEqual(d.a, 'A')
+        self.assertEqual(d.b, 10)
+        self.assertFalse(d._b_present)
+        self.assertIsNone(d.c)
+
+        for obj in ('t0', {'.tag': 't2'}, {'.tag': 't3', 'f': 'F'},
+                    {'.tag': 't4'}, {'.tag': 't5', 't5': {'.tag': 't0'}},
+                    {'.tag': 't7', 't7': {'.tag': 'file', 'name': 'n',
+                                          'size': 1}},
+                    {'.tag': 't10', 't10': [{'.tag': 't1', 't1': 'a'}]}):
+            v = self.compat_obj_decode(self.sv.Union(self.ns.V), obj)
+            self.assertIsInstance(v, self.ns.V)
+            self.assertEqual(
+                self.compat_obj_encode(self.sv.Union(self.ns.V), v),
+                {'.tag': obj} if obj == 't0' else obj)
+
+        # Input that the generated functions can't handle is left to the
+        # generic serializer, which reports errors the same way.
+        self.assertIsNone(self.ns._json_decode_D(
+            {'a': 'A'}, [self.ns.D._a_validator.validate]))
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.compat_obj_decode(self.sv.Struct(self.ns.D), {'a': 'A'})
+        self.assertEqual("missing required field 'd'", str(cm.exception))
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.compat_obj_decode(
+                self.sv.Struct(self.ns.D), {'a': 'A', 'd': ['x']})
+        self.assertEqual("d: expected integer, got string", str(cm.exception))
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.compat_obj_encode(self.sv.Struct(self.ns.D), self.ns.D(a='A'))
+        self.assertEqual("missing required field 'd'", str(cm.exception))
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.compat_obj_decode(self.sv.Union(self.ns.V), {'.tag': 't1'})
+        self.assertEqual("missing 't1' key", str(cm.exception))
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.compat_obj_decode(self.sv.Union(self.ns.V), 'z')
+        self.assertEqual("unknown tag 'z'", str(cm.exception))
+        v = self.compat_obj_decode(
+            self.sv.Union(self.ns.V), {'.tag': 'z'}, strict=False)
+        self.assertTrue(v.is_other())
+
+        # Absent struct fields without required fields default to an empty
+        # struct.
+        s = self.compat_obj_decode(self.sv.Struct(self.ns.S2), {})
+        self.assertEqual(s.f1.f1, 'hello')
+
+
+class TestGeneratedPythonCompactSlots(TestGeneratedPython):
+    """
+    Runs the tests for generated Python against modules whose struct classes
+    were generated with one slot per field.
+    """
+
+    generator_args = ['--compact-slots']
+
+    def test_compact_slots(self):
+        self.assertEqual(self.ns.D.__slots__,
+                         ['_a_value', '_b_value', '_c_value', '_d_value'])
+        d = self.ns.D(a='A', d=[1])
+        self.assertIs(d._b_value, self.bb.ABSENT)
+        self.assertFalse(d._b_present)
+        self.assertTrue(d._a_present)
+        self.assertEqual(d.b, 10)
+        self.assertEqual(repr(d), 'D(a=%r, d=[1], b=None, c=None)' % 'A')
+        del d.a
+        self.assertIs(d._a_value, self.bb.ABSENT)
+        with self.assertRaises(AttributeError):
+            d.a  # pylint: disable=pointless-statement
+
+        c = self.ns.C(a='A', b=1, c=b'c', d=1.5)
+        c2 = pickle.loads(pickle.dumps(c, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(repr(c2), repr(c))
+        for protocol in (2, pickle.HIGHEST_PROTOCOL):
+            d2 = pickle.loads(pickle.dumps(d, protocol))
+            self.assertIs(d2._a_value, self.bb.ABSENT)
+
+    def test_lazy_decoding(self):
+        # Fields of classes with compact slots are always decoded up front.
+        data_type = self.sv.Struct(self.ns.D)
+        d = self.decode(data_type, '{"a":"x","d":[1,null]}', lazy=True)
+        self.assertEqual(d._a_value, 'x')
+        self.assertEqual(d._d_value, [1, None])
+        with self.assertRaises(self.sv.ValidationError) as cm:
+            self.decode(data_type, '{"a":"x","d":["s"]}', lazy=True)
+        self.assertEqual(str(cm.exception), 'd: expected integer, got string')
+
+
+class TestGeneratedPythonCompactSlotsJsonCodecs(TestGeneratedPythonJsonCodecs):
+    """
+    Runs the tests for generated Python against modules that were generated
+    with compact slots and JSON codecs.
+    """
+
+    generator_args = ['--compact-slots', '--json-codecs']
+
+    test_lazy_decoding = TestGeneratedPythonCompactSlots.__dict__[
+        'test_lazy_decoding']